@@ -1,6 +1,9 @@
 import numpy as np
 import itertools
 
+import array_analyzer.extract.constants as constants
+import array_analyzer.utils.kernels as kernels
+
 
 class BackgroundEstimator2D:
     """Estimates flat field image"""
@@ -8,13 +11,22 @@ class BackgroundEstimator2D:
     def __init__(self,
                  block_size=128,
                  order=2,
-                 normalize=True):
+                 normalize=True,
+                 robust=False,
+                 huber_k=1.345,
+                 max_iter=20):
         """
         Background images are estimated once per channel for 2D data
         :param int block_size: Size of blocks image will be divided into
         :param int order: Order of polynomial (default 2)
         :param bool normalize: Normalize surface by dividing by its mean
             for background correction (default True)
+        :param bool robust: Fit polynomial with iteratively reweighted least
+            squares using Huber weights, so blocks on the well edge or on
+            spot clusters don't skew the surface (default False)
+        :param float huber_k: Residuals larger than huber_k times their
+            robust standard deviation are down weighted in robust fits
+        :param int max_iter: Maximum number of reweighting iterations
         """
 
         if block_size is None:
@@ -22,13 +34,23 @@ class BackgroundEstimator2D:
         self.block_size = block_size
         self.order = order
         self.normalize = normalize
+        self.robust = robust
+        self.huber_k = huber_k
+        self.max_iter = max_iter
+        # Pseudo-inverses of polynomial design matrices keyed by order and
+        # sample coordinates, which only depend on the number of blocks
+        self._pinv_cache = {}
 
-    def sample_block_medians(self, im):
+    def sample_block_medians(self, im, exclude=None):
         """Subdivide a 2D image in smaller blocks of size block_size and
         compute the median intensity value for each block. Any incomplete
         blocks (remainders of modulo operation) will be ignored.
+        Excluded pixels aren't part of the medians, and blocks with less than
+        constants.BG_MIN_BLOCK_FRACTION of their pixels left are ignored.
 
         :param np.array im:         2D image
+        :param np.array/None exclude: Boolean mask of pixels to exclude,
+                                      e.g. spots
         :return np.array(float) sample_coords: Image coordinates for block
                                                centers
         :return np.array(float) sample_values: Median intensity values for
@@ -40,21 +62,104 @@ class BackgroundEstimator2D:
 
         nbr_blocks_x = im_shape[0] // self.block_size
         nbr_blocks_y = im_shape[1] // self.block_size
-        sample_coords = np.zeros((nbr_blocks_x * nbr_blocks_y, 2),
-                                 dtype=np.float64)
-        sample_values = np.zeros((nbr_blocks_x * nbr_blocks_y, ),
-                                 dtype=np.float64)
-        for x in range(nbr_blocks_x):
-            for y in range(nbr_blocks_y):
-                idx = y * nbr_blocks_x + x
-                sample_coords[idx, :] = [x * self.block_size + (self.block_size - 1) / 2,
-                                         y * self.block_size + (self.block_size - 1) / 2]
-                sample_values[idx] = np.median(
-                    im[x * self.block_size:(x + 1) * self.block_size,
-                       y * self.block_size:(y + 1) * self.block_size]
-                )
+        # Block (x, y) has index y * nbr_blocks_x + x
+        block_x, block_y = np.meshgrid(
+            np.arange(nbr_blocks_x),
+            np.arange(nbr_blocks_y),
+        )
+        sample_coords = np.stack([block_x.ravel(), block_y.ravel()], axis=1)
+        sample_coords = sample_coords * self.block_size + (self.block_size - 1) / 2
+        if exclude is None:
+            sample_values = kernels.block_medians(im, self.block_size)
+        else:
+            sample_values = kernels.block_medians(
+                im,
+                self.block_size,
+                exclude=exclude,
+                min_count=int(np.ceil(
+                    constants.BG_MIN_BLOCK_FRACTION * self.block_size ** 2,
+                )),
+            )
+            valid = np.isfinite(sample_values)
+            sample_coords = sample_coords[valid]
+            sample_values = sample_values[valid]
         return sample_coords, sample_values
 
+    def _get_exponents(self):
+        """
+        Exponents of the terms of the polynomial: the sum of orders of x, y
+        is at most the order of the polynomial.
+
+        :return list exponents: (m, n) exponents of column and row
+            coordinates per term, (order + 1)*(order + 2)/2 terms
+        """
+        orders = np.arange(self.order + 1)
+        order_pairs = itertools.product(orders, orders)
+        return list(itertools.filterfalse(lambda x: sum(x) > self.order, order_pairs))
+
+    def _get_pinv(self, sample_coords):
+        """
+        Get the pseudo-inverse of the design matrix of the polynomial at the
+        sample coordinates, computed once per order and sample coordinates.
+
+        :param np.array sample_coords: 2D sample coords (nbr of points, 2)
+        :return np.array pinv: Pseudo-inverse of design matrix
+            (nbr of terms, nbr of points)
+        """
+        sample_coords = np.ascontiguousarray(sample_coords, dtype=np.float64)
+        cache_key = (self.order, sample_coords.shape, sample_coords.tobytes())
+        if cache_key not in self._pinv_cache:
+            self._pinv_cache[cache_key] = np.linalg.pinv(
+                self._get_variable_matrix(sample_coords),
+            )
+        return self._pinv_cache[cache_key]
+
+    def _get_variable_matrix(self, sample_coords):
+        """
+        :param np.array sample_coords: 2D sample coords (nbr of points, 2)
+        :return np.array variable_matrix: Design matrix of the polynomial
+            (nbr of points, nbr of terms)
+        """
+        exponents = self._get_exponents()
+        variable_matrix = np.zeros((sample_coords.shape[0], len(exponents)))
+        for idx, (m, n) in enumerate(exponents):
+            variable_matrix[:, idx] = sample_coords[:, 0] ** n * sample_coords[:, 1] ** m
+        return variable_matrix
+
+    def _fit_huber(self, sample_coords, sample_values):
+        """
+        Fit polynomial coefficients by iteratively reweighted least squares
+        with Huber weights. Residuals are scaled by their median absolute
+        deviation, and samples with scaled residuals above huber_k get
+        weights inversely proportional to their residuals.
+
+        :param np.array sample_coords: 2D sample coords (nbr of points, 2)
+        :param np.array sample_values: Corresponding intensity values (nbr points,)
+        :return np.array coeffs: Polynomial coefficients (nbr of terms,)
+        """
+        variable_matrix = self._get_variable_matrix(sample_coords)
+        weights = np.ones(sample_values.shape[0])
+        for i in range(self.max_iter):
+            sqrt_weights = np.sqrt(weights)
+            coeffs, _, _, _ = np.linalg.lstsq(
+                variable_matrix * sqrt_weights[:, np.newaxis],
+                sample_values * sqrt_weights,
+                rcond=None,
+            )
+            residuals = sample_values - variable_matrix @ coeffs
+            # Robust standard deviation of residuals
+            scale = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+            if scale == 0:
+                break
+            new_weights = self.huber_k * scale / np.maximum(
+                np.abs(residuals),
+                self.huber_k * scale,
+            )
+            if np.max(np.abs(new_weights - weights)) < 1e-3:
+                break
+            weights = new_weights
+        return coeffs
+
     def fit_polynomial_surface_2d(self,
                                   sample_coords,
                                   sample_values,
@@ -62,6 +167,10 @@ class BackgroundEstimator2D:
         """
         Given coordinates and corresponding values, this function will fit a
         2D polynomial of given order, then create a surface of given shape.
+        The least squares fit is a product with the cached pseudo-inverse of
+        the design matrix, or a Huber fit if robust. The surface is separable
+        into row and column powers, so it's computed as a product of two
+        small matrices.
 
         :param np.array sample_coords: 2D sample coords (nbr of points, 2)
         :param np.array sample_values: Corresponding intensity values (nbr points,)
@@ -71,41 +180,35 @@ class BackgroundEstimator2D:
         """
         assert (self.order + 1)*(self.order + 2)/2 <= len(sample_values), \
             "Can't fit a higher degree polynomial than there are sampled values"
-        # Number of coefficients is determined by (order + 1)*(order + 2)/2
-        orders = np.arange(self.order + 1)
-        variable_matrix = np.zeros(
-            (sample_coords.shape[0], int((self.order + 1)*(self.order + 2)/2)),
-        )
-        order_pairs = list(itertools.product(orders, orders))
-        # sum of orders of x,y <= order of the polynomial
-        variable_iterator = itertools.filterfalse(lambda x: sum(x) > self.order, order_pairs)
-        for idx, (m, n) in enumerate(variable_iterator):
-            variable_matrix[:, idx] = sample_coords[:, 0] ** n * sample_coords[:, 1] ** m
         # Least squares fit of the points to the polynomial
-        coeffs, _, _, _ = np.linalg.lstsq(variable_matrix, sample_values, rcond=-1)
-        # Create a grid of image (x, y) coordinates
-        x_mesh, y_mesh = np.meshgrid(np.linspace(0, im_shape[1] - 1, im_shape[1]),
-                                     np.linspace(0, im_shape[0] - 1, im_shape[0]))
+        if self.robust:
+            coeffs = self._fit_huber(sample_coords, sample_values)
+        else:
+            coeffs = self._get_pinv(sample_coords) @ sample_values
+        # Coefficients by row and column exponent
+        coeff_matrix = np.zeros((self.order + 1, self.order + 1))
+        for coeff, (m, n) in zip(coeffs, self._get_exponents()):
+            coeff_matrix[n, m] = coeff
+        # Powers of image row and column coordinates
+        orders = np.arange(self.order + 1)
+        row_powers = np.arange(im_shape[0], dtype=np.float64)[:, np.newaxis] ** orders
+        col_powers = np.arange(im_shape[1], dtype=np.float64)[:, np.newaxis] ** orders
         # Reconstruct the surface from the coefficients
-        poly_surface = np.zeros(im_shape, np.float)
-        order_pairs = list(itertools.product(orders, orders))
-        # sum of orders of x,y <= order of the polynomial
-        variable_iterator = itertools.filterfalse(lambda x: sum(x) > self.order, order_pairs)
-        for coeff, (m, n) in zip(coeffs, variable_iterator):
-            poly_surface += coeff * x_mesh ** m * y_mesh ** n
-
+        poly_surface = row_powers @ coeff_matrix @ col_powers.T
         return poly_surface
 
-    def get_background(self, im):
+    def get_background(self, im, exclude=None):
         """
         Combine sampling and polynomial surface fit for background estimation.
         To background correct an image, divide it by background.
 
         :param np.array im: 2D grayscale image
+        :param np.array/None exclude: Boolean mask of pixels excluded from
+            block medians, e.g. spots
         :return np.array background: Background image
         """
         # Get grid of coordinates with median intensity values
-        coords, values = self.sample_block_medians(im=im)
+        coords, values = self.sample_block_medians(im=im, exclude=exclude)
         # Estimate background from grid
         background = self.fit_polynomial_surface_2d(
             sample_coords=coords,
@@ -1,20 +1,36 @@
 """
 The constants.py namespace contains constants used throughout the repo
-    These values are assigned at the start of analysis using the "metadata.MetaData" class
-    Set the values by populating the .xml or .xlsx file as per documentation
+    Runtime arguments are assigned by the CLI at the start of analysis.
+    Values parsed from the .xml or .xlsx metadata file are not stored here,
+    they are collected in a RunContext by the "metadata.MetaData" class
+    which is passed to workflows.
 """
+import os
+
 # === runtime arguments ===
 EXTRACT_OD = None
 ANALYZE_OD = None
-INPUT_FOLDER = None
-OUTPUT_FOLDER = None
 WORKFLOW = None
 METADATA_FILE = None
 DEBUG = None
 LOAD_REPORT = None
+# Debug sampling policy, if all None/False debug plots are written for all wells
+DEBUG_SAMPLING = {
+    'every_nth': None,
+    'fraction': None,
+    'failed': False,
+    'outliers': False,
+}
+# Write plate montages instead of debug plots per well
+DEBUG_MONTAGE = False
+# Background estimation method, 'polynomial' least squares fit to block
+# medians, 'robust' Huber fit to block medians of pixels outside spots or
+# 'annulus' median of a ring around each spot
+BACKGROUND_METHODS = ['polynomial', 'robust', 'annulus']
+BACKGROUND = 'polynomial'
 
-# === constants parsed from metadata ===
-#   the constants below are all dictionaries
+# === default parameters, updated by values parsed from metadata ===
+#   MetaData copies them into the run context
 params = {
     'rows': None,
     'columns': None,
@@ -28,14 +44,18 @@ params = {
     'pixel_size_scienion': 0.0049,
     'pixel_size_octopi': 0.00185,
     'pixel_size': None,
-    'nbr_outliers': 1
+    'nbr_outliers': 1,
+    # Number of wells in plate (96, 384 or 1536)
+    'plate_format': 96,
 }
 
 # a map between Image Name : well (row, col)
 IMAGE_TO_WELL = dict()
-# If there's a sheet in xlsx call 'rerun_wells', only those well names will be run
+# If there's a sheet in xlsx call 'rerun_wells', only those well names will be run.
+# Otherwise a rerun only recomputes wells whose image or parameters changed.
 RERUN = False
-RERUN_WELLS = []
+# Resume an interrupted run, skipping wells that are already done
+RESUME = False
 
 # Column names for dataframe that holds all spot properties
 SPOT_DF_COLS = ['grid_row',
@@ -53,30 +73,9 @@ SPOT_DF_COLS = ['grid_row',
                 'bbox_col_max'
                 ]
 
-# === array-constants ===
-#   the constants below are all np.ndarrays whose elements are "U100" strings
-SPOT_ID_ARRAY = None
-SPOT_TYPE_ARRAY = None
-FIDUCIAL_ARRAY = None
-ANTIGEN_ARRAY = None
-
-# ndarrays representing 96-well plates for each analysis type
-WELL_OD_ARRAY = None
-WELL_INT_ARRAY = None
-WELL_BG_ARRAY = None
-
 # === constants needed for workflows ===
-#   these values are extracted from the above ARRAYs
-
-# list of (column, row) fiducial locations
-FIDUCIALS = []
-
-# list of int fiducial location in array.  Example for 6x6 array: (0,0) = 0, (0,1) = 6, (5,5) = 35
-FIDUCIALS_IDX = []
 
 # values used by point_registration.py
-SPOT_DIST_PIX = int()
-SPOT_DIST_UM = int()
 STDS = [100, 100, 2, .01]  # x, y, angle, scale
 NBR_PARTICLES = 4000
 REG_DIST_THRESH = 100
@@ -84,32 +83,48 @@ MEAN_POINT = (0, 0)
 SCALE_MEAN = 1.
 ANGLE_MEAN = 0.
 
+# Environment variable selecting compute kernels, see utils/kernels.py.
+# Set to 'numpy' to use the reference implementations even if numba is installed
+KERNELS_ENV = 'MULTISERO_KERNELS'
+
+# Robust background: radius of spots excluded from block medians as
+# fraction of spot width, minimum fraction of block pixels outside spots
+# for a block to be used, and crop margin in spot distances
+BG_SPOT_RADIUS = .6
+BG_MIN_BLOCK_FRACTION = .25
+BG_CROP_MARGIN_SPOTS = 2
+# Annulus background: distance of rings from spot edges and ring width
+# as fractions of spot width
+BG_ANNULUS_OFFSET = .1
+BG_ANNULUS_WIDTH = .25
+
 # Requirement of minimum number of detected spots
 MIN_NBR_SPOTS = 5
 # Minimum detected spot percentage of spot ROI area
 SPOT_MIN_PERCENT_AREA = .1
 
-# constants for saving
+# constants for saving, run path is assigned by the CLI
 RUN_PATH = ''
+# Subdirectory of RUN_PATH where well results are cached for reruns
+CACHE_DIR_NAME = 'well_cache'
+# Increment if cached well results are no longer compatible
+CACHE_VERSION = 2
+# Directory where array layouts compiled from metadata are cached,
+# shared by runs. None disables the layout cache
+LAYOUT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'multisero', 'layouts',
+)
+# Increment if cached layouts are no longer compatible
+LAYOUT_CACHE_VERSION = 1
+
+# Default port of the extraction service on localhost
+SERVICE_PORT = 8765
+# Watch mode: time in seconds between polls of the input directory, since
+# last modification before an image is considered fully written, and
+# without new images before watching stops
+WATCH_POLL_INTERVAL = 1.
+WATCH_SETTLE_TIME = 1.
+WATCH_TIMEOUT = 600.
 
 # Logger
 LOG_NAME = 'multisero.log'
-
-# template for writing OD, INT, BG worksheets
-WELL_OUTPUT_TEMPLATE = {'A': {1: None, 2: None, 3: None, 4: None, 5: None, 6: None,
-                              7: None, 8: None, 9: None, 10: None, 11: None, 12: None},
-                        'B': {1: None, 2: None, 3: None, 4: None, 5: None, 6: None,
-                              7: None, 8: None, 9: None, 10: None, 11: None, 12: None},
-                        'C': {1: None, 2: None, 3: None, 4: None, 5: None, 6: None,
-                              7: None, 8: None, 9: None, 10: None, 11: None, 12: None},
-                        'D': {1: None, 2: None, 3: None, 4: None, 5: None, 6: None,
-                              7: None, 8: None, 9: None, 10: None, 11: None, 12: None},
-                        'E': {1: None, 2: None, 3: None, 4: None, 5: None, 6: None,
-                              7: None, 8: None, 9: None, 10: None, 11: None, 12: None},
-                        'F': {1: None, 2: None, 3: None, 4: None, 5: None, 6: None,
-                              7: None, 8: None, 9: None, 10: None, 11: None, 12: None},
-                        'G': {1: None, 2: None, 3: None, 4: None, 5: None, 6: None,
-                              7: None, 8: None, 9: None, 10: None, 11: None, 12: None},
-                        'H': {1: None, 2: None, 3: None, 4: None, 5: None, 6: None,
-                              7: None, 8: None, 9: None, 10: None, 11: None, 12: None}
-                        }
@@ -1,10 +1,8 @@
 import cv2 as cv
 import numpy as np
-import itertools
 import math
 import pandas as pd
 from types import SimpleNamespace
-from scipy import spatial
 
 from skimage.transform import hough_circle, hough_circle_peaks
 from skimage.feature import canny
@@ -71,6 +69,175 @@ def get_well_intensity(image_, mask_):
     return well_int
 
 
+def get_well_intensity_fused(image_,
+                             disk_size=3,
+                             segmethod='otsu'):
+    """
+    Segment the well and compute its median intensity in one pass,
+    equivalent to get_well_mask followed by get_well_intensity.
+    The well is the first connected component larger than 10^5 pixels,
+    and for integer images the median is computed from a histogram of the
+    well pixels instead of gathering and sorting them.
+
+    :param np.array image_: 2D image
+    :param int disk_size: Radius of opening structuring element
+    :param str segmethod: Method for thresh_and_binarize
+    :return float well_int: Median intensity of the well
+    :return np.array well_mask: Boolean mask of the well
+    """
+    well_mask = thresh_and_binarize(image_, method=segmethod, invert=False)
+    # Remove small objects
+    str_elem = disk(disk_size).astype(np.uint8)
+    well_mask = cv.morphologyEx(
+        well_mask.astype(np.uint8),
+        cv.MORPH_OPEN,
+        str_elem,
+    )
+    _, labels, stats, _ = cv.connectedComponentsWithStats(
+        well_mask,
+        connectivity=8,
+    )
+    # Labels are in raster order like measure.label, skip background
+    well_labels = np.flatnonzero(stats[1:, cv.CC_STAT_AREA] > 10 ** 5) + 1
+    # Raises IndexError if there's no well, like get_well_mask
+    well_mask = (labels == well_labels[0]).astype(np.uint8)
+
+    if image_.dtype in (np.uint8, np.uint16):
+        nbr_bins = np.iinfo(image_.dtype).max + 1
+        hist = cv.calcHist([image_], [0], well_mask, [nbr_bins], [0, nbr_bins])
+        cum_hist = np.cumsum(hist.ravel())
+        nbr_pixels = cum_hist[-1]
+        # Middle value(s), averaged for an even number of pixels
+        lower = np.searchsorted(cum_hist, (nbr_pixels - 1) // 2 + 1)
+        upper = np.searchsorted(cum_hist, nbr_pixels // 2 + 1)
+        well_int = (lower + upper) / 2
+    else:
+        well_int = np.median(image_[well_mask.astype(bool)])
+
+    return well_int, well_mask.astype(bool)
+
+
+def fit_circle(points):
+    """
+    Algebraic least squares circle fit (Kasa): solves
+    x^2 + y^2 = a * x + b * y + c for center (a / 2, b / 2) and
+    radius sqrt(c + (a / 2)^2 + (b / 2)^2).
+
+    :param np.array points: Points (row, col) on circle (nbr points x 2)
+    :return np.array center: Circle center (row, col)
+    :return float radius: Circle radius
+    """
+    design = np.hstack([points, np.ones((points.shape[0], 1))])
+    target = np.sum(points ** 2, axis=1)
+    sol, _, _, _ = np.linalg.lstsq(design, target, rcond=None)
+    center = sol[:2] / 2
+    radius = np.sqrt(sol[2] + np.sum(center ** 2))
+    return center, radius
+
+
+def refine_circle(image, center, radius, annulus_width, nbr_angles=180):
+    """
+    Refine a coarse circle estimate at full resolution by sampling the image
+    only along radial rays on an annulus around the coarse border. The border
+    on each ray is where the radial intensity gradient is strongest, and a
+    circle is fit to the border points, rejecting outliers once.
+
+    :param np.array image: 2D image
+    :param np.array center: Coarse circle center (row, col)
+    :param float radius: Coarse circle radius
+    :param float annulus_width: Half width of annulus in pixels
+    :param int nbr_angles: Number of rays
+    :return np.array center: Refined circle center (row, col)
+    :return float radius: Refined circle radius
+    """
+    angles = np.linspace(0, 2 * np.pi, nbr_angles, endpoint=False)
+    radii = np.arange(
+        max(radius - annulus_width, 1),
+        radius + annulus_width,
+        dtype=np.float32,
+    )
+    ray_rows = center[0] + np.outer(np.sin(angles), radii)
+    ray_cols = center[1] + np.outer(np.cos(angles), radii)
+    profiles = cv.remap(
+        image.astype(np.float32),
+        ray_cols.astype(np.float32),
+        ray_rows.astype(np.float32),
+        interpolation=cv.INTER_LINEAR,
+        borderMode=cv.BORDER_REPLICATE,
+    )
+    # Smooth along rays before taking the radial gradient
+    profiles = cv.GaussianBlur(profiles, (5, 1), 0)
+    gradient = np.abs(np.diff(profiles, axis=1))
+    edge_idx = np.argmax(gradient, axis=1)
+    edge_radii = radii[edge_idx] + .5
+    # Remove rays that leave the image
+    inside = (ray_rows.min(axis=1) >= 0) & \
+        (ray_rows.max(axis=1) < image.shape[0]) & \
+        (ray_cols.min(axis=1) >= 0) & \
+        (ray_cols.max(axis=1) < image.shape[1])
+    if np.sum(inside) < 3:
+        return center, radius
+    points = np.stack(
+        [center[0] + np.sin(angles) * edge_radii,
+         center[1] + np.cos(angles) * edge_radii],
+        axis=1,
+    )[inside]
+    center_fit, radius_fit = fit_circle(points)
+    residuals = np.abs(np.linalg.norm(points - center_fit, axis=1) - radius_fit)
+    inliers = residuals <= max(2 * np.median(residuals), 1.)
+    if np.sum(inliers) >= 3:
+        center_fit, radius_fit = fit_circle(points[inliers])
+    return center_fit, radius_fit
+
+
+def find_well_border_fast(image, segmethod='otsu', downsample=4):
+    """
+    Find the well border on a downsampled image, then refine the circle at
+    full resolution on a narrow annulus around the coarse border.
+
+    :param np.array image: 2D image, raw and not inverted
+    :param str segmethod: Threshold method for thresh_and_binarize
+    :param int downsample: Downsampling factor for coarse detection
+    :return list center: Well center [row, col]
+    :return int radius: Half side of the square inscribed in the well
+    :return np.array well_mask: Boolean disk mask of the well
+    """
+    im_small = cv.resize(
+        image,
+        (image.shape[1] // downsample, image.shape[0] // downsample),
+        interpolation=cv.INTER_AREA,
+    )
+    well_mask = thresh_and_binarize(im_small, method=segmethod, invert=False)
+    well_mask = binary_opening(well_mask, disk(max(1, 10 // downsample)))
+    labels = measure.label(well_mask)
+    props = measure.regionprops(labels)
+    props = select_props(
+        props,
+        attribute="area",
+        condition="greater_than",
+        condition_value=10 ** 5 / downsample ** 2,
+    )
+    props = select_props(props, attribute="eccentricity", condition="less_than", condition_value=0.5)
+    # Raises IndexError if no well is found, like the region method
+    center = (np.array(props[0].centroid) + .5) * downsample - .5
+    radius = (props[0].minor_axis_length + props[0].major_axis_length) / 4 * downsample
+    center, radius = refine_circle(
+        image,
+        center,
+        radius,
+        annulus_width=max(3 * downsample, .05 * radius),
+    )
+    well_mask = np.zeros(image.shape, dtype=np.uint8)
+    cv.circle(
+        well_mask,
+        (int(np.rint(center[1])), int(np.rint(center[0]))),
+        int(np.rint(radius)),
+        1,
+        thickness=-1,
+    )
+    return [center[0], center[1]], int(radius / np.sqrt(2)), well_mask.astype(bool)
+
+
 def find_well_border(image, segmethod='bimodal', detmethod='region'):
     """
     finds the border of the well to motivate future cropping around spots
@@ -84,8 +251,13 @@ def find_well_border(image, segmethod='bimodal', detmethod='region'):
         raw image, not inverted
     :param segmethod: str
         'otsu' or 'hough'
+    :param detmethod: str
+        'region', 'hough' or 'fast' (see find_well_border_fast)
     :return: center x, center y, radius of the one hough circle
     """
+    if detmethod == 'fast':
+        return find_well_border_fast(image, segmethod=segmethod)
+
     well_mask = thresh_and_binarize(image, method=segmethod, invert=False)
     # Now remove small objects.
     str_elem_size = 10
@@ -152,6 +324,79 @@ def generate_spot_background(spotmask, distance=3, annulus=5):
     return spot_background
 
 
+def _dilate_disk(im, radius):
+    """
+    Grayscale dilation with disk(radius), decomposed into dilations with one
+    row of the disk each. Rows are fast rectangular dilations, which are
+    shifted to their row offset and combined by maximum.
+
+    :param np.array im: 2D image, e.g. labels
+    :param int radius: Disk radius
+    :return np.array dilated: Dilated image
+    """
+    half_widths = np.sum(disk(radius), axis=1).astype(int) // 2
+    dilated = np.zeros_like(im)
+    nbr_rows = im.shape[0]
+    row_dilations = {}
+    for row_offset, half_width in zip(range(-radius, radius + 1), half_widths):
+        if half_width not in row_dilations:
+            row_dilations[half_width] = cv.dilate(
+                im,
+                np.ones((1, 2 * half_width + 1), dtype=np.uint8),
+            )
+        row_dilation = row_dilations[half_width]
+        if row_offset >= 0:
+            np.maximum(
+                dilated[:nbr_rows - row_offset],
+                row_dilation[row_offset:],
+                out=dilated[:nbr_rows - row_offset],
+            )
+        else:
+            np.maximum(
+                dilated[-row_offset:],
+                row_dilation[:nbr_rows + row_offset],
+                out=dilated[-row_offset:],
+            )
+    return dilated
+
+
+def generate_annulus_labels(spot_labels, distance=3, annulus=5):
+    """
+    Labeled annuli around all spots at once, the labeled equivalent of
+    generate_spot_background. Spot labels are dilated once with the outer
+    disk (see _dilate_disk) within the bounding box of spots padded by the
+    outer radius, and pixels within distance of any spot are removed.
+    Where annuli of neighboring spots overlap, the larger label is kept.
+
+    :param np.array spot_labels: Spot label image, 0 is background
+    :param int distance: Distance from the edge of segmented spots
+    :param int annulus: Width of the annulus
+    :return np.array annulus_labels: Label image of annuli with the labels
+        of their spots, 0 outside annuli
+    """
+    assert spot_labels.max() <= np.iinfo(np.uint16).max, \
+        "Too many spots for uint16 labels"
+    annulus_labels = np.zeros(spot_labels.shape, dtype=np.uint16)
+    spot_rows = np.flatnonzero(np.any(spot_labels > 0, axis=1))
+    spot_cols = np.flatnonzero(np.any(spot_labels > 0, axis=0))
+    if spot_rows.size == 0:
+        return annulus_labels
+    radius = distance + annulus
+    row_min = max(spot_rows[0] - radius, 0)
+    row_max = min(spot_rows[-1] + radius + 1, spot_labels.shape[0])
+    col_min = max(spot_cols[0] - radius, 0)
+    col_max = min(spot_cols[-1] + radius + 1, spot_labels.shape[1])
+    spot_labels = spot_labels[row_min:row_max, col_min:col_max].astype(np.uint16)
+    inner = cv.dilate(
+        (spot_labels > 0).astype(np.uint8),
+        disk(distance, dtype=np.uint8),
+    )
+    outer = _dilate_disk(spot_labels, radius)
+    outer[inner > 0] = 0
+    annulus_labels[row_min:row_max, col_min:col_max] = outer
+    return annulus_labels
+
+
 def generate_props(mask,
                    intensity_image=None,
                    dataframe=False,
@@ -338,130 +583,132 @@ def find_fiducials_markers(props_,
     return cent_map
 
 
+def _circular_mean_phase(values, period):
+    """
+    Mean phase of values on a circle with given period, e.g. the offset of
+    a 1D lattice with given pitch.
+
+    :param np.array values: Values (e.g. coordinates)
+    :param float period: Period (e.g. lattice pitch)
+    :return float phase: Mean phase in [0, period)
+    """
+    angles = 2 * np.pi * values / period
+    phase = np.angle(np.mean(np.exp(1j * angles))) / (2 * np.pi) * period
+    return phase % period
+
+
+def fit_lattice(centroids, n_rows, n_cols, grid_spacing=None, max_residual=.3):
+    """
+    Fit a square lattice of n_rows x n_cols nodes to spot centroids.
+    Pitch and orientation are estimated from all pairwise centroid offsets
+    that are close to the expected spacing: pitch is their median length and
+    orientation the circular mean of four times their angles (the lattice is
+    symmetric under 90 degree rotations). Centroids are then rotated to the
+    lattice axes and assigned to integer lattice indices in one step. The
+    n_rows x n_cols window containing most centroids is selected, and an
+    affine transform from lattice indices to image coordinates is fit by
+    least squares to the centroids close to their nodes.
+
+    :param np.array centroids: Spot centroids (row, col) (nbr spots x 2)
+    :param int n_rows: Number of rows in lattice
+    :param int n_cols: Number of columns in lattice
+    :param float/None grid_spacing: Expected distance between spots in pixels.
+        If None, it's estimated from nearest neighbor distances
+    :param float max_residual: Max distance from centroid to its lattice
+        node, as fraction of pitch, for centroid to be used in the final fit
+    :return np.array coords: Lattice node coordinates (row, col) in row major
+        order (n_rows * n_cols x 2)
+    """
+    centroids = np.asarray(centroids, dtype=np.float64)
+    assert centroids.shape[0] >= 2, "Need at least two centroids to fit grid"
+    offsets = centroids[:, np.newaxis, :] - centroids[np.newaxis, :, :]
+    offsets = offsets.reshape(-1, 2)
+    dists = np.linalg.norm(offsets, axis=1)
+    if grid_spacing is None:
+        dist_mat = dists.reshape(centroids.shape[0], -1)
+        np.fill_diagonal(dist_mat, np.inf)
+        grid_spacing = np.median(np.min(dist_mat, axis=1))
+    # Offsets between neighboring nodes
+    neighbors = (dists > .7 * grid_spacing) & (dists < 1.3 * grid_spacing)
+    if np.any(neighbors):
+        pitch = np.median(dists[neighbors])
+        angles = np.arctan2(offsets[neighbors, 1], offsets[neighbors, 0])
+        angle = np.angle(np.mean(np.exp(4j * angles))) / 4
+    else:
+        pitch = grid_spacing
+        angle = 0.
+    # Rotate centroids to lattice axes
+    cos_a, sin_a = np.cos(angle), np.sin(angle)
+    rot = np.array([[cos_a, sin_a], [-sin_a, cos_a]])
+    lattice_coords = centroids @ rot.T
+    phase = np.array([
+        _circular_mean_phase(lattice_coords[:, 0], pitch),
+        _circular_mean_phase(lattice_coords[:, 1], pitch),
+    ])
+    lattice_idx = np.rint((lattice_coords - phase) / pitch).astype(np.int64)
+    lattice_idx -= lattice_idx.min(axis=0)
+
+    # Count centroids per lattice node, padded so the window can extend past
+    # the detected nodes if edge rows or columns are missing
+    occupancy = np.zeros(
+        (lattice_idx[:, 0].max() + 1 + 2 * n_rows,
+         lattice_idx[:, 1].max() + 1 + 2 * n_cols),
+    )
+    np.add.at(occupancy, (lattice_idx[:, 0] + n_rows, lattice_idx[:, 1] + n_cols), 1)
+    # Number of centroids in every n_rows x n_cols window from integral image
+    integral = np.pad(occupancy.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    window_sums = integral[n_rows:, n_cols:] - integral[:-n_rows, n_cols:] - \
+        integral[n_rows:, :-n_cols] + integral[:-n_rows, :-n_cols]
+    # Break ties by distance between window center and centroid mean
+    centroid_mean = lattice_idx.mean(axis=0) + [n_rows, n_cols]
+    window_rows, window_cols = np.indices(window_sums.shape)
+    center_dist = (window_rows + (n_rows - 1) / 2 - centroid_mean[0]) ** 2 + \
+        (window_cols + (n_cols - 1) / 2 - centroid_mean[1]) ** 2
+    best_idx = np.lexsort((center_dist.ravel(), -window_sums.ravel()))[0]
+    start_row, start_col = np.unravel_index(best_idx, window_sums.shape)
+    lattice_idx = lattice_idx - [start_row - n_rows, start_col - n_cols]
+
+    # Rigid model from pitch, angle and phase, used to reject outliers
+    inside = (lattice_idx[:, 0] >= 0) & (lattice_idx[:, 0] < n_rows) & \
+        (lattice_idx[:, 1] >= 0) & (lattice_idx[:, 1] < n_cols)
+    origin = np.median(
+        lattice_coords[inside] - lattice_idx[inside] * pitch,
+        axis=0,
+    )
+    model = np.vstack([pitch * rot, origin @ rot])
+    design = np.hstack([lattice_idx, np.ones((lattice_idx.shape[0], 1))])
+    residuals = np.linalg.norm(design @ model - centroids, axis=1)
+    inliers = inside & (residuals < max_residual * pitch)
+    # Affine fit if there are enough non collinear inliers
+    if np.linalg.matrix_rank(design[inliers]) == 3:
+        model, _, _, _ = np.linalg.lstsq(design[inliers], centroids[inliers], rcond=None)
+
+    grid_rows, grid_cols = np.meshgrid(
+        np.arange(n_rows),
+        np.arange(n_cols),
+        indexing='ij',
+    )
+    grid_design = np.stack(
+        [grid_rows.ravel(), grid_cols.ravel(), np.ones(n_rows * n_cols)],
+        axis=1,
+    )
+    return grid_design @ model
+
+
 def grid_from_centroids(props_, n_rows, n_cols, grid_spacing=82):
     """
-    based on the region props, creates a dictionary of format:
-        key = (centroid_x, centroid_y)
-        value = region_prop object
+    Fit the spot grid to the centroids of region props, see fit_lattice.
 
     :param props_: list of region props
         approximately 36-48 of these, depending on quality of the image
     :param n_rows: int
     :param n_cols: int
-    :param grid_spacing
-    :return: dict
-        of format (cent_x, cent_y): prop
+    :param grid_spacing: float expected distance between spots in pixels
+    :return: np.array
+        grid (row, col) coordinates in row major order (n_rows * n_cols x 2)
     """
     centroids = np.array([prop.weighted_centroid for prop in props_])
-    bbox_areas = np.array([prop.bbox_area for prop in props_])
-    areas = np.array([prop.area for prop in props_])
-    # calculate mean bbox width for cropping undetected spots
-    bbox_area_mean = np.mean(bbox_areas)
-    area_mean = np.mean(areas)
-    # bbox_width = bbox_height = int(np.sqrt(bbox_area_mean))
-    bbox_width = bbox_height = 2 * int(0.5 * np.sqrt(area_mean / np.pi)) + 1
-
-    y_min_idx = np.argmin(centroids[:, 0])
-    y_min = centroids[y_min_idx, 0]
-    y_max_idx = np.argmax(centroids[:, 0])
-    y_max = centroids[y_max_idx, 0]
-    x_min_idx = np.argmin(centroids[:, 1])
-    x_min = centroids[x_min_idx, 1]
-    x_max_idx = np.argmax(centroids[:, 1])
-    x_max = centroids[x_max_idx, 1]
-
-    margin = 0.05 * grid_spacing
-    y_min_idx = 0
-    y_max_idx = len(props_) - 1
-    x_min_idx = 0
-    x_max_idx = len(props_) - 1
-    y_sort_ids = np.argsort(centroids[:, 0])
-    x_sort_ids = np.argsort(centroids[:, 1])
-    y_spacing = (y_max - y_min) / (n_rows - 1)
-    x_spacing = (x_max - x_min) / (n_cols - 1)
-    # update the x, y bound to match the expected grid_spacing
-    while y_spacing - grid_spacing > margin:
-        y_min_idx_new = y_min_idx + 1
-        y_min_new = centroids[y_sort_ids[y_min_idx_new], 0]
-        y_max_idx_new = y_max_idx - 1
-        y_max_new = centroids[y_sort_ids[y_max_idx_new], 0]
-        if np.abs((y_max - y_min_new) / (n_rows - 1) - grid_spacing) < \
-                np.abs((y_max_new - y_min) / (n_rows - 1) - grid_spacing):
-            y_min_idx = y_min_idx_new
-            y_min = y_min_new
-        else:
-            y_max_idx = y_max_idx_new
-            y_max = y_max_new
-        y_spacing = (y_max - y_min) / (n_rows - 1)
-
-    while x_spacing - grid_spacing > margin:
-        x_min_idx_new = x_min_idx + 1
-        x_min_new = centroids[x_sort_ids[x_min_idx_new], 1]
-        x_max_idx_new = x_max_idx - 1
-        x_max_new = centroids[x_sort_ids[x_max_idx_new], 1]
-        if np.abs((x_max - x_min_new) / (n_cols - 1) - grid_spacing) < \
-                np.abs((x_max_new - x_min) / (n_cols - 1) - grid_spacing):
-            x_min_idx = x_min_idx_new
-            x_min = x_min_new
-        else:
-            x_max_idx = x_max_idx_new
-            x_max = x_max_new
-        x_spacing = (x_max - x_min) / (n_cols - 1)
-    # If apporach 1 fails, try nearest neighbor distance filter to remove spurious spots
-    if grid_spacing - y_spacing > margin or grid_spacing - x_spacing > margin:
-        # y_sort_ids = np.argsort(centroids[:, 0])
-        # x_sort_ids = np.argsort(centroids[:, 1])
-        dist_tree = spatial.cKDTree(centroids)
-        dist, ids = dist_tree.query(centroids, k=2)
-        dist = dist[:, 1]
-        dist_median = np.median(dist)
-        # dist_median = grid_spacing
-        dist_std = 0.8 * dist.std()
-        # if dist_std > 5:
-        if grid_spacing - y_spacing > margin:
-            y_min_idx = 0
-
-            while dist[y_sort_ids[y_min_idx]] > dist_median + dist_std or \
-                    dist[y_sort_ids[y_min_idx]] < dist_median - dist_std:
-                y_min_idx += 1
-                if y_min_idx >= len(props_) - 1:
-                    break
-            y_min = centroids[y_sort_ids[y_min_idx], 0]
-            y_max_idx = len(props_) - 1
-            while dist[y_sort_ids[y_max_idx]] > dist_median + dist_std or \
-                    dist[y_sort_ids[y_max_idx]] < dist_median - dist_std:
-                y_max_idx -= 1
-                if y_max_idx == 0:
-                    break
-            y_max = centroids[y_sort_ids[y_max_idx], 0]
-            y_spacing = (y_max - y_min) / (n_rows - 1)
-
-        if grid_spacing - x_spacing > margin:
-            x_min_idx = 0
-            while dist[x_sort_ids[x_min_idx]] > dist_median + dist_std or \
-                    dist[x_sort_ids[x_min_idx]] < dist_median - dist_std:
-                x_min_idx += 1
-                if x_min_idx >= len(props_) - 1:
-                    break
-            x_min = centroids[x_sort_ids[x_min_idx], 1]
-
-            x_max_idx = len(props_) - 1
-            while dist[x_sort_ids[x_max_idx]] > dist_median + dist_std or \
-                    dist[x_sort_ids[x_max_idx]] < dist_median - dist_std:
-                x_max_idx -= 1
-                if x_max_idx == 0:
-                    break
-            x_max = centroids[x_sort_ids[x_max_idx], 1]
-            x_spacing = (x_max - x_min) / (n_cols - 1)
-    # scaled max-x, max-y
-    y_range = y_max - y_min
-    x_range = x_max - x_min
-    grid_ids = list(itertools.product(range(n_rows), range(n_cols)))
-    coords = np.ndarray((len(grid_ids), 2))
-    for idx, grid_id in enumerate(grid_ids):
-        coords[idx, :] = [grid_id[0]/(n_rows - 1) * y_range + y_min,
-                grid_id[1]/(n_cols - 1) * x_range + x_min]
-    return coords
+    return fit_lattice(centroids, n_rows, n_cols, grid_spacing)
 
 
 def assign_props_to_array(arr, cent_map_):
@@ -117,6 +117,28 @@ def crop_image_from_coords(im, coords, margin=500):
     return im_crop, crop_coords
 
 
+def make_spot_mask(im_shape, coords, radius):
+    """
+    Create a mask of disks around grid coordinates, e.g. to exclude spots
+    from background estimation.
+
+    :param tuple im_shape: Image shape (rows, cols)
+    :param np.array coords: Grid coordinates (nbr points x 2)
+    :param float radius: Radius of disks in pixels
+    :return np.array mask: Boolean mask, True inside disks
+    """
+    mask = np.zeros(im_shape, dtype=np.uint8)
+    for coord in coords:
+        cv.circle(
+            mask,
+            (int(np.round(coord[1])), int(np.round(coord[0]))),
+            int(np.ceil(radius)),
+            1,
+            -1,
+        )
+    return mask.astype(np.bool_)
+
+
 def crop_image_at_center(im, center, height, width):
     """
     Crop the supplied image to include only the well and its spots
@@ -323,20 +345,21 @@ class SpotDetector:
             ignored (to ignore boundary effects)
         :param float im_mean: Set normalized image to fixed mean
         :param float im_std: Set normalized image to fixed std
-        :param int max_intensity: Maximum image intensity (default uint8)
+        :param int max_intensity: Maximum image intensity (default uint8).
+            Scaling cancels in the normalization, so it doesn't affect spots
         :return np.array spot_coords: row, col coordinates of spot centroids
             (nbr spots x 2)
         """
-        # First invert image to detect peaks
-        im_norm = (max_intensity - im) / max_intensity
-        # Filter with Laplacian of Gaussian
-        im_norm = cv.filter2D(im_norm, -1, self.log_filter)
-        # Normalize
-        im_norm = im_norm / im_norm.std() * im_std
-        im_norm = im_norm - im_norm.mean() + im_mean
-        im_norm[im_norm < 0] = 0
-        im_norm[im_norm > 255] = 255
-        im_norm = im_norm.astype(np.uint8)
+        # Filter with Laplacian of Gaussian. The filter sums to one, so
+        # filtering and inverting the image to detect peaks commute
+        im_filtered = cv.filter2D(im, cv.CV_64F, self.log_filter)
+        mean, std = cv.meanStdDev(im_filtered)
+        # Invert and normalize in place
+        im_filtered -= mean[0, 0]
+        im_filtered *= -im_std / std[0, 0]
+        im_filtered += im_mean
+        np.clip(im_filtered, 0, 255, out=im_filtered)
+        im_norm = im_filtered.astype(np.uint8)
 
         # Detect peaks in filtered image
         keypoints = self.blob_detector.detect(im_norm)
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+
+import array_analyzer.extract.constants as constants
+import array_analyzer.load.well_cache as well_cache
+
+# Grid arrays stored in a layout, None for arrays a metadata type doesn't have
+LAYOUT_ARRAYS = [
+    'fiducials_array',
+    'antigen_array',
+    'spot_id_array',
+    'spot_type_array',
+]
+
+
+def hash_metadata(metadata_paths, metadata_extension):
+    """
+    Compute a hash of the metadata files describing a printed array layout,
+    so that plates with the same layout share a cache entry.
+
+    :param list metadata_paths: Paths to metadata files
+    :param str metadata_extension: Metadata type ('xml', 'csv' or 'xlsx')
+    :return str: Hex digest of metadata
+    """
+    layout_hash = hashlib.sha1()
+    layout_hash.update('{}_{}'.format(
+        constants.LAYOUT_CACHE_VERSION,
+        metadata_extension,
+    ).encode('utf-8'))
+    for metadata_path in sorted(metadata_paths):
+        layout_hash.update(well_cache.hash_file(metadata_path).encode('utf-8'))
+    return layout_hash.hexdigest()
+
+
+class LayoutCache:
+    """
+    Cache of array layouts compiled from metadata, one compressed numpy
+    file per layout keyed by the hash of the metadata files.
+    A layout holds the grid arrays, the array parameters parsed from the
+    metadata and the rerun well names, so metadata with a known layout
+    doesn't have to be parsed again.
+    """
+    def __init__(self, cache_dir):
+        """
+        :param str cache_dir: Directory where layouts are stored
+        """
+        self.logger = logging.getLogger(constants.LOG_NAME)
+        self.cache_dir = cache_dir
+
+    def _get_path(self, layout_hash):
+        """
+        :param str layout_hash: Hash of metadata, see hash_metadata
+        :return str: Path to layout file
+        """
+        return os.path.join(self.cache_dir, layout_hash + '.npz')
+
+    def load(self, layout_hash):
+        """
+        Load a compiled layout.
+
+        :param str layout_hash: Hash of metadata, see hash_metadata
+        :return dict/None layout: Grid arrays, 'params' and 'rerun_wells'
+            (None if metadata has no rerun sheet), None if there's no
+            valid entry
+        """
+        layout_path = self._get_path(layout_hash)
+        if not os.path.isfile(layout_path):
+            return None
+        try:
+            with np.load(layout_path, allow_pickle=False) as layout_file:
+                layout = json.loads(str(layout_file['layout']))
+                for array_name in LAYOUT_ARRAYS:
+                    layout[array_name] = None
+                    if array_name in layout_file:
+                        layout[array_name] = layout_file[array_name]
+        except (OSError, ValueError, KeyError):
+            self.logger.warning("Corrupt layout cache entry {}".format(layout_path))
+            return None
+        self.logger.debug("Loaded cached layout {}".format(layout_hash))
+        return layout
+
+    def save(self, layout_hash, layout):
+        """
+        Store a compiled layout atomically. The cache is only an
+        optimization, so layouts that can't be written are skipped.
+
+        :param str layout_hash: Hash of metadata, see hash_metadata
+        :param dict layout: Grid arrays, 'params' and 'rerun_wells'
+        """
+        arrays = {
+            array_name: layout[array_name] for array_name in LAYOUT_ARRAYS
+            if layout[array_name] is not None
+        }
+        arrays['layout'] = np.array(json.dumps({
+            'params': layout['params'],
+            'rerun_wells': layout['rerun_wells'],
+        }))
+        layout_path = self._get_path(layout_hash)
+        tmp_path = layout_path + '.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, layout_path)
+        except OSError as ex:
+            self.logger.warning("Can't write layout cache entry {}: {}".format(
+                layout_path, ex))
@@ -5,17 +5,55 @@ import shutil
 
 import array_analyzer.extract.txt_parser as txt_parser
 import array_analyzer.extract.constants as constants
+import array_analyzer.extract.layout_cache as layout_cache
+import array_analyzer.extract.run_context as run_context
+import array_analyzer.utils.plate_geometry as plate_geometry
+
+# Sheets read from xlsx metadata
+XLSX_SHEETS = [
+    'imaging_and_array_parameters',
+    'antigen_type',
+    'antigen_array',
+    'rerun_wells',
+]
 
 
 class MetaData:
 
-    def __init__(self, input_folder_, output_folder_):
+    def __init__(self,
+                 input_folder_,
+                 output_folder_,
+                 metadata_file=None,
+                 run_path=None,
+                 rerun=None,
+                 resume=None,
+                 debug=None,
+                 debug_sampling=None,
+                 debug_montage=None,
+                 background=None,
+                 layout_cache_dir=None):
         """
         Parses metadata spreadsheets then populates all necessary ARRAY data structures
-        Extracts all necessary constants and assigns them in the constants.py namespace
+        Extracts all necessary parameters and collects them in an immutable
+        run context (self.run_context) which is passed to workflows.
+        Runtime arguments default to the ones assigned in the constants.py
+        namespace by the CLI.
 
         :param input_folder_: str full path to metadata spreadsheet
         :param output_folder_: str full path to output folder for reports and diagnostics
+        :param str/None metadata_file: Metadata file name
+        :param str/None run_path: Run directory where outputs are written
+        :param bool/None rerun: Rerun wells in existing run path
+        :param bool/None resume: Resume interrupted run in existing run path
+        :param bool/None debug: Write debug plots
+        :param dict/None debug_sampling: Debug sampling policy
+        :param bool/None debug_montage: Write plate montages instead of
+            debug plots per well
+        :param str/None background: Background estimation method
+            ('polynomial' or 'robust')
+        :param str/None layout_cache_dir: Directory where compiled layouts
+            are cached, metadata with a cached layout isn't parsed again.
+            Defaults to constants.LAYOUT_CACHE_DIR
         """
         self.fiduc = None
         self.spots = None
@@ -23,65 +61,157 @@ class MetaData:
         self.params = None
         self.xlsx_path = None
         self.xml_path = None
-        constants.INPUT_FOLDER = input_folder_
-        constants.OUTPUT_FOLDER = output_folder_
-        metadata_split = constants.METADATA_FILE.split('.')
+        self.input_folder = input_folder_
+        self.output_folder = output_folder_
+        self.metadata_file = metadata_file
+        if metadata_file is None:
+            self.metadata_file = constants.METADATA_FILE
+        self.run_path = run_path
+        if run_path is None:
+            self.run_path = constants.RUN_PATH
+        self.rerun = constants.RERUN if rerun is None else rerun
+        self.resume = constants.RESUME if resume is None else resume
+        self.debug = constants.DEBUG if debug is None else debug
+        if debug_sampling is None:
+            debug_sampling = constants.DEBUG_SAMPLING
+        self.debug_sampling = dict(debug_sampling)
+        self.debug_montage = constants.DEBUG_MONTAGE if debug_montage is None \
+            else debug_montage
+        self.background = constants.BACKGROUND if background is None \
+            else background
+        self.rerun_wells = []
+        if layout_cache_dir is None:
+            layout_cache_dir = constants.LAYOUT_CACHE_DIR
+        self.layout_cache = None
+        if layout_cache_dir is not None:
+            self.layout_cache = layout_cache.LayoutCache(layout_cache_dir)
+        # Parameters with defaults, to be updated with parsed metadata
+        self.array_params = dict(constants.params)
+        self.layout_params = None
+        self.spot_id_array = None
+        self.spot_type_array = None
+        self.fiducials_array = None
+        self.antigen_array = None
+        self.fiducials = []
+        self.fiducials_idx = []
+        self.spot_dist_pix = None
+        self.spot_dist_um = None
+        self.run_context = None
+
+        metadata_split = self.metadata_file.split('.')
         # In case of a 'well' run
         if len(metadata_split) == 1:
             assert metadata_split[0] == 'well',\
                 "Only metadata without extension allowed is 'well,"\
                 "not {}".format(metadata_split[0])
+            self._create_run_context()
             return
         elif len(metadata_split) == 2:
             self.metadata_extension = metadata_split[-1]
         else:
             raise IOError("Metadata file must be of type"
                           "file_name.extension or 'well'"
-                          "not {}".format(constants.METADATA_FILE))
+                          "not {}".format(self.metadata_file))
+
+        # Load compiled layout if metadata is known, otherwise parse it
+        metadata_paths = self._get_metadata_paths()
+        layout = None
+        if self.layout_cache is not None:
+            layout_hash = layout_cache.hash_metadata(
+                metadata_paths,
+                self.metadata_extension,
+            )
+            layout = self.layout_cache.load(layout_hash)
+        if layout is None:
+            layout = self._parse_layout(metadata_paths)
+            if self.layout_cache is not None:
+                self.layout_cache.save(layout_hash, layout)
+        self._assign_layout(layout)
+
+        # setting location of fiducials and other useful parameters
+        self._calculate_fiduc_coords()
+        self._calculate_fiduc_idx()
+        self._calc_spot_dist()
+        if self.rerun or self.resume:
+            # Rerun or resume wells in existing run path
+            assert os.path.isdir(self.run_path),\
+                "Can't find re-run dir {}".format(self.run_path)
+            # Make sure it's a multisero directory
+            base_path = os.path.basename(os.path.normpath(self.run_path))
+            assert base_path[:10] == 'multisero_',\
+                "Rerun path should be a multisero_... path, not".format(self.run_path)
+
+        self._copy_metadata_to_output()
+        self._create_run_context()
+
+    def _get_metadata_paths(self):
+        """
+        Check that metadata files exist in input folder.
 
-        # parse fiducials, spot types, antigens, and hardware parameters from metadata
+        :return list metadata_paths: Paths to metadata files
+        """
         if self.metadata_extension == 'xml':
             # check that .xml exists
-            if constants.METADATA_FILE not in os.listdir(input_folder_):
+            if self.metadata_file not in os.listdir(self.input_folder):
                 raise IOError("xml file not found, aborting")
-            self.xml_path = os.path.join(input_folder_, constants.METADATA_FILE)
-            # parsing .xml
-            self.fiduc, self.spots, self.repl, self.params = txt_parser.create_xml_dict(self.xml_path)
-
+            self.xml_path = os.path.join(self.input_folder, self.metadata_file)
+            return [self.xml_path]
         elif self.metadata_extension == 'csv':
             # check that three .csvs exist
             three_csvs = ['array_format_antigen', 'array_format_type', 'array_parameters']
-            csvs = [f for f in os.listdir(input_folder_) if '.csv' in f]
+            csvs = [f for f in os.listdir(self.input_folder) if '.csv' in f]
             if len(csvs) != 3:
                 raise IOError("incorrect number of .csv files found, aborting")
             for target in three_csvs:
                 if True not in [target in file for file in csvs]:
                     raise IOError(f".csv file with substring {target} is missing")
+            return [os.path.join(self.input_folder, one_csv) for one_csv in csvs]
+        elif self.metadata_extension == 'xlsx':
+            if self.metadata_file not in os.listdir(self.input_folder):
+                raise IOError("xlsx file not found, aborting")
+            self.xlsx_path = os.path.join(self.input_folder, self.metadata_file)
+            return [self.xlsx_path]
+        else:
+            raise NotImplementedError(
+                f"metadata with extension {self.metadata_extension} is not supported"
+            )
 
-            csv_paths = [os.path.join(input_folder_, one_csv) for one_csv in csvs]
-            # parsing .csv
-            self.fiduc, _, self.repl, self.params = txt_parser.create_csv_dict(csv_paths)
+    def _parse_layout(self, metadata_paths):
+        """
+        Parse fiducials, spot types, antigens, and hardware parameters from
+        metadata and compile them into a layout.
 
-        elif self.metadata_extension == 'xlsx':
-            self.xlsx_path = os.path.join(input_folder_, constants.METADATA_FILE)
+        :param list metadata_paths: Paths to metadata files
+        :return dict layout: Grid arrays, array parameters parsed from
+            metadata ('params') and rerun well names ('rerun_wells', None
+            if there's no rerun sheet)
+        """
+        rerun_wells = None
+        if self.metadata_extension == 'xml':
+            # parsing .xml
+            self.fiduc, self.spots, self.repl, self.params = txt_parser.create_xml_dict(self.xml_path)
 
-            if constants.METADATA_FILE not in os.listdir(input_folder_):
-                raise IOError("xlsx file not found, aborting")
+        elif self.metadata_extension == 'csv':
+            # parsing .csv
+            self.fiduc, _, self.repl, self.params = txt_parser.create_csv_dict(metadata_paths)
 
+        elif self.metadata_extension == 'xlsx':
             # check that the xlsx file contains necessary worksheets
-            sheets = pd.read_excel(self.xlsx_path, sheet_name=None)
-            if 'imaging_and_array_parameters' not in sheets.keys():
-                raise IOError("sheet by name 'imaging_and_array_parameters' not present in excel file, aborting")
-            if 'antigen_array' not in sheets.keys():
-                raise IOError("sheet by name 'array_antigens' not present in excel file, aborting")
+            # and only read the sheets that are used
+            with pd.ExcelFile(self.xlsx_path) as xlsx_file:
+                sheet_names = xlsx_file.sheet_names
+                if 'imaging_and_array_parameters' not in sheet_names:
+                    raise IOError("sheet by name 'imaging_and_array_parameters' not present in excel file, aborting")
+                if 'antigen_array' not in sheet_names:
+                    raise IOError("sheet by name 'array_antigens' not present in excel file, aborting")
+                sheets = {
+                    sheet_name: xlsx_file.parse(sheet_name)
+                    for sheet_name in XLSX_SHEETS if sheet_name in sheet_names
+                }
             # Collect well names for rerun, if sheet exists
-            if constants.RERUN:
-                if 'rerun_wells' in sheets.keys():
-                    constants.RERUN_WELLS = list(sheets['rerun_wells']['well_name'])
-                    assert len(constants.RERUN_WELLS) > 0,\
-                        "No rerun well names found"
-                else:
-                    raise IOError("Rerun flag given but no rerun_wells sheet")
+            if 'rerun_wells' in sheets:
+                rerun_wells = [str(well_name) for well_name in
+                               sheets['rerun_wells']['well_name']]
             # parsing .xlsx
             self.fiduc, self.repl, self.params = txt_parser.create_xlsx_dict(sheets)
 
@@ -90,11 +220,6 @@ class MetaData:
             # c.FIDUCIAL_ARRAY = self.fiduc
             # c.ANTIGEN_ARRAY = self.repl
 
-        else:
-            raise NotImplementedError(
-                f"metadata with extension {self.metadata_extension} is not supported"
-            )
-
         # set hardware and array parameters
         self._assign_params()
 
@@ -104,64 +229,122 @@ class MetaData:
             self._create_spot_type_array()
         self._create_fiducials_array()
         self._create_antigen_array()
+        return {
+            'params': self.layout_params,
+            'rerun_wells': rerun_wells,
+            'fiducials_array': self.fiducials_array,
+            'antigen_array': self.antigen_array,
+            'spot_id_array': self.spot_id_array,
+            'spot_type_array': self.spot_type_array,
+        }
 
-        # setting location of fiducials and other useful parameters
-        self._calculate_fiduc_coords()
-        self._calculate_fiduc_idx()
-        self._calc_spot_dist()
-        if constants.RERUN:
-            # Rerun certain wells in existing run path
-            assert os.path.isdir(constants.RUN_PATH),\
-                "Can't find re-run dir {}".format(constants.RUN_PATH)
-            # Make sure it's a multisero directory
-            base_path = os.path.basename(os.path.normpath(constants.RUN_PATH))
-            assert base_path[:10] == 'multisero_',\
-                "Rerun path should be a multisero_... path, not".format(constants.RUN_PATH)
+    def _assign_layout(self, layout):
+        """
+        Set array parameters, grid arrays and rerun wells from a layout.
 
-        self._copy_metadata_to_output()
+        :param dict layout: Layout, see _parse_layout
+        """
+        self.layout_params = layout['params']
+        self.array_params.update(self.layout_params)
+        if self.metadata_extension == 'xml':
+            self.array_params['pixel_size'] = self.array_params['pixel_size_scienion']
+        self.fiducials_array = layout['fiducials_array']
+        self.antigen_array = layout['antigen_array']
+        self.spot_id_array = layout['spot_id_array']
+        self.spot_type_array = layout['spot_type_array']
+        # If no rerun wells are given, wells with changed images or
+        # parameters are rerun
+        if self.rerun and layout['rerun_wells'] is not None:
+            self.rerun_wells = list(layout['rerun_wells'])
+            assert len(self.rerun_wells) > 0,\
+                "No rerun well names found"
+
+    def _create_run_context(self):
+        """
+        Collect parsed metadata and runtime arguments in a run context.
+        Parameters are copied and, like arrays, made read only since the
+        context is shared.
+        """
+        for array in [self.spot_id_array,
+                      self.spot_type_array,
+                      self.fiducials_array,
+                      self.antigen_array]:
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+        self.run_context = run_context.RunContext(
+            input_dir=self.input_folder,
+            run_path=self.run_path,
+            metadata_file=self.metadata_file,
+            params=run_context.ReadOnlyDict(self.array_params),
+            fiducials=self.fiducials,
+            fiducials_idx=self.fiducials_idx,
+            fiducial_array=self.fiducials_array,
+            antigen_array=self.antigen_array,
+            spot_id_array=self.spot_id_array,
+            spot_type_array=self.spot_type_array,
+            spot_dist_pix=self.spot_dist_pix,
+            spot_dist_um=self.spot_dist_um,
+            debug=self.debug,
+            debug_sampling=self.debug_sampling,
+            rerun=self.rerun,
+            resume=self.resume,
+            rerun_wells=tuple(self.rerun_wells),
+            plate_geometry=plate_geometry.PlateGeometry.from_format(
+                self.array_params['plate_format'],
+            ),
+            debug_montage=self.debug_montage,
+            background=self.background,
+        )
 
     def _assign_params(self):
-        constants.params['rows'] = int(self.params['rows'])
-        constants.params['columns'] = int(self.params['columns'])
-        constants.params['v_pitch'] = float(self.params['v_pitch'])
-        constants.params['h_pitch'] = float(self.params['h_pitch'])
-        constants.params['spot_width'] = float(self.params['spot_width'])
-        if self.metadata_extension == 'xml':
-            constants.params['pixel_size'] = constants.params['pixel_size_scienion']
-        else:
-            constants.params['pixel_size'] = float(self.params['pixel_size'])
+        """
+        Convert array parameters parsed from metadata and set them.
+        Parameters that aren't in the metadata keep their defaults.
+        """
+        self.layout_params = {
+            'rows': int(self.params['rows']),
+            'columns': int(self.params['columns']),
+            'v_pitch': float(self.params['v_pitch']),
+            'h_pitch': float(self.params['h_pitch']),
+            'spot_width': float(self.params['spot_width']),
+        }
+        if self.metadata_extension != 'xml':
+            self.layout_params['pixel_size'] = float(self.params['pixel_size'])
         if 'nbr_outliers' in self.params:
-            constants.params['nbr_outliers'] = int(self.params['nbr_outliers'])
+            self.layout_params['nbr_outliers'] = int(self.params['nbr_outliers'])
+        if 'plate_format' in self.params:
+            self.layout_params['plate_format'] = int(self.params['plate_format'])
+        self.array_params.update(self.layout_params)
 
     def _create_spot_id_array(self):
         """
         Creates an empty ndarray of strings, whose rows and columns match the printed array's rows/cols
-            Sets the ARRAY constant corresponding to "Spot-ID" based on metadata
+            Sets the array corresponding to "Spot-ID" based on metadata
         *** note: this is used ONLY for .xml metadata files generated by the sciReader ***
         :return:
         """
-        self.spot_ids = np.empty(
-            shape=(constants.params['rows'], constants.params['columns']),
+        spot_ids = np.empty(
+            shape=(self.array_params['rows'], self.array_params['columns']),
             dtype='U100',
         )
-        constants.SPOT_ID_ARRAY = txt_parser.populate_array_id(
-            self.spot_ids,
+        self.spot_id_array = txt_parser.populate_array_id(
+            spot_ids,
             self.spots,
         )
 
     def _create_spot_type_array(self):
         """
         Creates an empty ndarray of strings, whose rows and columns match the printed array's rows/cols
-            Sets the ARRAY constant corresponding to "Spot Type" based on metadata
+            Sets the array corresponding to "Spot Type" based on metadata
             "Spot Type" are values like "Positive Control", "Diagnostic"
         :return:
         """
-        self.spot_type = np.empty(
-            shape=(constants.params['rows'], constants.params['columns']),
+        spot_type = np.empty(
+            shape=(self.array_params['rows'], self.array_params['columns']),
             dtype='U100',
         )
-        constants.SPOT_TYPE_ARRAY = txt_parser.populate_array_spots_type(
-            self.spot_type,
+        self.spot_type_array = txt_parser.populate_array_spots_type(
+            spot_type,
             self.spots,
             self.fiduc,
         )
@@ -169,16 +352,16 @@ class MetaData:
     def _create_fiducials_array(self):
         """
         Creates an empty ndarray of strings, whose rows and columns match the printed array's rows/cols
-            Sets the ARRAY constant corresponding to "Fiducial" based on metadata
+            Sets the array corresponding to "Fiducial" based on metadata
             "Fiducial" are values like "Fiducial" or "Reference, Diagnostic" and are used to align array spots
         :return:
         """
-        self.fiducials_array = np.empty(
-            shape=(constants.params['rows'], constants.params['columns']),
+        fiducials_array = np.empty(
+            shape=(self.array_params['rows'], self.array_params['columns']),
             dtype='U100',
         )
-        constants.FIDUCIAL_ARRAY = txt_parser.populate_array_fiduc(
-            self.fiducials_array,
+        self.fiducials_array = txt_parser.populate_array_fiduc(
+            fiducials_array,
             self.fiduc,
         )
 
@@ -188,76 +371,73 @@ class MetaData:
             Assigns the corresponding "Antigen" based on metadata
             "Antigens" are descriptive values of the antigen at each spot location.
 
-        This is the only array creator that requires one of the above arrays (SPOT_ID_ARRAY, .xml meta ONLY)
-            multiple "spot-ids" can contain the same "antigen".  Thus it's required to pass the "SPOT_ID_ARRAY"
+        This is the only array creator that requires one of the above arrays (spot_id_array, .xml meta ONLY)
+            multiple "spot-ids" can contain the same "antigen".  Thus it's required to pass the spot_id_array
         :return:
         """
-        self.antigen_array = np.empty(
-            shape=(constants.params['rows'], constants.params['columns']),
+        antigen_array = np.empty(
+            shape=(self.array_params['rows'], self.array_params['columns']),
             dtype='U100',
         )
         if self.metadata_extension == 'xml':
-            if constants.SPOT_ID_ARRAY.size == 0:
+            if self.spot_id_array is None or self.spot_id_array.size == 0:
                 raise AttributeError("attempting to create antigen array "
-                                     "before SPOT_ID_ARRAY is assigned")
-            constants.ANTIGEN_ARRAY = txt_parser.populate_array_antigen_xml(
-                self.antigen_array,
-                constants.SPOT_ID_ARRAY,
+                                     "before spot_id_array is assigned")
+            self.antigen_array = txt_parser.populate_array_antigen_xml(
+                antigen_array,
+                self.spot_id_array,
                 self.repl,
             )
         elif self.metadata_extension == 'csv' or self.metadata_extension == 'xlsx':
-            constants.ANTIGEN_ARRAY = txt_parser.populate_array_antigen(
-                self.antigen_array,
+            self.antigen_array = txt_parser.populate_array_antigen(
+                antigen_array,
                 self.repl,
             )
 
-    @staticmethod
-    def _calculate_fiduc_coords():
+    def _calculate_fiduc_coords(self):
         """
         Calculate and set the fiducial coordinates like:
-            FIDUCIALS = [(0, 0), (0, 1), (0, 5), (7, 0), (7, 5)]
+            fiducials = [(0, 0), (0, 1), (0, 5), (7, 0), (7, 5)]
             fiducial coordinates are labeled as "Reference, Diagnostic"
         :return:
         """
-        x, y = np.where(constants.FIDUCIAL_ARRAY == 'Reference, Diagnostic')
+        x, y = np.where(self.fiducials_array == 'Reference, Diagnostic')
         if x.size == 0 or y.size == 0:
-            x, y = np.where(constants.FIDUCIAL_ARRAY == 'Fiducial')
-        constants.FIDUCIALS = list(zip(x, y))
+            x, y = np.where(self.fiducials_array == 'Fiducial')
+        self.fiducials = list(zip(x, y))
 
-    @staticmethod
-    def _calculate_fiduc_idx():
+    def _calculate_fiduc_idx(self):
         """
         Calculate fiducial index like
-            FIDUCIALS_IDX = [0, 5, 6, 30, 35]\
-            FIDUCIALS_IDX = [0, 7, 8, 40, 47] for 8 columns
+            fiducials_idx = [0, 5, 6, 30, 35]\
+            fiducials_idx = [0, 7, 8, 40, 47] for 8 columns
         :return:
         """
-        constants.FIDUCIALS_IDX = list(np.where(
-            constants.FIDUCIAL_ARRAY.flatten() == 'Reference, Diagnostic')[0])
-        if len(constants.FIDUCIALS_IDX) == 0:
-            constants.FIDUCIALS_IDX = list(np.where(
-                constants.FIDUCIAL_ARRAY.flatten() == 'Fiducial')[0])
-
-    @staticmethod
-    def _calc_spot_dist():
+        self.fiducials_idx = list(np.where(
+            self.fiducials_array.flatten() == 'Reference, Diagnostic')[0])
+        if len(self.fiducials_idx) == 0:
+            self.fiducials_idx = list(np.where(
+                self.fiducials_array.flatten() == 'Fiducial')[0])
+
+    def _calc_spot_dist(self):
         """
         Calculate distance between spots in both pixels and microns
         :return:
         """
-        v_pitch_mm = constants.params['v_pitch']
-        h_pitch_mm = constants.params['h_pitch']
-        pix_size = constants.params['pixel_size']
+        v_pitch_mm = self.array_params['v_pitch']
+        h_pitch_mm = self.array_params['h_pitch']
+        pix_size = self.array_params['pixel_size']
 
         # assuming similar v_pitch and h_pitch, average to get the SPOT_DIST
         v_pitch_pix = v_pitch_mm/pix_size
         h_pitch_pix = h_pitch_mm/pix_size
-        constants.SPOT_DIST_PIX = np.mean([v_pitch_pix, h_pitch_pix]).astype('uint8')
+        self.spot_dist_pix = np.mean([v_pitch_pix, h_pitch_pix]).astype('uint8')
 
         # convert the SPOT_DIST to microns, 0 - 255
-        constants.SPOT_DIST_UM = np.mean([v_pitch_mm * 1000, h_pitch_mm * 1000]).astype('uint8')
+        self.spot_dist_um = np.mean([v_pitch_mm * 1000, h_pitch_mm * 1000]).astype('uint8')
 
     def _copy_metadata_to_output(self):
         if self.metadata_extension == 'xlsx':
-            shutil.copy2(self.xlsx_path, constants.RUN_PATH)
+            shutil.copy2(self.xlsx_path, self.run_path)
         elif self.metadata_extension == 'xml':
-            shutil.copy2(self.xml_path, constants.RUN_PATH)
+            shutil.copy2(self.xml_path, self.run_path)
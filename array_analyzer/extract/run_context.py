@@ -0,0 +1,57 @@
+import collections
+
+
+class ReadOnlyDict(dict):
+    """
+    Dict that can't be modified after it's created, for run context
+    parameters which are shared by plates with the same layout.
+    Unlike types.MappingProxyType it can be pickled, so run contexts can be
+    sent to worker processes, and it serializes to json like a dict.
+    Use dict(params) for a modifiable copy.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Run context parameters are read only")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return ReadOnlyDict, (dict(self),)
+
+
+# Everything parsed from metadata and runtime arguments that a run needs.
+# A RunContext is built by MetaData and passed explicitly to workflows and
+# processing classes instead of assigning module globals in constants, so
+# that several plates can be processed at once in the same process.
+# It's a namedtuple so fields can't be reassigned, use _replace to derive
+# a context for another plate with the same layout.
+RunContext = collections.namedtuple(
+    'RunContext',
+    [
+        'input_dir',  # Directory containing images and metadata
+        'run_path',  # Directory where outputs for this run are written
+        'metadata_file',  # Metadata file name
+        'params',  # ReadOnlyDict of imaging and array parameters
+        'fiducials',  # List of (row, col) fiducial locations in the grid
+        'fiducials_idx',  # List of fiducial indices in the flattened grid
+        'fiducial_array',  # Spot types (fiducial or not) on the grid
+        'antigen_array',  # Antigen names on the grid
+        'spot_id_array',  # Spot IDs on the grid (xml metadata only)
+        'spot_type_array',  # Spot types on the grid (xml metadata only)
+        'spot_dist_pix',  # Distance between spots in pixels
+        'spot_dist_um',  # Distance between spots in microns
+        'debug',  # Write debug plots
+        'debug_sampling',  # Debug sampling policy, see DebugSampler
+        'rerun',  # Rerun wells in existing run path
+        'resume',  # Resume interrupted run in existing run path
+        'rerun_wells',  # Wells listed for rerun
+        'plate_geometry',  # PlateGeometry with plate rows and columns
+        'debug_montage',  # Write plate montages instead of debug plots per well
+        'background',  # Background estimation method, see BACKGROUND_METHODS
+    ],
+    defaults=(
+        None, None, None, None, None, None, None, None, None, None, None,
+        None, False, None, False, False, (), None, False, 'polynomial',
+    ),
+)
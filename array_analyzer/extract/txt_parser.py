@@ -1,15 +1,14 @@
 # bchhun, {2020-03-22}
+import collections
 import csv
-import natsort
 import numpy as np
 import os
-import xmltodict
-from xml.parsers.expat import ExpatError
 import xml.etree.ElementTree as ET
 import pandas as pd
 import math
 
 import array_analyzer.extract.constants as constants
+import array_analyzer.utils.plate_geometry as plate_geometry
 
 """
 functions like "create_<extension>_dict" parse files of <extension> and return:
@@ -35,50 +34,60 @@ populating antigens is more complicated for .xml parsing than for .csv or .xlsx
 """
 
 
+def _xml_attributes(element, list_tags=()):
+    """
+    Collect attributes of an xml element in a dict with '@' prefixed keys,
+    and the text of child elements in lists.
+
+    :param xml.etree.ElementTree.Element element: xml element
+    :param tuple list_tags: Tags of child elements whose text is collected
+    :return dict attributes: Attributes and child element texts
+    """
+    attributes = {'@' + key: value for key, value in element.attrib.items()}
+    for tag in list_tags:
+        attributes[tag] = [child.text for child in element.iter(tag)]
+    return attributes
+
+
 def create_xml_dict(path_):
     """
     receives an .xml file generated by the Scienion sciReader software
     and returns dictionaries containing info.
+    Only the array element of the first well configuration is converted.
 
     :param str path_: Full path of xml file
-    :return dict fiduc: Fiducials and control info
-    :return dict spots: Spot info
-    :return dict repl: Replicate info
+    :return list fiduc: Fiducials and control info
+    :return list spots: Spot info
+    :return list repl: Replicate info
     :return dict params: Additional parameters
     """
     try:
-        with open(path_) as fd:
-            doc = xmltodict.parse(fd.read())
-    except ExpatError:
-        tree = ET.parse(path_)
-        xml_data = tree.getroot()
-        # here you can change the encoding type to be able to set it to the one you need
-        xmlstr = ET.tostring(xml_data, encoding='utf-8', method='xml')
-        doc = xmltodict.parse(xmlstr)
-
-    try:
+        # ElementTree reads the encoding from the xml declaration
+        root = ET.parse(path_).getroot()
+        array = root.find('well_configurations/configuration/array')
         # layout of array
-        layout = doc['configuration']['well_configurations']['configuration']['array']['layout']
+        layout = array.find('layout')
 
         # fiducials
-        fiduc = layout['marker']
+        fiduc = [_xml_attributes(marker) for marker in layout.iter('marker')]
 
         # spot IDs
-        spots = doc['configuration']['well_configurations']['configuration']['array']['spots']['spot']
+        spots = [_xml_attributes(spot) for spot in array.find('spots').iter('spot')]
 
         # replicates
-        repl = doc['configuration']['well_configurations']['configuration']['array']['spots']['multiplet']
+        repl = [_xml_attributes(multiplet, list_tags=('id',))
+                for multiplet in array.find('spots').iter('multiplet')]
 
         array_params = dict()
-        array_params['rows'] = int(layout['@rows'])
-        array_params['columns'] = int(layout['@cols'])
-        array_params['v_pitch'] = float(layout['@vspace'])
-        array_params['h_pitch'] = float(layout['@hspace'])
-        array_params['spot_width'] = float(layout['@expected_diameter'])
-        array_params['bg_offset'] = float(layout['@background_offset'])
-        array_params['bg_thickness'] = float(layout['@background_thickness'])
-        array_params['max_diam'] = float(layout['@max_diameter'])
-        array_params['min_diam'] = float(layout['@min_diameter'])
+        array_params['rows'] = int(layout.attrib['rows'])
+        array_params['columns'] = int(layout.attrib['cols'])
+        array_params['v_pitch'] = float(layout.attrib['vspace'])
+        array_params['h_pitch'] = float(layout.attrib['hspace'])
+        array_params['spot_width'] = float(layout.attrib['expected_diameter'])
+        array_params['bg_offset'] = float(layout.attrib['background_offset'])
+        array_params['bg_thickness'] = float(layout.attrib['background_thickness'])
+        array_params['max_diam'] = float(layout.attrib['max_diameter'])
+        array_params['min_diam'] = float(layout.attrib['min_diameter'])
 
     except Exception as ex:
         raise AttributeError(f"exception while parsing .xml : {ex}")
@@ -327,11 +336,14 @@ def populate_array_antigen_xml(arr, id_arr_, repl):
     :return: np.ndarray
         populated array
     """
+    # Map spot IDs to antigens, later replicates take precedence
+    spot_antigens = {}
     for rep in repl:
-        antigen = rep['@id']
-        all_spots = rep['id']  # list of IDs
-        for spot in all_spots:
-            arr[np.where(id_arr_ == spot)] = antigen
+        for spot in rep['id']:  # list of IDs
+            spot_antigens[spot] = rep['@id']
+    for idx, spot in np.ndenumerate(id_arr_):
+        if spot in spot_antigens:
+            arr[idx] = spot_antigens[spot]
 
     return arr
 
@@ -354,29 +366,30 @@ def populate_array_antigen(arr, csv_antigens_):
     return arr
 
 
-def rerun_xl_od(well_names, well_xlsx_path, rerun_names, xlsx_writer):
+def rerun_xl_od(well_names, well_xlsx_path, rerun_names):
     """
-    Load stats_per_well excel file and copy over existing well sheets
+    Load stats_per_well excel file and return existing well sheets
     before rerunning some of the wells.
 
     :param list well_names: Well names (e.g. ['B12', 'C2'])
     :param str well_xlsx_path: Full path to well stats xlsx sheet
     :param list rerun_names: Names of wells to be rerun
-    :param pd.ExcelWriter xlsx_writer: Pandas excel writer
+    :return OrderedDict well_sheets: Spot metrics of wells that aren't rerun
     """
     rerun_set = set(rerun_names)
     assert rerun_set.issubset(well_names), \
         "All rerun wells can't be found in input directory"
     assert os.path.isfile(well_xlsx_path),\
         "Can't find stats_per_well excel: {}".format(well_xlsx_path)
-    ordered_dict = pd.read_excel(well_xlsx_path, sheet_name=None)
+    ordered_dict = pd.read_excel(well_xlsx_path, sheet_name=None, index_col=0)
     written_wells = list(ordered_dict.keys())
     written_wells.remove('antigens')
     # Find the difference between the sets
-    existing_wells = natsort.natsorted(
-        list(set(written_wells) - rerun_set),
+    existing_wells = sorted(
+        set(written_wells) - rerun_set,
+        key=plate_geometry.well_sort_key,
     )
-    # Write existing wells to well stats
+    well_sheets = collections.OrderedDict()
     for well_name in existing_wells:
-        well_df = pd.DataFrame(ordered_dict[well_name])
-        well_df.to_excel(xlsx_writer, sheet_name=well_name)
+        well_sheets[well_name] = ordered_dict[well_name]
+    return well_sheets
\ No newline at end of file
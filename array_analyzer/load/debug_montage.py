@@ -0,0 +1,265 @@
+import cv2 as cv
+import numpy as np
+import os
+
+import array_analyzer.load.debug_plots as debug_plots
+
+# Maximum size of well thumbnails in pixels
+THUMB_SIZE = 128
+# Montages are at most this wide, thumbnails shrink for large plates
+MAX_MONTAGE_WIDTH = 3072
+# Montage panels made of well thumbnails
+IMAGE_PANELS = ['registration', 'composite_spots', 'bg_overlay']
+# Montage panels made of spot grid heatmaps, with the spots_df column shown
+GRID_PANELS = {
+    'intensity': 'intensity_median',
+    'background': 'bg_median',
+    'od': 'od_norm',
+}
+# Height of the montage header showing heatmap ranges
+HEADER_HEIGHT = 24
+# BGR colors of detected spots, initial fiducials, registered grid and failures
+SPOT_COLOR = (0, 0, 255)
+FIDUCIAL_COLOR = (255, 0, 0)
+REGISTERED_COLOR = (0, 255, 0)
+FAILED_COLOR = (0, 0, 255)
+# Matplotlib colormap of OD heatmaps
+OD_COLORMAP = 'viridis'
+# Color lookup tables by colormap name, built the first time they're used
+_COLOR_LUTS = {}
+
+
+def get_color_lut(colormap):
+    """
+    Lookup table mapping 8 bit intensities to the BGR colors of a matplotlib
+    colormap, for use with cv.LUT. Not all colormaps are available in OpenCV,
+    e.g. viridis was added in OpenCV 4.
+
+    :param str colormap: Name of matplotlib colormap
+    :return np.array lut: BGR colors (256 x 1 x 3), uint8
+    """
+    if colormap not in _COLOR_LUTS:
+        import matplotlib.pyplot as plt
+        colors = plt.get_cmap(colormap)(np.linspace(0, 1, 256))[:, 2::-1]
+        _COLOR_LUTS[colormap] = np.round(255 * colors).astype(np.uint8)[:, np.newaxis]
+    return _COLOR_LUTS[colormap]
+
+
+def get_thumb_size(plate):
+    """
+    Thumbnail size so that the plate montage fits in MAX_MONTAGE_WIDTH.
+
+    :param PlateGeometry plate: Plate geometry
+    :return int thumb_size: Thumbnail size in pixels
+    """
+    return int(min(THUMB_SIZE, MAX_MONTAGE_WIDTH // plate.nbr_cols))
+
+
+def _to_uint8(im, max_intensity=1.):
+    """
+    :param np.array im: Image with values in [0, max_intensity]
+    :param float max_intensity: Maximum image intensity
+    :return np.array im_uint8: Image scaled to uint8
+    """
+    im = np.clip(im * (255. / max_intensity), 0, 255)
+    return im.astype(np.uint8)
+
+
+def _thumbnail(im, thumb_size):
+    """
+    Downsample an image so its longest side fits in the thumbnail.
+
+    :param np.array im: 2D or color image
+    :param int thumb_size: Thumbnail size in pixels
+    :return np.array thumb: Downsampled image
+    :return float scale: Thumbnail to image size ratio
+    """
+    scale = min(1., thumb_size / max(im.shape[:2]))
+    new_shape = (
+        max(1, int(round(im.shape[1] * scale))),
+        max(1, int(round(im.shape[0] * scale))),
+    )
+    thumb = cv.resize(im, new_shape, interpolation=cv.INTER_AREA)
+    return thumb, scale
+
+
+def _draw_points(thumb, coords, scale, color):
+    """
+    Draw points at image coordinates (row, col) scaled to a thumbnail.
+    """
+    if coords is None:
+        return
+    for row, col in np.round(np.asarray(coords) * scale).astype(np.int64):
+        cv.circle(thumb, (int(col), int(row)), 1, color, -1)
+
+
+def well_tiles(well_data, thumb_size, grid_shape):
+    """
+    Make montage tiles for a well processed by extract_well. Tiles are
+    small, so they can be made where the well is processed and sent
+    to the process assembling the montage.
+
+    :param dict well_data: Well results from extract_well
+    :param int thumb_size: Thumbnail size in pixels
+    :param tuple grid_shape: Number of spot grid rows and columns
+    :return dict tiles: Thumbnails and spot grids by panel name
+    """
+    tiles = {}
+    if 'im_well' in well_data:
+        thumb, scale = _thumbnail(well_data['im_well'], thumb_size)
+        thumb = cv.cvtColor(
+            _to_uint8(thumb, well_data.get('max_intensity', 1.)),
+            cv.COLOR_GRAY2BGR,
+        )
+        _draw_points(thumb, well_data.get('spot_coords'), scale, SPOT_COLOR)
+        _draw_points(thumb, well_data.get('fiducial_coords'), scale, FIDUCIAL_COLOR)
+        _draw_points(thumb, well_data.get('registered_coords'), scale, REGISTERED_COLOR)
+        if well_data['status'] != 'done':
+            cv.rectangle(
+                thumb,
+                (0, 0),
+                (thumb.shape[1] - 1, thumb.shape[0] - 1),
+                FAILED_COLOR,
+                2,
+            )
+        tiles['registration'] = thumb
+    if well_data['status'] != 'done':
+        return tiles
+    im_crop = well_data['im_crop']
+    composite = debug_plots.composite_spots(well_data['spot_props'], im_crop)
+    tiles['composite_spots'] = cv.cvtColor(
+        _thumbnail(_to_uint8(composite), thumb_size)[0],
+        cv.COLOR_GRAY2BGR,
+    )
+    # There's no background image for annulus backgrounds
+    if well_data['background'] is not None:
+        im_bg_overlay = np.stack(
+            [well_data['background'], im_crop, well_data['background']],
+            axis=2,
+        )
+        tiles['bg_overlay'] = _thumbnail(_to_uint8(im_bg_overlay), thumb_size)[0]
+    for panel_name, col_name in GRID_PANELS.items():
+        tiles[panel_name] = debug_plots.spots_to_grid(
+            well_data['spots_df'],
+            col_name,
+            grid_shape,
+        )
+    return tiles
+
+
+class PlateMontage:
+    """
+    Plate level debug images. Instead of writing several debug plots per
+    well, downsampled well thumbnails and spot grid heatmaps are tiled at
+    the wells' plate positions, giving one image per panel for the plate:
+    registration (detected spots red, initial fiducials blue, registered
+    grid green, failed wells framed in red), composite spots, background
+    overlay, and intensity, background and OD heatmaps. Heatmaps share one
+    intensity range per plate so wells can be compared.
+    """
+    def __init__(self, plate, grid_shape):
+        """
+        :param PlateGeometry plate: Plate geometry
+        :param tuple grid_shape: Number of spot grid rows and columns
+        """
+        self.plate = plate
+        self.grid_shape = tuple(grid_shape)
+        self.thumb_size = get_thumb_size(plate)
+        # Tiles by panel name, then well name
+        self.tiles = {panel_name: {} for panel_name in
+                      IMAGE_PANELS + list(GRID_PANELS)}
+
+    def add_tiles(self, well_name, tiles):
+        """
+        :param str well_name: Well name (e.g. 'B12')
+        :param dict tiles: Tiles by panel name from well_tiles
+        """
+        # Check that well is on the plate
+        self.plate.well_position(well_name)
+        for panel_name, tile in tiles.items():
+            self.tiles[panel_name][well_name] = tile
+
+    def add_well(self, well_name, well_data):
+        """
+        :param str well_name: Well name (e.g. 'B12')
+        :param dict well_data: Well results from extract_well
+        """
+        self.add_tiles(
+            well_name,
+            well_tiles(well_data, self.thumb_size, self.grid_shape),
+        )
+
+    def _grid_thumbnail(self, grid, vmin, vmax, colormap):
+        """
+        Color a spot grid with a plate wide range and upscale it with
+        nearest neighbor interpolation. Missing spots are black.
+        """
+        scaled = (grid - vmin) / max(vmax - vmin, np.finfo(np.float64).eps)
+        im = cv.cvtColor(_to_uint8(np.nan_to_num(scaled, nan=0.)), cv.COLOR_GRAY2BGR)
+        if colormap is not None:
+            im = cv.LUT(im, get_color_lut(colormap))
+        im[np.isnan(grid)] = 0
+        scale = self.thumb_size / max(grid.shape)
+        return cv.resize(
+            im,
+            (max(1, int(grid.shape[1] * scale)), max(1, int(grid.shape[0] * scale))),
+            interpolation=cv.INTER_NEAREST,
+        )
+
+    def _assemble(self, tiles, header=None):
+        """
+        Place tiles at their wells' plate positions, labeled with well names.
+
+        :param dict tiles: Color images by well name
+        :param str/None header: Text written above the plate
+        :return np.array montage: Color montage image
+        """
+        header_height = 0 if header is None else HEADER_HEIGHT
+        montage = np.zeros(
+            (header_height + self.plate.nbr_rows * self.thumb_size,
+             self.plate.nbr_cols * self.thumb_size,
+             3),
+            dtype=np.uint8,
+        )
+        if header is not None:
+            cv.putText(montage, header, (4, HEADER_HEIGHT - 8),
+                       cv.FONT_HERSHEY_SIMPLEX, .45, (255, 255, 255), 1)
+        font_scale = self.thumb_size / 320
+        for well_name, tile in tiles.items():
+            row_idx, col_idx = self.plate.well_position(well_name)
+            row = header_height + row_idx * self.thumb_size
+            col = col_idx * self.thumb_size
+            # Leave a one pixel border between wells
+            tile = tile[:self.thumb_size - 1, :self.thumb_size - 1]
+            montage[row:row + tile.shape[0], col:col + tile.shape[1]] = tile
+            cv.putText(montage, well_name, (col + 2, row + int(30 * font_scale)),
+                       cv.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), 1)
+        return montage
+
+    def write(self, output_dir):
+        """
+        Write one montage per panel with wells, named plate_<panel>.png.
+        Panels without wells aren't written.
+
+        :param str output_dir: Directory where montages are written
+        :return list montage_paths: Paths to written montages
+        """
+        montage_paths = []
+        for panel_name in IMAGE_PANELS + list(GRID_PANELS):
+            tiles = self.tiles[panel_name]
+            if len(tiles) == 0:
+                continue
+            header = None
+            if panel_name in GRID_PANELS:
+                values = np.concatenate([grid.ravel() for grid in tiles.values()])
+                values = values[np.isfinite(values)]
+                vmin, vmax = (values.min(), values.max()) if values.size else (0., 1.)
+                colormap = OD_COLORMAP if panel_name == 'od' else None
+                tiles = {well_name: self._grid_thumbnail(grid, vmin, vmax, colormap)
+                         for well_name, grid in tiles.items()}
+                header = '{} {}: {:.4g} - {:.4g}'.format(
+                    panel_name, GRID_PANELS[panel_name], vmin, vmax)
+            montage_path = os.path.join(output_dir, 'plate_{}.png'.format(panel_name))
+            cv.imwrite(montage_path, self._assemble(tiles, header))
+            montage_paths.append(montage_path)
+        return montage_paths
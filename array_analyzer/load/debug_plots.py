@@ -3,7 +3,9 @@
 import cv2 as cv
 import os
 import numpy as np
-import matplotlib.pyplot as plt
+
+# matplotlib.pyplot is imported by the functions that plot, so workflows
+# only import it when debug plots are written
 
 
 def save_all_wells(region_props_array, spot_ids_, output_folder, well_name):
@@ -23,14 +25,76 @@ def save_all_wells(region_props_array, spot_ids_, output_folder, well_name):
                 )
 
 
+def stack_spot_rois(spot_props):
+    """
+    Stack the spot images and masks of a grid of spots into zero padded
+    buffers, so they can be pasted into an image at once.
+
+    :param np.ndarray spot_props: Grid of props describing
+        each segmented spot from image
+    :return np.ndarray rois: Spot images (nbr spots x max height x max width)
+    :return np.ndarray masks: Boolean spot masks, False in padding
+    :return np.ndarray extents: Boolean spot bounding boxes, False in padding
+    :return np.ndarray origins: Top left corner (row, col) of spots in image
+    """
+    props = [spot_prop for spot_prop in spot_props.ravel() if spot_prop is not None]
+    origins = np.array(
+        [[spot_prop.spot_dict['bbox_row_min'], spot_prop.spot_dict['bbox_col_min']]
+         for spot_prop in props],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    shapes = np.array(
+        [spot_prop.image.shape for spot_prop in props],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    max_shape = tuple(shapes.max(axis=0)) if len(props) > 0 else (0, 0)
+    rois = np.zeros((len(props),) + max_shape)
+    masks = np.zeros(rois.shape, dtype=bool)
+    for idx, spot_prop in enumerate(props):
+        height, width = shapes[idx]
+        rois[idx, :height, :width] = spot_prop.image
+        masks[idx, :height, :width] = spot_prop.mask > 0
+    extents = (np.arange(max_shape[0])[np.newaxis, :, np.newaxis] <
+               shapes[:, 0, np.newaxis, np.newaxis]) & \
+        (np.arange(max_shape[1])[np.newaxis, np.newaxis, :] <
+         shapes[:, 1, np.newaxis, np.newaxis])
+    return rois, masks, extents, origins
+
+
+def composite_spots(spot_props, image, from_source=False):
+    """
+    Creates a grey image with only the grid of spots on top of it.
+    if from_source, the whole spot ROI is shown, otherwise the
+    spot intensities inside the spot masks are shown.
+    All spots are pasted at once from the stacked spot ROIs.
+
+    :param np.ndarray spot_props: Grid of props describing
+        each segmented spot from image
+    :param np.ndarray image:
+        image representing original image data with all spots
+    :param from_source: bool
+        True : whole spot ROIs (crops of image) are shown
+        False : spot intensities inside spot masks are shown
+    :return np.ndarray bbox_image: Composite image of spots
+    """
+    bbox_image = np.full(image.shape, np.mean(image))
+    rois, masks, extents, origins = stack_spot_rois(spot_props)
+    # Flat image index of every ROI pixel, spot ROIs are crops of the image
+    flat_idx = (origins[:, 0] * image.shape[1] + origins[:, 1])[:, np.newaxis, np.newaxis] + \
+        (np.arange(rois.shape[1]) * image.shape[1])[np.newaxis, :, np.newaxis] + \
+        np.arange(rois.shape[2])[np.newaxis, np.newaxis, :]
+    # Show all intensities within bounding boxes, or only inside masks
+    paste = extents if from_source else masks
+    bbox_image.reshape(-1)[flat_idx[paste]] = rois[paste]
+    return bbox_image
+
+
 def save_composite_spots(spot_props,
                          output_name,
                          image,
                          from_source=False):
     """
-    Creates a grey image and plots only the grid of spots on top of it.
-    if from_source, the whole spot ROI is plotted, otherwise the
-    spot intensities inside the spot masks are plotted.
+    Writes a composite image of the grid of spots, see composite_spots.
 
     :param np.ndarray spot_props: Grid of props describing
         each segmented spot from image
@@ -42,28 +106,7 @@ def save_composite_spots(spot_props,
         True : images are extracted from source array
         False : images are pulled from regionprops.intensity_image
     """
-    bbox_image = np.mean(image) * np.ones(image.shape)
-
-    # Loop through grid of all spots
-    for row in range(spot_props.shape[0]):
-        for col in range(spot_props.shape[1]):
-            # Get properties for individual spot
-            spot_prop = spot_props[row, col]
-            spot_dict = spot_prop.spot_dict
-            if spot_prop is not None:
-                min_row = spot_dict['bbox_row_min']
-                min_col = spot_dict['bbox_col_min']
-                max_row = spot_dict['bbox_row_max']
-                max_col = spot_dict['bbox_col_max']
-                if not from_source:
-                    # Plot only intensities inside mask
-                    bbox_mask = bbox_image[min_row:max_row, min_col:max_col]
-                    bbox_mask[spot_prop.mask > 0] = spot_prop.image[spot_prop.mask > 0]
-                else:
-                    # Plot all intensities within bounding box
-                    bbox_image[min_row:max_row, min_col:max_col] = \
-                        image[min_row:max_row, min_col:max_col]
-
+    bbox_image = composite_spots(spot_props, image, from_source)
     write_name = output_name + "_composite_spots_prop.png"
     if from_source:
         write_name = output_name + "_composite_spots_img.png"
@@ -74,6 +117,7 @@ def plot_centroid_overlay(im_crop,
                           params,
                           spots_df,
                           output_name):
+    import matplotlib.pyplot as plt
 
     plt.imshow(im_crop, cmap='gray')
     plt.colorbar()
@@ -98,50 +142,48 @@ def plot_centroid_overlay(im_crop,
     plt.close(figcentroid)
 
 
+def spots_to_grid(spots_df, col_name, grid_shape):
+    """
+    Place a spot statistic at the spots' grid positions.
+
+    :param pd.DataFrame spots_df: Stats for each spot in grid
+    :param str col_name: Column of spots_df to place
+    :param tuple grid_shape: Number of grid rows and columns
+    :return np.array grid: Spot values, NaN where there's no spot
+    """
+    grid = np.full(grid_shape, np.nan)
+    grid[spots_df['grid_row'].to_numpy(dtype=np.int64),
+         spots_df['grid_col'].to_numpy(dtype=np.int64)] = \
+        spots_df[col_name].to_numpy(dtype=np.float64)
+    return grid
+
+
 def plot_od(spots_df,
             nbr_grid_rows,
             nbr_grid_cols,
             output_name):
     """
-    Collect OD, intensity and background values for each spot and place
-    values in grid shaped arrays and plot them side by side.
+    Place OD, intensity and background values for each spot in grid shaped
+    arrays and plot them side by side.
 
     :param pd.DataFrame spots_df: Stats for each spot in grid
     :param int nbr_grid_rows: Number of grid rows
     :param int nbr_grid_cols: Number of grid columns
     :param str output_name: Path to image to be written minus exension
     """
-    intensity_well = np.empty((nbr_grid_rows, nbr_grid_cols))
-    bg_well = intensity_well.copy()
-    od_well = intensity_well.copy()
-
-    for r in np.arange(nbr_grid_rows):
-        for c in np.arange(nbr_grid_cols):
-            df_row = spots_df[(spots_df['grid_row'] == r) & (spots_df['grid_col'] == c)]
-            intensity_well[r, c] = df_row['intensity_median']
-            bg_well[r, c] = df_row['bg_median']
-            od_well[r, c] = df_row['od_norm']
-
-    plt.figure(figsize=(6, 1.5))
-    plt.subplot(131)
-    plt.imshow(intensity_well, cmap='gray')
-    plt.colorbar()
-    plt.title('intensity')
-
-    plt.subplot(132)
-    plt.imshow(bg_well, cmap='gray')
-    plt.colorbar()
-    plt.title('background')
-
-    plt.subplot(133)
-    plt.imshow(od_well, cmap='gray')
-    plt.colorbar()
-    plt.title('OD')
+    import matplotlib.pyplot as plt
 
-    figOD = plt.gcf()
-    od_debug = output_name + '_od.png'
-    figOD.savefig(od_debug)
-    plt.close(figOD)
+    grid_shape = (nbr_grid_rows, nbr_grid_cols)
+    fig, axes = plt.subplots(1, 3, figsize=(6, 1.5))
+    for ax, col_name, title in zip(
+            axes,
+            ['intensity_median', 'bg_median', 'od_norm'],
+            ['intensity', 'background', 'OD']):
+        im_ax = ax.imshow(spots_to_grid(spots_df, col_name, grid_shape), cmap='gray')
+        fig.colorbar(im_ax, ax=ax)
+        ax.set_title(title)
+    fig.savefig(output_name + '_od.png')
+    plt.close(fig)
 
 
 def plot_background_overlay(im, background, output_name):
@@ -177,6 +219,8 @@ def plot_registration(image,
     :param int max_intensity: Maximum image intensity (expecting uint8 or 16)
     :param int margin: Margin around spots to crop image before plotting
     """
+    import matplotlib.pyplot as plt
+
     im = (image / max_intensity * 255).astype(np.uint8)
 
     all_coords = np.vstack([spot_coords, grid_coords, reg_coords])
@@ -0,0 +1,115 @@
+import logging
+import numpy as np
+
+import array_analyzer.extract.constants as constants
+
+
+class DebugSampler:
+    """
+    Decides for which wells debug plots are written.
+    Writing debug plots for every well is expensive, so instead wells can be
+    sampled: every Nth well, a random fraction of wells, wells where
+    registration failed, and/or wells whose statistics are outliers compared
+    to the wells processed so far in the plate.
+    If no sampling policy is given, all wells are sampled when debug is on.
+    """
+    def __init__(self,
+                 debug=False,
+                 every_nth=None,
+                 fraction=None,
+                 failed=False,
+                 outliers=False,
+                 outlier_thresh=3.,
+                 min_history=8,
+                 random_seed=None):
+        """
+        :param bool debug: If False, no wells are sampled
+        :param int/None every_nth: Sample every Nth well (starting with the first)
+        :param float/None fraction: Sample a random fraction of wells [0, 1]
+        :param bool failed: Sample all wells where registration failed
+        :param bool outliers: Sample wells with outlier statistics
+        :param float outlier_thresh: Robust z-score (median/MAD based) above
+            which a well statistic is considered an outlier
+        :param int min_history: Minimum number of previous wells needed
+            before outliers can be detected
+        :param int random_seed: Optional random seed for deterministic sampling
+        """
+        self.logger = logging.getLogger(constants.LOG_NAME)
+        self.debug = debug
+        if every_nth is not None:
+            assert every_nth > 0, \
+                "every_nth must be a positive integer, not {}".format(every_nth)
+        if fraction is not None:
+            assert 0 <= fraction <= 1, \
+                "Debug fraction must be in [0, 1], not {}".format(fraction)
+        self.every_nth = every_nth
+        self.fraction = fraction
+        self.failed = failed
+        self.outliers = outliers
+        self.outlier_thresh = outlier_thresh
+        self.min_history = min_history
+        self.random_state = np.random.RandomState(random_seed)
+        # Sample everything if debug is on but no policy is given
+        self.sample_all = debug and not any([
+            every_nth is not None,
+            fraction is not None,
+            failed,
+            outliers,
+        ])
+        # History of well statistics, stat name: list of values
+        self.history = {}
+
+    def is_outlier(self, stat_name, value):
+        """
+        Compare a well statistic to the statistics of previously seen wells
+        using a robust z-score: |value - median| / (1.4826 * MAD).
+
+        :param str stat_name: Name of statistic (e.g. 'registered_dist')
+        :param float value: Value of statistic for current well
+        :return bool: True if value is an outlier
+        """
+        if value is None or not np.isfinite(value):
+            return False
+        history = self.history.get(stat_name, [])
+        if len(history) < self.min_history:
+            return False
+        history = np.array(history)
+        median = np.median(history)
+        mad = 1.4826 * np.median(np.abs(history - median))
+        if mad == 0:
+            return value != median
+        return abs(value - median) / mad > self.outlier_thresh
+
+    def sample_well(self, well_idx, registration_ok=True, well_stats=None):
+        """
+        Decide if debug plots should be saved for current well.
+        Well statistics are added to the history after the outlier check.
+
+        :param int well_idx: Index of well in processing order
+        :param bool registration_ok: False if registration failed for well
+        :param dict/None well_stats: Well statistics used for outlier
+            detection (e.g. {'registered_dist': 2.3, 'od_median': .1})
+        :return bool sample: True if debug plots should be saved
+        """
+        if not self.debug:
+            return False
+        sample = self.sample_all
+        if self.failed and not registration_ok:
+            sample = True
+        if self.every_nth is not None and well_idx % self.every_nth == 0:
+            sample = True
+        # Always draw so that sampling doesn't depend on other criteria
+        if self.fraction is not None and \
+                self.random_state.random_sample() < self.fraction:
+            sample = True
+        if well_stats is not None:
+            for stat_name, value in well_stats.items():
+                if self.outliers and self.is_outlier(stat_name, value):
+                    self.logger.debug(
+                        "Well {} is an outlier in {}: {}".format(
+                            well_idx, stat_name, value),
+                    )
+                    sample = True
+                if value is not None and np.isfinite(value):
+                    self.history.setdefault(stat_name, []).append(value)
+        return sample
@@ -6,6 +6,8 @@ import os
 import pandas as pd
 
 import array_analyzer.extract.constants as constants
+import array_analyzer.load.xlsx_writer as xlsx_writer
+import array_analyzer.utils.plate_geometry as plate_geometry
 
 
 class ReportWriter:
@@ -15,17 +17,25 @@ class ReportWriter:
     where each sheet correspond to a given antigen at a given grid location.
     Each sheet is a dataframe corresponding to all wells in a plate.
     Plates are traditionally represented with numerical columns and
-    alphabetical rows.
+    alphabetical rows, the plate size is given by the run context
+    plate geometry (96 wells if None).
     """
-    def __init__(self):
+    def __init__(self, run_context):
         """
         Create dataframe with antigen names and well grid locations.
+
+        :param RunContext run_context: Run context with antigen array,
+            plate geometry and run path where reports are written
         """
         self.logger = logging.getLogger(constants.LOG_NAME)
+        self.plate = run_context.plate_geometry
+        if self.plate is None:
+            self.plate = plate_geometry.PlateGeometry()
+        self.grid_shape = run_context.antigen_array.shape
 
         # Dataframe for antigen positions on grid
         self.antigen_df = pd.DataFrame(columns=['antigen', 'grid_row', 'grid_col'])
-        for antigen_position, antigen in np.ndenumerate(constants.ANTIGEN_ARRAY):
+        for antigen_position, antigen in np.ndenumerate(run_context.antigen_array):
             if antigen == '' or antigen is None:
                 continue
             # Abbreviate antigen name if too long
@@ -42,13 +52,20 @@ class ReportWriter:
             self.antigen_df = self.antigen_df.append(idx_row, ignore_index=True)
 
         self.antigen_names = list(self.antigen_df['antigen'].values)
+        # Flattened grid index of each antigen
+        self.antigen_grid_idx = np.ravel_multi_index(
+            (self.antigen_df['grid_row'].values.astype(np.int64),
+             self.antigen_df['grid_col'].values.astype(np.int64)),
+            self.grid_shape,
+        )
         self.report_int = None
         self.report_bg = None
         self.report_od = None
         # Report paths
-        self.od_path = os.path.join(constants.RUN_PATH, 'median_ODs.xlsx')
-        self.int_path = os.path.join(constants.RUN_PATH, 'median_intensities.xlsx')
-        self.bg_path = os.path.join(constants.RUN_PATH, 'median_backgrounds.xlsx')
+        run_path = run_context.run_path
+        self.od_path = os.path.join(run_path, 'median_ODs.xlsx')
+        self.int_path = os.path.join(run_path, 'median_intensities.xlsx')
+        self.bg_path = os.path.join(run_path, 'median_backgrounds.xlsx')
 
     def get_antigen_df(self):
         """
@@ -63,9 +80,7 @@ class ReportWriter:
         Creates three new reports with sheets corresponding to antigen names.
         """
         # Dataframe for a whole plate
-        rows = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-        cols = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
-        plate_df = pd.DataFrame(None, index=rows, columns=cols)
+        plate_df = self.plate.to_df()
 
         report_dict = collections.OrderedDict()
         for sheet_name in self.antigen_names:
@@ -88,22 +103,33 @@ class ReportWriter:
             "Intensity report doesn't exist: {}".format(self.int_path)
         assert os.path.isfile(self.bg_path), \
             "Background report doesn't exist: {}".format(self.bg_path)
-        # Read reports and make sure they have the right keys
-        ordered_dict = pd.read_excel(self.od_path, sheet_name=None, index_col=0)
-        assert list(ordered_dict) == self.antigen_names, \
-            "Existing report keys don't match current keys"
-        self.report_od = ordered_dict
+        # Read reports and make sure they have the right keys and plate size
+        self.report_od = self._read_report(self.od_path)
         self.logger.debug('Loaded existing OD report')
-        ordered_dict = pd.read_excel(self.int_path, sheet_name=None, index_col=0)
-        assert list(ordered_dict) == self.antigen_names, \
-            "Existing report keys don't match current keys"
-        self.report_int = ordered_dict
+        self.report_int = self._read_report(self.int_path)
         self.logger.debug('Loaded existing intensity report')
-        ordered_dict = pd.read_excel(self.bg_path, sheet_name=None, index_col=0)
+        self.report_bg = self._read_report(self.bg_path)
+        self.logger.debug('Loaded existing background report')
+
+    def _read_report(self, report_path):
+        """
+        Read a plate report and check that its sheets match the antigens and
+        plate geometry of the current run.
+
+        :param str report_path: Path to report xlsx file
+        :return OrderedDict ordered_dict: Plate dataframe per antigen
+        """
+        ordered_dict = pd.read_excel(report_path, sheet_name=None, index_col=0)
         assert list(ordered_dict) == self.antigen_names, \
             "Existing report keys don't match current keys"
-        self.report_bg = ordered_dict
-        self.logger.debug('Loaded existing background report')
+        for sheet_name, sheet_df in ordered_dict.items():
+            assert sheet_df.shape == self.plate.shape, \
+                "Existing report plate size {} doesn't match {}".format(
+                    sheet_df.shape, self.plate.shape)
+            # Use the same labels as new reports
+            sheet_df.index = self.plate.row_names
+            sheet_df.columns = self.plate.col_names
+        return ordered_dict
 
     def assign_well_to_plate(self, well_name, spots_df):
         """
@@ -113,19 +139,23 @@ class ReportWriter:
         :param str well_name: Well name (e.g. 'B12')
         :param pd.DataFrame spots_df: Metrics for all spots in a well
         """
-        plate_row = well_name[0]
-        plate_col = well_name[1:]
-        for idx, antigen_row in self.antigen_df.iterrows():
-            spots_row = spots_df.loc[
-                (spots_df['grid_row'] == antigen_row['grid_row']) &
-                (spots_df['grid_col'] == antigen_row['grid_col']),
-            ]
-            self.report_int[antigen_row['antigen']].at[plate_row, plate_col] = \
-                spots_row['intensity_median'].values[0]
-            self.report_bg[antigen_row['antigen']].at[plate_row, plate_col] = \
-                spots_row['bg_median'].values[0]
-            self.report_od[antigen_row['antigen']].at[plate_row, plate_col] = \
-                spots_row['od_norm'].values[0]
+        row_idx, col_idx = self.plate.well_position(well_name)
+        # Look up antigen spots on the grid, using the first spot if
+        # there are duplicates
+        spots_df = spots_df.iloc[::-1]
+        spots_grid_idx = np.ravel_multi_index(
+            (spots_df['grid_row'].values.astype(np.int64),
+             spots_df['grid_col'].values.astype(np.int64)),
+            self.grid_shape,
+        )
+        for col_name, report_dict in [('intensity_median', self.report_int),
+                                      ('bg_median', self.report_bg),
+                                      ('od_norm', self.report_od)]:
+            grid_values = np.full(np.prod(self.grid_shape), np.nan)
+            grid_values[spots_grid_idx] = spots_df[col_name].values
+            antigen_values = grid_values[self.antigen_grid_idx]
+            for antigen_name, value in zip(self.antigen_names, antigen_values):
+                report_dict[antigen_name].iat[row_idx, col_idx] = value
         self.logger.debug("Assigned well {} to plate reports".format(well_name))
 
     def write_reports(self):
@@ -134,20 +164,11 @@ class ReportWriter:
         intensity, and background.
         """
         # Write OD report
-        with pd.ExcelWriter(self.od_path) as writer:
-            for antigen_name in self.antigen_names:
-                sheet_df = self.report_od[antigen_name]
-                sheet_df.to_excel(writer, sheet_name=antigen_name)
+        xlsx_writer.write_sheets(self.od_path, self.report_od)
         self.logger.debug("Wrote OD plate report")
         # Write intensity report
-        with pd.ExcelWriter(self.int_path) as writer:
-            for antigen_name in self.antigen_names:
-                sheet_df = self.report_int[antigen_name]
-                sheet_df.to_excel(writer, sheet_name=antigen_name)
+        xlsx_writer.write_sheets(self.int_path, self.report_int)
         self.logger.debug("Wrote intensity plate report")
         # Write background report
-        with pd.ExcelWriter(self.bg_path) as writer:
-            for antigen_name in self.antigen_names:
-                sheet_df = self.report_bg[antigen_name]
-                sheet_df.to_excel(writer, sheet_name=antigen_name)
+        xlsx_writer.write_sheets(self.bg_path, self.report_bg)
         self.logger.debug("Wrote background plate report")
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+import array_analyzer.extract.constants as constants
+
+
+def _to_builtin(obj):
+    """
+    Convert numpy types that json can't serialize to builtin types.
+
+    :param obj: Object to be converted
+    :return: Builtin python version of object
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("Can't serialize {} of type {}".format(obj, type(obj)))
+
+
+def hash_file(file_path, chunk_size=2 ** 20):
+    """
+    Compute SHA1 hash of file content.
+
+    :param str file_path: Path to file
+    :param int chunk_size: Number of bytes to read at a time
+    :return str: Hex digest of file content
+    """
+    file_hash = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def hash_params(workflow, params, fiducials_idx, antigen_array, background='polynomial'):
+    """
+    Compute a hash of everything besides the image that determines a well's
+    results: workflow, array and imaging parameters parsed from metadata,
+    array layout and the processing constants.
+
+    :param str workflow: Workflow name, e.g. 'array_fit'
+    :param dict params: Array and imaging parameters
+    :param list fiducials_idx: Fiducial indices in grid
+    :param np.array antigen_array: Antigen names on the grid
+    :param str background: Background estimation method
+    :return str: Hex digest of parameters
+    """
+    param_dict = {
+        'cache_version': constants.CACHE_VERSION,
+        'workflow': workflow,
+        'params': params,
+        'fiducials_idx': fiducials_idx,
+        'antigen_array': antigen_array,
+        'stds': constants.STDS,
+        'nbr_particles': constants.NBR_PARTICLES,
+        'reg_dist_thresh': constants.REG_DIST_THRESH,
+        'min_nbr_spots': constants.MIN_NBR_SPOTS,
+        'spot_min_percent_area': constants.SPOT_MIN_PERCENT_AREA,
+    }
+    # Default background isn't hashed so existing caches stay valid
+    if background != 'polynomial':
+        param_dict['background'] = {
+            'method': background,
+            'spot_radius': constants.BG_SPOT_RADIUS,
+            'min_block_fraction': constants.BG_MIN_BLOCK_FRACTION,
+            'crop_margin_spots': constants.BG_CROP_MARGIN_SPOTS,
+            'annulus_offset': constants.BG_ANNULUS_OFFSET,
+            'annulus_width': constants.BG_ANNULUS_WIDTH,
+        }
+    param_str = json.dumps(param_dict, sort_keys=True, default=_to_builtin)
+    return hashlib.sha1(param_str.encode('utf-8')).hexdigest()
+
+
+class WellCache:
+    """
+    Cache of well results stored in the run directory, one file per well.
+    Each entry is keyed by the content hash of the well image and a hash
+    of the parameters used to process it, so that a rerun only needs to
+    recompute wells whose image or parameters have changed.
+    Entries are written as soon as a well is done, so they also serve as
+    checkpoints for resuming an interrupted run.
+    """
+    def __init__(self, run_path, param_hash):
+        """
+        :param str run_path: Run directory where the cache subdirectory is stored
+        :param str param_hash: Hash of parameters, see hash_params
+        """
+        self.logger = logging.getLogger(constants.LOG_NAME)
+        self.cache_dir = os.path.join(run_path, constants.CACHE_DIR_NAME)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.param_hash = param_hash
+
+    def _get_path(self, well_name):
+        """
+        :param str well_name: Well name (e.g. 'B12')
+        :return str: Path to cache file for well
+        """
+        return os.path.join(self.cache_dir, well_name + '.json')
+
+    def _read_entry(self, well_name, image_hash):
+        """
+        Read cache entry for a well if image and parameters match.
+
+        :param str well_name: Well name (e.g. 'B12')
+        :param str image_hash: Content hash of current well image
+        :return dict/None entry: Cache entry, None if there's no valid entry
+        """
+        cache_path = self._get_path(well_name)
+        if not os.path.isfile(cache_path):
+            return None
+        try:
+            with open(cache_path, 'r') as f:
+                entry = json.load(f)
+        except ValueError:
+            self.logger.warning("Corrupt cache entry for {}".format(well_name))
+            return None
+        if entry['image_hash'] != image_hash or \
+                entry['param_hash'] != self.param_hash:
+            return None
+        return entry
+
+    def _write_entry(self, well_name, entry):
+        """
+        Write cache entry atomically, so that a process that is killed
+        while writing doesn't leave a partial entry behind.
+
+        :param str well_name: Well name (e.g. 'B12')
+        :param dict entry: Cache entry
+        """
+        cache_path = self._get_path(well_name)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f, default=_to_builtin)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, cache_path)
+
+    def load(self, well_name, image_hash):
+        """
+        Load cached spot metrics for a well if image and parameters match.
+
+        :param str well_name: Well name (e.g. 'B12')
+        :param str image_hash: Content hash of current well image
+        :return pd.DataFrame/None spots_df: Metrics for all spots in well,
+            None if there's no valid cache entry or the well failed
+        """
+        entry = self._read_entry(well_name, image_hash)
+        if entry is None or entry['status'] != 'done':
+            return None
+        spots_df = pd.DataFrame(entry['spots'])
+        self.logger.debug("Loaded cached results for {}".format(well_name))
+        return spots_df
+
+    def is_failed(self, well_name, image_hash):
+        """
+        Check if processing of well failed with current image and parameters.
+
+        :param str well_name: Well name (e.g. 'B12')
+        :param str image_hash: Content hash of current well image
+        :return bool: True if well has been processed and failed
+        """
+        entry = self._read_entry(well_name, image_hash)
+        return entry is not None and entry['status'] == 'failed'
+
+    def save(self, well_name, image_hash, spots_df):
+        """
+        Store spot metrics for a well.
+
+        :param str well_name: Well name (e.g. 'B12')
+        :param str image_hash: Content hash of well image
+        :param pd.DataFrame spots_df: Metrics for all spots in well
+        """
+        entry = {
+            'status': 'done',
+            'image_hash': image_hash,
+            'param_hash': self.param_hash,
+            'spots': spots_df.to_dict(orient='list'),
+        }
+        self._write_entry(well_name, entry)
+
+    def save_failed(self, well_name, image_hash, reason=''):
+        """
+        Record that processing failed for a well, so that a resumed run
+        doesn't have to repeat it.
+
+        :param str well_name: Well name (e.g. 'B12')
+        :param str image_hash: Content hash of well image
+        :param str reason: Why processing failed
+        """
+        entry = {
+            'status': 'failed',
+            'image_hash': image_hash,
+            'param_hash': self.param_hash,
+            'reason': reason,
+        }
+        self._write_entry(well_name, entry)
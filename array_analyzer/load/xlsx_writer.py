@@ -0,0 +1,61 @@
+import numpy as np
+import openpyxl
+import os
+
+
+def _cell_value(value):
+    """
+    Convert a dataframe value to a value openpyxl can write. Missing values
+    are written as empty cells like pandas does.
+
+    :param value: Dataframe value
+    :return: Python scalar, string or None
+    """
+    if value is None:
+        return None
+    if isinstance(value, (float, np.floating)) and np.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+
+def _write_df(worksheet, df):
+    """
+    Stream a dataframe to a write only worksheet, with the index in the first
+    column and column names in the first row, so it reads back with
+    pd.read_excel(..., index_col=0).
+
+    :param worksheet: openpyxl write only worksheet
+    :param pd.DataFrame df: Dataframe to write
+    """
+    worksheet.append(
+        [_cell_value(df.index.name)] + [_cell_value(col) for col in df.columns],
+    )
+    for row in df.itertuples(index=True, name=None):
+        worksheet.append([_cell_value(value) for value in row])
+
+
+def write_sheets(xlsx_path, sheets):
+    """
+    Write dataframes to sheets of an xlsx file in one pass. Rows are streamed
+    to a write only workbook so memory doesn't grow with the number of
+    sheets, and the file is written to a temporary path and renamed so an
+    interrupted write doesn't leave a truncated file.
+
+    :param str xlsx_path: Path to xlsx file
+    :param dict sheets: Sheet names as keys and dataframes as values,
+        written in order
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_name, df in sheets.items():
+        worksheet = workbook.create_sheet(title=str(sheet_name))
+        _write_df(worksheet, df)
+    if len(sheets) == 0:
+        # A workbook needs at least one sheet
+        workbook.create_sheet()
+    tmp_path = xlsx_path + '.tmp'
+    workbook.save(tmp_path)
+    os.replace(tmp_path, xlsx_path)
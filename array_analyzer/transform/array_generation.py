@@ -3,8 +3,10 @@ import numpy as np
 import pandas as pd
 
 import array_analyzer.extract.constants as constants
+import array_analyzer.extract.image_parser as image_parser
 import array_analyzer.extract.img_processing as img_processing
 import array_analyzer.extract.txt_parser as txt_parser
+import array_analyzer.utils.kernels as kernels
 import array_analyzer.utils.spot_regionprop as regionprop
 
 
@@ -59,7 +61,42 @@ def build_centroid_binary_blocks(cent_list, image_, params_, return_type='region
         return target
 
 
-def get_spot_intensity(coords, im, background, search_range=3):
+def get_annulus_background(im, spot_props, distance, annulus):
+    """
+    Background mean and median of each spot in an annulus around its mask,
+    see image_parser.generate_spot_background. Spot masks are painted into
+    one label image which is dilated once for all spots, and annulus pixels
+    are reduced by label.
+
+    :param np.array im: Intensity image the spot bounding boxes refer to
+    :param list spot_props: SpotRegionprop objects with mask and bounding box
+    :param int distance: Distance of annuli from spot edges in pixels
+    :param int annulus: Width of annuli in pixels
+    :return np.array bg_stats: Background mean and median per spot, NaN if
+        the annulus is empty (nbr spots x 2)
+    """
+    spot_labels = np.zeros(im.shape, dtype=np.uint16)
+    for label, spot_prop in enumerate(spot_props, start=1):
+        row_min = spot_prop.spot_dict['bbox_row_min']
+        col_min = spot_prop.spot_dict['bbox_col_min']
+        mask = spot_prop.mask > 0
+        label_roi = spot_labels[row_min:row_min + mask.shape[0],
+                                col_min:col_min + mask.shape[1]]
+        label_roi[mask] = label
+    annulus_labels = image_parser.generate_annulus_labels(
+        spot_labels,
+        distance=distance,
+        annulus=annulus,
+    )
+    is_annulus = annulus_labels > 0
+    return kernels.segment_stats(
+        im[is_annulus],
+        annulus_labels[is_annulus] - 1,
+        len(spot_props),
+    )
+
+
+def get_spot_intensity(coords, im, background, run_context, search_range=3):
     """
     Extract signal and background intensity at each spot given the spot coordinate
     with the following steps:
@@ -67,13 +104,16 @@ def get_spot_intensity(coords, im, background, search_range=3):
     2. Segment 1 single spot from each image
     3. Get median intensity, background and OD within the spot mask
     4. If segmentation in 2. returns no mask, use a circular mask with average spot size as the spot mask and do 3.
+    If background is None, the background of each spot is instead the median
+    of an annulus around its mask, see get_annulus_background.
 
     :param coords: list or tuple
         [row, col] coordinates of spots
     :param im: ndarray
         intensity image of the spots (signals)
-    :param background: ndarray
-        background image without spots
+    :param background: ndarray/None
+        background image without spots, None for annulus backgrounds
+    :param RunContext run_context: Run context with array parameters
     :param float search_range: Factor of bounding box size in which to search for
         spots. E.g. 2 searches 2 * 2 * bbox width * bbox height
     :return pd.DataFrame spots_df: Dataframe containing metrics for
@@ -82,10 +122,11 @@ def get_spot_intensity(coords, im, background, search_range=3):
         each spot in the grid
     """
     # values in mm
-    spot_width = constants.params['spot_width']
-    pix_size = constants.params['pixel_size']
-    n_rows = constants.params['rows']
-    n_cols = constants.params['columns']
+    spot_width = run_context.params['spot_width']
+    pix_size = run_context.params['pixel_size']
+    spot_width_pix = spot_width / pix_size
+    n_rows = run_context.params['rows']
+    n_cols = run_context.params['columns']
     # make spot size always odd
     spot_size = 2 * int(0.3 * spot_width / pix_size) + 1
     bbox_width = bbox_height = spot_size
@@ -126,17 +167,20 @@ def get_spot_intensity(coords, im, background, search_range=3):
         # Mask spot should cover a certain percentage of ROI
         if np.mean(mask_spot) > constants.SPOT_MIN_PERCENT_AREA:
             # Mask detected
-            bg_spot_lg, _ = img_processing.crop_image_at_center(
-                im=background,
-                center=coord,
-                height=spot_height,
-                width=spot_width,
-            )
+            bg_spot_lg = None
+            if background is not None:
+                bg_spot_lg, _ = img_processing.crop_image_at_center(
+                    im=background,
+                    center=coord,
+                    height=spot_height,
+                    width=spot_width,
+                )
             spot_prop.generate_props_from_mask(
                 image=im_spot_lg,
                 background=bg_spot_lg,
                 mask=mask_spot,
                 bbox=bbox_lg,
+                compute_stats=False,
             )
         else:
             # Crop around assumed spot size
@@ -146,19 +190,38 @@ def get_spot_intensity(coords, im, background, search_range=3):
                 bbox_height,
                 bbox_width,
             )
-            bg_spot, _ = img_processing.crop_image_at_center(
-                background,
-                coord,
-                bbox_height,
-                bbox_width,
-            )
+            bg_spot = None
+            if background is not None:
+                bg_spot, _ = img_processing.crop_image_at_center(
+                    background,
+                    coord,
+                    bbox_height,
+                    bbox_width,
+                )
             spot_prop.generate_props_from_disk(
                 image=im_spot,
                 background=bg_spot,
                 bbox=bbox,
                 centroid=coord,
+                compute_stats=False,
             )
-        spots_df = spots_df.append(spot_prop.spot_dict, ignore_index=True)
         spot_props[row_idx, col_idx] = spot_prop
 
+    # Compute stats of all spots at once
+    spot_list = list(spot_props.ravel())
+    bg_stats = None
+    if background is None:
+        bg_stats = get_annulus_background(
+            im=im,
+            spot_props=spot_list,
+            distance=int(np.rint(constants.BG_ANNULUS_OFFSET * spot_width_pix)),
+            annulus=max(int(np.rint(constants.BG_ANNULUS_WIDTH * spot_width_pix)), 1),
+        )
+        # Spot ROI backgrounds are constant at their annulus medians
+        for spot_prop, spot_bg in zip(spot_list, bg_stats):
+            spot_prop.background = np.full(spot_prop.image.shape, spot_bg[1])
+    regionprop.compute_spot_stats(spot_list, bg_stats=bg_stats)
+    for spot_prop in spot_list:
+        spots_df = spots_df.append(spot_prop.spot_dict, ignore_index=True)
+
     return spots_df, spot_props
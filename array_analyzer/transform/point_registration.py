@@ -3,6 +3,7 @@ import logging
 import numpy as np
 
 import array_analyzer.extract.constants as constants
+import array_analyzer.utils.kernels as kernels
 
 
 def icp(source, target, max_iterate=50, matrix_diff=1.):
@@ -69,19 +70,21 @@ class ParticleFilter:
     Framework for registering grid points to spot coordinates using a
     particle filter approach.
     """
-    def __init__(self, spot_coords, im_shape, fiducials_idx, random_seed=None):
+    def __init__(self, spot_coords, im_shape, run_context, random_seed=None):
         """
         Initialize by creating grid coordinates and particles.
 
         :param np.array spot_coords: Coordinates of detected spots (nbr spots x 2)
         :param tuple im_shape: Image shape
-        :param list fiducials_idx: Indices of grid coordinates which are considered
+        :param RunContext run_context: Run context with array parameters,
+            spot distance and indices of grid coordinates which are considered
             fiducials
         :param int random_seed: Optional random seed for deterministic runs
         """
         self.logger = logging.getLogger(constants.LOG_NAME)
         self.im_shape = im_shape
-        self.fiducials_idx = fiducials_idx
+        self.run_context = run_context
+        self.fiducials_idx = run_context.fiducials_idx
         # Initialize random number generator
         np.random.seed(random_seed)
 
@@ -106,10 +109,10 @@ class ParticleFilter:
 
         :return np.array grid_coords: (row, col) coordinates for reference spots (nbr x 2)
         """
-        nbr_grid_rows = constants.params['rows']
-        nbr_grid_cols = constants.params['columns']
+        nbr_grid_rows = self.run_context.params['rows']
+        nbr_grid_cols = self.run_context.params['columns']
         # Distance between spots in pixels
-        spot_dist = constants.SPOT_DIST_PIX
+        spot_dist = self.run_context.spot_dist_pix
         # Assume center point is the center of image as starting point
         center_point = tuple((self.im_shape[0] / 2, self.im_shape[1] / 2))
         start_row = center_point[0] - spot_dist * (nbr_grid_rows - 1) / 2
@@ -190,19 +193,14 @@ class ParticleFilter:
             spots when running particle filter. Maximum nbr_outliers allowed is
             min(n(fiducial) - 2, n(spots) -2)
         """
-        # Use kNN module to petrain spot coords
-        dst = self.spot_coords.copy().astype(np.float32)
-        knn = cv.ml.KNearest_create()
-        labels = np.array(range(dst.shape[0])).astype(np.float32)
-        knn.train(dst, cv.ml.ROW_SAMPLE, labels)
+        nbr_spots = self.spot_coords.shape[0]
         # Make sure we don't have too many outliers
         if nbr_outliers > 0:
-            if min(len(labels) - nbr_outliers, self.fiducial_coords.shape[0] - nbr_outliers) < 2:
-                nbr_outliers = min(len(labels) - 2, self.fiducial_coords.shape[0] - 2)
+            if min(nbr_spots - nbr_outliers, self.fiducial_coords.shape[0] - nbr_outliers) < 2:
+                nbr_outliers = min(nbr_spots - 2, self.fiducial_coords.shape[0] - 2)
         self.logger.debug(
             "Particle filter, number of outliers: {}".format(nbr_outliers),
         )
-        dists = np.zeros(self.nbr_particles)
         temp_stds = self.standard_devs.copy()
         temp_particles = self.particles.copy()
 
@@ -210,20 +208,14 @@ class ParticleFilter:
         min_dist_old = 10 ** 6
         for i in range(max_iter):
 
-            for p in range(self.nbr_particles):
-                particle = temp_particles[p]
-                # Generate transformation matrix
-                t_matrix = self.get_translation_matrix(particle)
-                trans_coords = cv.transform(np.array([self.fiducial_coords]), t_matrix)
-                trans_coords = trans_coords[0].astype(np.float32)
-                # Find nearest spots
-                ret, results, neighbors, dist = knn.findNearest(trans_coords, 1)
-                if nbr_outliers > 0:
-                    # Remove worst fitted spots
-                    dist = np.sort(dist, axis=0)
-                    dist = dist[:-nbr_outliers]
-
-                dists[p] = sum(dist)
+            # Squared distances from transformed fiducials to nearest spots,
+            # without worst fitted spots
+            dists = kernels.particle_dists(
+                temp_particles,
+                self.fiducial_coords,
+                self.spot_coords,
+                nbr_outliers,
+            )
 
             min_dist = np.min(dists)
             self.logger.debug("Iteration: {} min dist: {}".format(i, min_dist))
@@ -1,2 +1,9 @@
-from . import visualize_elisa_spots
+import importlib
 
+
+def __getattr__(name):
+    # Import submodules on first access, so importing a utility module
+    # doesn't import matplotlib and pandas for visualize_elisa_spots
+    if name == 'visualize_elisa_spots':
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
@@ -7,7 +7,8 @@ import numpy as np
 import os
 import skimage.io as io
 from skimage.color import rgb2grey
-import re
+
+import array_analyzer.utils.plate_geometry as plate_geometry
 
 
 def read_to_grey(path_, wellimage_):
@@ -61,20 +62,22 @@ def get_max_intensity(im):
     return max_intensity
 
 
-def get_image_paths(input_dir):
+def find_image_paths(input_dir):
     """
-    Searches input directory and its subdirectory for all images
-    and returns sorted list of paths.
+    Searches input directory and its subdirectory for well images.
 
     :param str input_dir: Input directory, may contain images or subdirectories
         with one image each
-    :return dict well_images: Well name key, path to found image value
+    :return dict well_images: Well name key, path to found image value,
+        empty if there are no images. Image or subdirectory names start with
+        the well name, e.g. B12.png or B12_xxx.png. If several images start
+        with the same well name, the first in natural sort order is used
     """
     extensions = ('.png', '.tif')
 
     image_names = []
     for ext in extensions:
-        search_str = os.path.join(input_dir,'[A-P][0-9]*'+ext)
+        search_str = os.path.join(input_dir,'[A-Z]*'+ext)
         image_names.extend(glob.glob(search_str, recursive=False))
 
     # Sort images
@@ -84,15 +87,17 @@ def get_image_paths(input_dir):
     if len(image_names) > 0:
         # Assume images are named e.g. A0.png
         for im_name in image_names:
-            well_name = os.path.basename(im_name)[:-4]
             # double-check that the file represents a well
-            if re.match(r'[A-P][0-9]{1,2}',well_name):
-                well_images[well_name] = im_name
+            match = plate_geometry.WELL_NAME_PREFIX_REGEX.match(
+                os.path.basename(im_name),
+            )
+            if match:
+                well_images.setdefault(match.group(0), im_name)
     else:
         # Micromanager naming convention, find well from subdir name
         image_names = []
         for ext in extensions:
-            search_str = os.path.join(input_dir,'[A-P][0-9]*','*'+ext)
+            search_str = os.path.join(input_dir,'[A-Z]*','*'+ext)
             image_names.extend(glob.glob(search_str, recursive=False))
 
         # Sort images
@@ -102,14 +107,32 @@ def get_image_paths(input_dir):
             # split again for well name, assume - separation
             well_name = well_name.split('-')[0]
             #  double-check that the file represents a well
-            if re.match(r'[A-P][0-9]{1,2}',well_name):
-                well_images[well_name] = im_name
+            match = plate_geometry.WELL_NAME_PREFIX_REGEX.match(well_name)
+            if match:
+                well_images.setdefault(match.group(0), im_name)
+    return well_images
+
+
+def get_image_paths(input_dir):
+    """
+    Searches input directory and its subdirectory for all images
+    and returns sorted list of paths.
 
+    :param str input_dir: Input directory, may contain images or subdirectories
+        with one image each
+    :return dict well_images: Well name key, path to found image value
+    """
+    well_images = find_image_paths(input_dir)
     # Check that wells are found, refer to docs if not
     assert len(well_images) > 0,\
         "No wells found, check documentation for naming conventions"\
         "And conversion scripts 12to16bit.py and rename_only.py"
 
+    # Order wells by plate row then column, rows after Z are AA, AB...
+    well_images = {
+        well_name: well_images[well_name]
+        for well_name in sorted(well_images, key=plate_geometry.well_sort_key)
+    }
     return well_images
 
 
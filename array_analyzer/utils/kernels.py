@@ -0,0 +1,200 @@
+import numpy as np
+import os
+
+import array_analyzer.extract.constants as constants
+
+# Number of particles scored at once by the NumPy particle kernel,
+# bounds the size of the particles x fiducials x spots distance array
+PARTICLE_CHUNK = 256
+# Compiled kernels module once imported, None if numba isn't installed
+_NOT_IMPORTED = object()
+_numba_kernels = _NOT_IMPORTED
+
+
+def _get_numba_kernels():
+    """
+    Import the compiled kernels, which requires numba. Numba is only
+    imported when a kernel is first used, and the import is only attempted
+    once per process.
+
+    :return module/None: numba_kernels, None if numba isn't installed
+    """
+    global _numba_kernels
+    if _numba_kernels is _NOT_IMPORTED:
+        try:
+            import array_analyzer.utils.numba_kernels as numba_kernels
+        except ImportError:
+            numba_kernels = None
+        _numba_kernels = numba_kernels
+    return _numba_kernels
+
+
+def use_numba():
+    """
+    Compiled kernels are used if numba is installed, unless the environment
+    variable constants.KERNELS_ENV is set to 'numpy', which forces the NumPy
+    reference implementations, e.g. for validation.
+
+    :return bool: True if compiled kernels are used
+    """
+    if os.environ.get(constants.KERNELS_ENV, '').lower() == 'numpy':
+        return False
+    return _get_numba_kernels() is not None
+
+
+def particle_dists(particles, fiducial_coords, spot_coords, nbr_outliers=0):
+    """
+    Score particles of the particle filter. Each particle's transform is
+    applied to the fiducial coordinates, and the squared distances from
+    transformed fiducials to their nearest spots are summed, leaving out
+    the nbr_outliers largest distances.
+
+    :param np.array particles: Particles x, y, angle (degrees) and scale
+        (nbr particles x 4)
+    :param np.array fiducial_coords: Fiducial grid coordinates (nbr fiducials x 2)
+    :param np.array spot_coords: Detected spot coordinates (nbr spots x 2)
+    :param int nbr_outliers: Number of worst fitted fiducials to leave out
+    :return np.array dists: Sum of squared distances per particle
+    """
+    particles = np.ascontiguousarray(particles, dtype=np.float64)
+    fiducial_coords = np.ascontiguousarray(fiducial_coords, dtype=np.float64)
+    spot_coords = np.ascontiguousarray(spot_coords, dtype=np.float64)
+    nbr_fit = fiducial_coords.shape[0] - nbr_outliers
+    if use_numba():
+        return _get_numba_kernels().particle_dists(
+            particles,
+            fiducial_coords,
+            spot_coords,
+            nbr_fit,
+        )
+    dists = np.empty(particles.shape[0])
+    for start in range(0, particles.shape[0], PARTICLE_CHUNK):
+        chunk = particles[start:start + PARTICLE_CHUNK]
+        angles = chunk[:, 2] * np.pi / 180
+        a = (chunk[:, 3] * np.cos(angles))[:, np.newaxis]
+        b = (chunk[:, 3] * np.sin(angles))[:, np.newaxis]
+        # Transformed fiducial coordinates (nbr particles x nbr fiducials)
+        rows = a * fiducial_coords[:, 0] + b * fiducial_coords[:, 1] + chunk[:, [0]]
+        cols = a * fiducial_coords[:, 1] - b * fiducial_coords[:, 0] + chunk[:, [1]]
+        min_dists = np.min(
+            (rows[..., np.newaxis] - spot_coords[:, 0]) ** 2 +
+            (cols[..., np.newaxis] - spot_coords[:, 1]) ** 2,
+            axis=2,
+        )
+        if nbr_outliers > 0:
+            min_dists = np.sort(min_dists, axis=1)[:, :nbr_fit]
+        dists[start:start + PARTICLE_CHUNK] = np.sum(min_dists, axis=1)
+    return dists
+
+
+def block_medians(im, block_size, exclude=None, min_count=1):
+    """
+    Median intensity of each complete block_size x block_size block of an
+    image. Blocks are ordered by column then row, i.e. block (x, y) has
+    index y * nbr_blocks_x + x.
+
+    :param np.array im: 2D image
+    :param int block_size: Size of blocks
+    :param np.array/None exclude: Boolean mask of pixels excluded from
+        medians, e.g. spots
+    :param int min_count: Blocks with fewer pixels that aren't excluded
+        have median NaN
+    :return np.array medians: Median of blocks (nbr blocks,)
+    """
+    nbr_blocks_x = im.shape[0] // block_size
+    nbr_blocks_y = im.shape[1] // block_size
+    if use_numba():
+        if exclude is None:
+            return _get_numba_kernels().block_medians(
+                np.ascontiguousarray(im),
+                block_size,
+            )
+        return _get_numba_kernels().masked_block_medians(
+            np.ascontiguousarray(im),
+            np.ascontiguousarray(exclude, dtype=np.bool_),
+            block_size,
+            min_count,
+        )
+
+    def to_blocks(array):
+        array = array[:nbr_blocks_x * block_size, :nbr_blocks_y * block_size]
+        array = array.reshape(nbr_blocks_x, block_size, nbr_blocks_y, block_size)
+        return array.transpose(2, 0, 1, 3).reshape(nbr_blocks_x * nbr_blocks_y, -1)
+
+    blocks = to_blocks(im)
+    if exclude is None:
+        return np.median(blocks, axis=1)
+    medians = np.full(blocks.shape[0], np.nan)
+    exclude_blocks = to_blocks(np.asarray(exclude, dtype=np.bool_))
+    counts = blocks.shape[1] - np.sum(exclude_blocks, axis=1)
+    valid = counts >= max(min_count, 1)
+    blocks = np.where(exclude_blocks[valid], np.nan, blocks[valid])
+    medians[valid] = np.nanmedian(blocks, axis=1)
+    return medians
+
+
+def segment_stats(values, segment_ids, nbr_segments):
+    """
+    Mean and median of values grouped by segment. Values are grouped in one
+    stable sort by segment, which is a radix sort for up to 2^16 segments,
+    and medians are taken of the contiguous groups.
+
+    :param np.array values: Values (nbr values,)
+    :param np.array segment_ids: Segment index of each value, 0 to
+        nbr_segments - 1 (nbr values,)
+    :param int nbr_segments: Number of segments
+    :return np.array stats: Mean and median per segment, NaN for segments
+        without values (nbr segments x 2)
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    id_dtype = np.uint16 if nbr_segments <= 2 ** 16 else np.int64
+    segment_ids = np.asarray(segment_ids).ravel().astype(id_dtype)
+    counts = np.bincount(segment_ids, minlength=nbr_segments)
+    sums = np.bincount(segment_ids, weights=values, minlength=nbr_segments)
+    stats = np.full((nbr_segments, 2), np.nan)
+    valid = counts > 0
+    stats[valid, 0] = sums[valid] / counts[valid]
+    grouped_values = values[np.argsort(segment_ids, kind='stable')]
+    ends = np.cumsum(counts)
+    for segment_id in np.flatnonzero(valid):
+        stats[segment_id, 1] = np.median(
+            grouped_values[ends[segment_id] - counts[segment_id]:ends[segment_id]],
+        )
+    return stats
+
+
+def spot_stats(images, backgrounds, masks):
+    """
+    Mean and median intensity and background within the masks of spots.
+    Spot ROIs can have different shapes.
+
+    :param list images: Spot intensity images
+    :param list backgrounds: Backgrounds corresponding to images
+    :param list masks: Spot masks corresponding to images
+    :return np.array stats: Intensity mean, intensity median, background mean
+        and background median per spot (nbr spots x 4)
+    """
+    nbr_spots = len(images)
+    if use_numba() and nbr_spots > 0:
+        # Pad ROIs to the largest shape, padding is outside masks
+        roi_shape = np.max([image.shape for image in images], axis=0)
+        image_stack = np.zeros((nbr_spots, roi_shape[0], roi_shape[1]))
+        bg_stack = np.zeros_like(image_stack)
+        mask_stack = np.zeros(image_stack.shape, dtype=np.bool_)
+        for i in range(nbr_spots):
+            roi_rows, roi_cols = images[i].shape
+            image_stack[i, :roi_rows, :roi_cols] = images[i]
+            bg_stack[i, :roi_rows, :roi_cols] = backgrounds[i]
+            mask_stack[i, :roi_rows, :roi_cols] = masks[i] > 0
+        return _get_numba_kernels().spot_stats(image_stack, bg_stack, mask_stack)
+    stats = np.empty((nbr_spots, 4))
+    for i in range(nbr_spots):
+        intensity_vals = images[i][masks[i] > 0]
+        bg_vals = backgrounds[i][masks[i] > 0]
+        stats[i] = [
+            np.mean(intensity_vals),
+            np.median(intensity_vals),
+            np.mean(bg_vals),
+            np.median(bg_vals),
+        ]
+    return stats
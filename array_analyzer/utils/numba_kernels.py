@@ -0,0 +1,122 @@
+import numba
+import numpy as np
+
+# Compiled versions of the kernels in kernels.py, parallel over particles,
+# blocks and spots. Kernels are cached on disk so that worker processes
+# don't compile them again.
+
+
+@numba.njit(parallel=True, cache=True)
+def particle_dists(particles, fiducial_coords, spot_coords, nbr_fit):
+    """
+    :param np.array particles: Particles x, y, angle (degrees) and scale
+        (nbr particles x 4)
+    :param np.array fiducial_coords: Fiducial grid coordinates (nbr fiducials x 2)
+    :param np.array spot_coords: Detected spot coordinates (nbr spots x 2)
+    :param int nbr_fit: Number of best fitted fiducials to sum distances of
+    :return np.array dists: Sum of squared distances per particle
+    """
+    nbr_particles = particles.shape[0]
+    nbr_fiducials = fiducial_coords.shape[0]
+    nbr_spots = spot_coords.shape[0]
+    dists = np.empty(nbr_particles)
+    for p in numba.prange(nbr_particles):
+        angle = particles[p, 2] * np.pi / 180
+        a = particles[p, 3] * np.cos(angle)
+        b = particles[p, 3] * np.sin(angle)
+        min_dists = np.empty(nbr_fiducials)
+        for f in range(nbr_fiducials):
+            row = a * fiducial_coords[f, 0] + b * fiducial_coords[f, 1] + particles[p, 0]
+            col = a * fiducial_coords[f, 1] - b * fiducial_coords[f, 0] + particles[p, 1]
+            min_dist = np.inf
+            for s in range(nbr_spots):
+                dist = (row - spot_coords[s, 0]) ** 2 + (col - spot_coords[s, 1]) ** 2
+                if dist < min_dist:
+                    min_dist = dist
+            min_dists[f] = min_dist
+        min_dists.sort()
+        dists[p] = np.sum(min_dists[:nbr_fit])
+    return dists
+
+
+@numba.njit(parallel=True, cache=True)
+def block_medians(im, block_size):
+    """
+    :param np.array im: 2D image
+    :param int block_size: Size of blocks
+    :return np.array medians: Median of blocks, block (x, y) at index
+        y * nbr_blocks_x + x
+    """
+    nbr_blocks_x = im.shape[0] // block_size
+    nbr_blocks_y = im.shape[1] // block_size
+    medians = np.empty(nbr_blocks_x * nbr_blocks_y)
+    for idx in numba.prange(nbr_blocks_x * nbr_blocks_y):
+        x = idx % nbr_blocks_x
+        y = idx // nbr_blocks_x
+        block = np.empty(block_size * block_size, dtype=im.dtype)
+        for i in range(block_size):
+            for j in range(block_size):
+                block[i * block_size + j] = im[x * block_size + i, y * block_size + j]
+        medians[idx] = np.median(block)
+    return medians
+
+
+@numba.njit(parallel=True, cache=True)
+def masked_block_medians(im, exclude, block_size, min_count):
+    """
+    :param np.array im: 2D image
+    :param np.array exclude: Boolean mask of pixels excluded from medians
+    :param int block_size: Size of blocks
+    :param int min_count: Blocks with fewer pixels that aren't excluded
+        have median NaN
+    :return np.array medians: Median of blocks, block (x, y) at index
+        y * nbr_blocks_x + x
+    """
+    nbr_blocks_x = im.shape[0] // block_size
+    nbr_blocks_y = im.shape[1] // block_size
+    medians = np.empty(nbr_blocks_x * nbr_blocks_y)
+    for idx in numba.prange(nbr_blocks_x * nbr_blocks_y):
+        x = idx % nbr_blocks_x
+        y = idx // nbr_blocks_x
+        block = np.empty(block_size * block_size, dtype=im.dtype)
+        nbr_vals = 0
+        for i in range(block_size):
+            for j in range(block_size):
+                if not exclude[x * block_size + i, y * block_size + j]:
+                    block[nbr_vals] = im[x * block_size + i, y * block_size + j]
+                    nbr_vals += 1
+        if nbr_vals < max(min_count, 1):
+            medians[idx] = np.nan
+        else:
+            medians[idx] = np.median(block[:nbr_vals])
+    return medians
+
+
+@numba.njit(parallel=True, cache=True)
+def spot_stats(images, backgrounds, masks):
+    """
+    :param np.array images: Spot intensity images (nbr spots x rows x cols)
+    :param np.array backgrounds: Backgrounds corresponding to images
+    :param np.array masks: Boolean spot masks corresponding to images
+    :return np.array stats: Intensity mean, intensity median, background mean
+        and background median per spot (nbr spots x 4)
+    """
+    nbr_spots = images.shape[0]
+    stats = np.empty((nbr_spots, 4))
+    for i in numba.prange(nbr_spots):
+        image = images[i].ravel()
+        background = backgrounds[i].ravel()
+        mask = masks[i].ravel()
+        intensity_vals = np.empty(mask.size)
+        bg_vals = np.empty(mask.size)
+        nbr_vals = 0
+        for j in range(mask.size):
+            if mask[j]:
+                intensity_vals[nbr_vals] = image[j]
+                bg_vals[nbr_vals] = background[j]
+                nbr_vals += 1
+        stats[i, 0] = np.mean(intensity_vals[:nbr_vals])
+        stats[i, 1] = np.median(intensity_vals[:nbr_vals])
+        stats[i, 2] = np.mean(bg_vals[:nbr_vals])
+        stats[i, 3] = np.median(bg_vals[:nbr_vals])
+    return stats
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+import re
+import string
+
+# Number of plate (rows, columns) for standard plate formats
+PLATE_FORMATS = {
+    96: (8, 12),
+    384: (16, 24),
+    1536: (32, 48),
+}
+
+# Well names are one or two row letters followed by a column number,
+# e.g. 'B12' or 'AF48' (rows after Z are AA, AB, ...)
+WELL_NAME_REGEX = re.compile(r'([A-Z]{1,2})([0-9]{1,2})$')
+# Well name at the start of an image name, which may be followed by a
+# suffix, e.g. 'B12_xxx'
+WELL_NAME_PREFIX_REGEX = re.compile(r'[A-Z]{1,2}[0-9]{1,2}(?![0-9])')
+
+
+def row_name(row_idx):
+    """
+    Convert a zero based plate row index to a row name.
+
+    :param int row_idx: Row index (0 -> 'A', 25 -> 'Z', 26 -> 'AA')
+    :return str row_name: Row name
+    """
+    letters = string.ascii_uppercase
+    if row_idx < len(letters):
+        return letters[row_idx]
+    return letters[row_idx // len(letters) - 1] + letters[row_idx % len(letters)]
+
+
+def parse_well_name(well_name):
+    """
+    Convert a well name to zero based plate row and column indices.
+
+    :param str well_name: Well name (e.g. 'B12')
+    :return int row_idx: Row index
+    :return int col_idx: Column index
+    """
+    match = WELL_NAME_REGEX.match(well_name)
+    if match is None:
+        raise ValueError("Invalid well name: {}".format(well_name))
+    letters, col = match.groups()
+    row_idx = string.ascii_uppercase.index(letters[-1])
+    if len(letters) == 2:
+        row_idx += 26 * (string.ascii_uppercase.index(letters[0]) + 1)
+    return row_idx, int(col) - 1
+
+
+def well_sort_key(well_name):
+    """
+    Sort key that orders well names row by row, with row 'Z' before 'AA'.
+
+    :param str well_name: Well name
+    :return tuple key: Row and column index
+    """
+    return parse_well_name(well_name)
+
+
+class PlateGeometry:
+    """
+    Rows and columns of a multi-well plate, and the mapping between well names,
+    integer well indices in row major order and plate arrays.
+    Plates are represented with alphabetical rows and numerical columns
+    starting at 1.
+    """
+    def __init__(self, nbr_rows=8, nbr_cols=12):
+        """
+        :param int nbr_rows: Number of plate rows
+        :param int nbr_cols: Number of plate columns
+        """
+        assert 0 < nbr_rows <= 52, \
+            "Number of plate rows must be in [1, 52], not {}".format(nbr_rows)
+        assert 0 < nbr_cols <= 99, \
+            "Number of plate columns must be in [1, 99], not {}".format(nbr_cols)
+        self.nbr_rows = nbr_rows
+        self.nbr_cols = nbr_cols
+        self.row_names = [row_name(row_idx) for row_idx in range(nbr_rows)]
+        self.col_names = [str(col_idx + 1) for col_idx in range(nbr_cols)]
+
+    @classmethod
+    def from_format(cls, plate_format):
+        """
+        Create plate geometry for a standard plate format.
+
+        :param int plate_format: Number of wells (96, 384 or 1536)
+        :return PlateGeometry: Plate geometry
+        """
+        plate_format = int(plate_format)
+        assert plate_format in PLATE_FORMATS, \
+            "Plate format must be one of {}, not {}".format(
+                list(PLATE_FORMATS), plate_format)
+        nbr_rows, nbr_cols = PLATE_FORMATS[plate_format]
+        return cls(nbr_rows, nbr_cols)
+
+    @property
+    def shape(self):
+        return self.nbr_rows, self.nbr_cols
+
+    @property
+    def nbr_wells(self):
+        return self.nbr_rows * self.nbr_cols
+
+    def well_position(self, well_name):
+        """
+        Row and column index of a well, checked against plate size.
+
+        :param str well_name: Well name (e.g. 'B12')
+        :return int row_idx: Row index
+        :return int col_idx: Column index
+        """
+        row_idx, col_idx = parse_well_name(well_name)
+        if row_idx >= self.nbr_rows or col_idx >= self.nbr_cols:
+            raise ValueError("Well {} is outside a {} x {} plate".format(
+                well_name, self.nbr_rows, self.nbr_cols))
+        return row_idx, col_idx
+
+    def well_index(self, well_name):
+        """
+        :param str well_name: Well name (e.g. 'B12')
+        :return int well_idx: Well index in row major order
+        """
+        row_idx, col_idx = self.well_position(well_name)
+        return row_idx * self.nbr_cols + col_idx
+
+    def well_indices(self, well_names):
+        """
+        :param list well_names: Well names
+        :return np.array well_idxs: Well indices in row major order
+        """
+        return np.array(
+            [self.well_index(well_name) for well_name in well_names],
+            dtype=np.int64,
+        )
+
+    def well_name(self, well_idx):
+        """
+        :param int well_idx: Well index in row major order
+        :return str well_name: Well name
+        """
+        row_idx, col_idx = divmod(int(well_idx), self.nbr_cols)
+        return self.row_names[row_idx] + self.col_names[col_idx]
+
+    def well_names(self):
+        """
+        :return list well_names: All well names in row major order
+        """
+        return [row + col for row in self.row_names for col in self.col_names]
+
+    def to_array(self, well_names, values, fill_value=np.nan):
+        """
+        Place values of the given wells at their plate positions.
+
+        :param list well_names: Well names
+        :param array-like values: One value per well
+        :param fill_value: Value for wells that aren't given
+        :return np.array plate_array: Values in a nbr_rows x nbr_cols array
+        """
+        values = np.asarray(values)
+        assert len(well_names) == values.shape[0], \
+            "Number of wells and values must match"
+        dtype = np.result_type(values, np.asarray(fill_value))
+        plate_array = np.full(self.nbr_wells, fill_value, dtype=dtype)
+        plate_array[self.well_indices(well_names)] = values
+        return plate_array.reshape(self.shape)
+
+    def to_df(self, plate_array=None):
+        """
+        Plate dataframe with row names as index and column names as columns.
+
+        :param np.array/None plate_array: Plate values, empty if None
+        :return pd.DataFrame plate_df: Plate dataframe
+        """
+        if plate_array is not None:
+            assert plate_array.shape == self.shape, \
+                "Plate array shape {} doesn't match plate {}".format(
+                    plate_array.shape, self.shape)
+        return pd.DataFrame(
+            plate_array,
+            index=self.row_names,
+            columns=self.col_names,
+        )
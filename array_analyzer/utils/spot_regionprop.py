@@ -4,6 +4,7 @@ from skimage import measure
 from skimage.morphology import disk
 
 import array_analyzer.extract.constants as constants
+import array_analyzer.utils.kernels as kernels
 
 
 class SpotRegionprop:
@@ -42,12 +43,21 @@ class SpotRegionprop:
         Optical density is affected by Beer-Lambert law
         i.e. I = I0*e^-{c*thickness). I0/I = e^{c*thickness).
         """
-        intensity_vals = self.image[self.mask > 0]
-        self.spot_dict['intensity_mean'] = np.mean(intensity_vals)
-        self.spot_dict['intensity_median'] = np.median(intensity_vals)
-        bg_vals = self.background[self.mask > 0]
-        self.spot_dict['bg_mean'] = np.mean(bg_vals)
-        self.spot_dict['bg_median'] = np.median(bg_vals)
+        stats = kernels.spot_stats([self.image], [self.background], [self.mask])
+        self.assign_stats(stats[0])
+
+    def assign_stats(self, stats):
+        """
+        Assign mean and median of spot intensity and background, and compute
+        OD from the medians.
+
+        :param np.array stats: Intensity mean, intensity median, background
+            mean and background median, see kernels.spot_stats
+        """
+        self.spot_dict['intensity_mean'] = stats[0]
+        self.spot_dict['intensity_median'] = stats[1]
+        self.spot_dict['bg_mean'] = stats[2]
+        self.spot_dict['bg_median'] = stats[3]
         with np.errstate(divide='ignore'):
             self.spot_dict['od_norm'] = np.log10(
                 self.spot_dict['bg_median'] / self.spot_dict['intensity_median'],
@@ -56,14 +66,17 @@ class SpotRegionprop:
             # TODO: What should be the default when intensity is zero?
             self.spot_dict['od_norm'] = 2.
 
-    def generate_props_from_disk(self, image, background, bbox, centroid):
+    def generate_props_from_disk(self, image, background, bbox, centroid, compute_stats=True):
         """
         Assign properties from disk shaped mask.
 
         :param np.ndarray image: Large single spot ROI intensity image
-        param np.ndarray background: Background corresponding to image
+        param np.ndarray/None background: Background corresponding to image,
+            None if it's assigned later, e.g. from an annulus around the spot
         :param list bbox: Bounding box of single spot image
         :param list/tuple centroid: Center coordinate
+        :param bool compute_stats: Compute spot stats, else they're computed
+            for all spots with compute_spot_stats
         """
         # Create disk mask
         self.mask = self.make_mask(image.shape[0])
@@ -78,17 +91,21 @@ class SpotRegionprop:
         self.spot_dict['bbox_row_max'] = bbox[2]
         self.spot_dict['bbox_col_max'] = bbox[3]
 
-        self.compute_stats()
+        if compute_stats:
+            self.compute_stats()
 
-    def generate_props_from_mask(self, image, background, mask, bbox):
+    def generate_props_from_mask(self, image, background, mask, bbox, compute_stats=True):
         """
         converts binarized image into region-properties using
         scikit-image.
 
         :param np.ndarray image: Large single spot ROI intensity image
-        :param np.ndarray background: Background corresponding to image
+        :param np.ndarray/None background: Background corresponding to image,
+            None if it's assigned later, e.g. from an annulus around the spot
         :param np.ndarray mask: Binary mask corresponding to image
         :param list bbox: Bounding box of single spot image
+        :param bool compute_stats: Compute spot stats, else they're computed
+            for all spots with compute_spot_stats
         """
         properties = ('label', 'centroid', 'mean_intensity',
                       'intensity_image', 'image', 'area', 'bbox')
@@ -113,8 +130,31 @@ class SpotRegionprop:
         self.spot_dict['bbox_col_max'] = bbox[1] + max_col
 
         self.image = image[min_row:max_row, min_col:max_col]
-        self.background = background[min_row:max_row, min_col:max_col]
+        if background is not None:
+            self.background = background[min_row:max_row, min_col:max_col]
         self.mask = mask[min_row:max_row, min_col:max_col]
         self.masked_image = self.image * self.mask
 
-        self.compute_stats()
+        if compute_stats:
+            self.compute_stats()
+
+
+def compute_spot_stats(spot_props, bg_stats=None):
+    """
+    Compute stats of spots in one pass, see SpotRegionprop.compute_stats.
+
+    :param list spot_props: SpotRegionprop objects with image, background
+        and mask
+    :param np.array/None bg_stats: Background mean and median per spot
+        (nbr spots x 2), e.g. from annuli around spots. If given, they
+        replace the background stats within spot masks
+    """
+    stats = kernels.spot_stats(
+        [spot_prop.image for spot_prop in spot_props],
+        [spot_prop.background for spot_prop in spot_props],
+        [spot_prop.mask for spot_prop in spot_props],
+    )
+    if bg_stats is not None:
+        stats[:, 2:] = bg_stats
+    for spot_prop, spot_stats in zip(spot_props, stats):
+        spot_prop.assign_stats(spot_stats)
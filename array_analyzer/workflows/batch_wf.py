@@ -0,0 +1,383 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import pandas as pd
+import shutil
+import time
+
+import array_analyzer.extract.background_estimator as background_estimator
+import array_analyzer.extract.img_processing as img_processing
+import array_analyzer.extract.metadata as metadata
+import array_analyzer.extract.constants as constants
+import array_analyzer.load.debug_montage as debug_montage
+import array_analyzer.load.debug_sampler as debug_sampler
+import array_analyzer.load.report as report
+import array_analyzer.load.well_cache as well_cache
+import array_analyzer.load.xlsx_writer as xlsx_writer
+import array_analyzer.utils.io_utils as io_utils
+import array_analyzer.workflows.registration_workflow as registration_wf
+
+# Spot detectors by layout hash and background estimator, created once per
+# worker process
+_WORKER_STATE = {'spot_detectors': {}, 'bg_estimators': {}}
+
+
+def read_manifest(manifest_path):
+    """
+    Read a batch manifest listing plate directories, one per row in a column
+    named 'directory'. An optional column 'metadata' gives the metadata file
+    name per plate, otherwise constants.METADATA_FILE is used.
+    Relative directories are relative to the manifest location.
+
+    :param str manifest_path: Path to csv or xlsx manifest
+    :return list plates: Dicts with plate 'input_dir' and 'metadata'
+    """
+    if manifest_path.endswith('.csv'):
+        manifest_df = pd.read_csv(manifest_path)
+    elif manifest_path.endswith('.xlsx'):
+        manifest_df = pd.read_excel(manifest_path)
+    else:
+        raise IOError("Manifest must be a csv or xlsx file, not {}".format(
+            manifest_path))
+    if 'directory' not in manifest_df.columns:
+        raise IOError("Manifest {} has no 'directory' column".format(
+            manifest_path))
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    plates = []
+    for _, row in manifest_df.iterrows():
+        input_dir = os.path.join(manifest_dir, str(row['directory']))
+        metadata_file = constants.METADATA_FILE
+        if 'metadata' in manifest_df.columns and \
+                isinstance(row['metadata'], str):
+            metadata_file = row['metadata']
+        if not os.path.isdir(input_dir):
+            raise IOError("Plate directory doesn't exist: {}".format(input_dir))
+        plates.append({'input_dir': input_dir, 'metadata': metadata_file})
+    assert len(plates) > 0, "No plates found in {}".format(manifest_path)
+    return plates
+
+
+def _get_worker_detectors(layout_hash, run_context):
+    """
+    Get spot detector for a layout and background estimator of the worker
+    process, creating them the first time they're needed.
+
+    :param str layout_hash: Hash of metadata file describing the layout
+    :param RunContext run_context: Run context of a plate with the layout
+    :return SpotDetector spot_detector: Spot detector for layout
+    :return BackgroundEstimator2D bg_estimator: Background estimator for
+        the background method of the run
+    """
+    if layout_hash not in _WORKER_STATE['spot_detectors']:
+        _WORKER_STATE['spot_detectors'][layout_hash] = \
+            img_processing.SpotDetector(imaging_params=run_context.params)
+    if run_context.background not in _WORKER_STATE['bg_estimators']:
+        _WORKER_STATE['bg_estimators'][run_context.background] = \
+            background_estimator.BackgroundEstimator2D(
+                block_size=128,
+                order=2,
+                normalize=False,
+                robust=run_context.background == 'robust',
+            )
+    return _WORKER_STATE['spot_detectors'][layout_hash], \
+        _WORKER_STATE['bg_estimators'][run_context.background]
+
+
+def _extract_well_task(task):
+    """
+    Extract a single well in a worker process. The spot detector and
+    background estimator are only created once per worker and layout.
+
+    :param dict task: Plate index, well name, image path, plate run context,
+        layout hash and debug settings for the well
+    :return dict result: Plate index, well name, image hash, status, spot
+        metrics if extraction succeeded and debug montage tiles if sampled
+    """
+    start_time = time.time()
+    run_context = task['run_context']
+    spot_detector, bg_estimator = _get_worker_detectors(
+        task['layout_hash'],
+        run_context,
+    )
+    well_data = registration_wf.extract_well(
+        im_path=task['im_path'],
+        well_name=task['well_name'],
+        spot_detector=spot_detector,
+        bg_estimator=bg_estimator,
+        run_context=run_context,
+    )
+    status = well_data['status']
+    debug_tiles = None
+    if (status == 'done' and task['debug']) or \
+            (status == 'registration' and task['debug_failed']):
+        if task['thumb_size'] is not None:
+            # Tiles are small, the plate montage is assembled by the parent
+            debug_tiles = debug_montage.well_tiles(
+                well_data,
+                thumb_size=task['thumb_size'],
+                grid_shape=(run_context.params['rows'], run_context.params['columns']),
+            )
+        else:
+            registration_wf.save_debug_plots(
+                well_data,
+                os.path.join(run_context.run_path, task['well_name']),
+                run_context,
+            )
+    return {
+        'plate_idx': task['plate_idx'],
+        'well_name': task['well_name'],
+        'image_hash': well_cache.hash_file(task['im_path']),
+        'status': status,
+        'spots_df': well_data.get('spots_df'),
+        'debug_tiles': debug_tiles,
+        'time': time.time() - start_time,
+    }
+
+
+def get_well_result(future, task):
+    """
+    Get the result of a well extraction task. If extraction raised an
+    exception the well is logged and returned as failed, so that the
+    remaining wells and plates can still finish.
+
+    :param concurrent.futures.Future future: Future of _extract_well_task
+    :param dict task: Task the future was submitted with
+    :return dict result: Well result, see _extract_well_task. Status is
+        'extraction' if the task raised an exception
+    """
+    try:
+        return future.result()
+    except Exception:
+        logger = logging.getLogger(constants.LOG_NAME)
+        logger.exception("Extraction raised an exception for {} in {}".format(
+            task['well_name'],
+            task['run_context'].input_dir,
+        ))
+    return {
+        'plate_idx': task['plate_idx'],
+        'well_name': task['well_name'],
+        'image_hash': well_cache.hash_file(task['im_path']),
+        'status': 'extraction',
+        'spots_df': None,
+        'debug_tiles': None,
+        'time': None,
+    }
+
+
+def _write_plate(plate):
+    """
+    Write stats per well and plate reports once all wells in a plate are done.
+
+    :param dict plate: Plate with run context, reporter and extracted wells
+    """
+    well_xlsx_path = os.path.join(
+        plate['run_context'].run_path,
+        'stats_per_well.xlsx',
+    )
+    well_sheets = collections.OrderedDict()
+    well_sheets['antigens'] = plate['reporter'].get_antigen_df()
+    # Keep wells in image order
+    for well_name in plate['well_names']:
+        if well_name in plate['spots_dfs']:
+            well_sheets[well_name] = plate['spots_dfs'][well_name]
+    xlsx_writer.write_sheets(well_xlsx_path, well_sheets)
+    plate['reporter'].write_reports()
+    if plate['montage'] is not None:
+        plate['montage'].write(plate['run_context'].run_path)
+
+
+def load_layout(plate, output_dir, layouts):
+    """
+    Create the run directory of a plate and get its run context. Metadata
+    is only parsed for layouts that haven't been seen before.
+
+    :param dict plate: Plate 'input_dir' and 'metadata' file name,
+        'run_path', 'run_context' and 'layout_hash' are added to it
+    :param str output_dir: Directory where plate run directory is created
+    :param dict layouts: Run contexts parsed so far, keyed by metadata
+        file hash. Parsed layouts are added to it
+    """
+    logger = logging.getLogger(constants.LOG_NAME)
+    plate['run_path'] = io_utils.make_run_dir(
+        input_dir=plate['input_dir'],
+        output_dir=output_dir,
+    )
+    metadata_path = os.path.join(plate['input_dir'], plate['metadata'])
+    assert os.path.isfile(metadata_path), \
+        "Metadata file not found: {}".format(metadata_path)
+    layout_hash = well_cache.hash_file(metadata_path)
+    if layout_hash in layouts:
+        logger.info("Reusing layout for plate {}".format(
+            plate['input_dir']))
+        run_context = layouts[layout_hash]._replace(
+            input_dir=plate['input_dir'],
+            run_path=plate['run_path'],
+            metadata_file=plate['metadata'],
+        )
+        shutil.copy2(metadata_path, plate['run_path'])
+    else:
+        run_context = metadata.MetaData(
+            plate['input_dir'],
+            output_dir,
+            metadata_file=plate['metadata'],
+            run_path=plate['run_path'],
+            rerun=False,
+            resume=False,
+        ).run_context
+        layouts[layout_hash] = run_context
+    plate['run_context'] = run_context
+    plate['layout_hash'] = layout_hash
+
+
+def setup_plate(plate, plate_idx, output_dir, layouts):
+    """
+    Create run directory, run context, reports and well cache for a plate
+    and list its wells to be extracted.
+
+    :param dict plate: Plate 'input_dir' and 'metadata' file name, plate
+        outputs and extracted wells are added to it
+    :param int plate_idx: Index of plate, added to its tasks
+    :param str output_dir: Directory where plate run directory is created
+    :param dict layouts: Run contexts by metadata file hash, see load_layout
+    :return list tasks: Tasks for extracting the plate wells,
+        see _extract_well_task
+    """
+    logger = logging.getLogger(constants.LOG_NAME)
+    load_layout(plate, output_dir, layouts)
+    run_context = plate['run_context']
+    plate['reporter'] = report.ReportWriter(run_context)
+    plate['reporter'].create_new_reports()
+    plate['cache'] = well_cache.WellCache(
+        run_path=plate['run_path'],
+        param_hash=well_cache.hash_params(
+            workflow='array_fit',
+            params=run_context.params,
+            fiducials_idx=run_context.fiducials_idx,
+            antigen_array=run_context.antigen_array,
+            background=run_context.background,
+        ),
+    )
+    # Outlier sampling needs the plate history, which isn't available
+    # when wells are processed out of order. Failed wells are sampled by
+    # the workers, see _extract_well_task
+    if run_context.debug_sampling.get('outliers', False):
+        logger.warning("Outlier debug sampling isn't available when wells "
+                       "are processed out of order, ignoring it")
+    sampler = debug_sampler.DebugSampler(
+        debug=run_context.debug,
+        **run_context.debug_sampling,
+    )
+    plate['montage'] = None
+    if run_context.debug and run_context.debug_montage:
+        plate['montage'] = debug_montage.PlateMontage(
+            plate=run_context.plate_geometry,
+            grid_shape=(run_context.params['rows'], run_context.params['columns']),
+        )
+    thumb_size = None
+    if plate['montage'] is not None:
+        thumb_size = plate['montage'].thumb_size
+    well_images = io_utils.get_image_paths(plate['input_dir'])
+    plate['well_names'] = list(well_images)
+    plate['spots_dfs'] = {}
+    plate['nbr_remaining'] = len(well_images)
+    tasks = []
+    for well_idx, (well_name, im_path) in enumerate(well_images.items()):
+        tasks.append({
+            'plate_idx': plate_idx,
+            'well_name': well_name,
+            'im_path': im_path,
+            'run_context': run_context,
+            'layout_hash': plate['layout_hash'],
+            'debug': sampler.sample_well(well_idx),
+            'debug_failed': sampler.debug and sampler.failed,
+            'thumb_size': thumb_size,
+        })
+    logger.info("Plate {}: {} wells, run dir {}".format(
+        plate['input_dir'],
+        len(well_images),
+        plate['run_path'],
+    ))
+    return tasks
+
+
+def collect_well_result(plate, result):
+    """
+    Add the result of a well extraction to the plate reports and well cache,
+    and write plate outputs as soon as all its wells are done.
+
+    :param dict plate: Plate set up by setup_plate
+    :param dict result: Well result returned by _extract_well_task
+    """
+    logger = logging.getLogger(constants.LOG_NAME)
+    well_name = result['well_name']
+    if result['debug_tiles'] is not None:
+        plate['montage'].add_tiles(well_name, result['debug_tiles'])
+    if result['status'] == 'done':
+        plate['spots_dfs'][well_name] = result['spots_df']
+        plate['cache'].save(
+            well_name,
+            result['image_hash'],
+            result['spots_df'],
+        )
+        plate['reporter'].assign_well_to_plate(
+            well_name,
+            result['spots_df'],
+        )
+        logger.info("Time to extract OD in {} {}: {:.3f} s".format(
+            plate['input_dir'],
+            well_name,
+            result['time'],
+        ))
+    else:
+        logger.warning("{} failed for {} in {}, will not write OD".format(
+            result['status'].capitalize(),
+            well_name,
+            plate['input_dir'],
+        ))
+        plate['cache'].save_failed(
+            well_name,
+            result['image_hash'],
+            reason=result['status'],
+        )
+    plate['nbr_remaining'] -= 1
+    if plate['nbr_remaining'] == 0:
+        _write_plate(plate)
+        logger.info("Wrote reports for plate {}".format(
+            plate['input_dir']))
+
+
+def batch_analysis(manifest_path, output_dir, nbr_workers=None):
+    """
+    Run the array_fit workflow for all plates listed in a manifest in a single
+    process. Metadata is parsed once per distinct metadata file, and the
+    wells of all plates are scheduled across a shared pool of worker
+    processes. Each plate gets its own timestamped run directory with the
+    same outputs as a single plate run.
+
+    :param str manifest_path: Path to csv or xlsx manifest, see read_manifest
+    :param str output_dir: Directory where plate run directories are created
+    :param int/None nbr_workers: Number of worker processes,
+        defaults to number of CPUs
+    """
+    logger = logging.getLogger(constants.LOG_NAME)
+    plates = read_manifest(manifest_path)
+    # Run contexts parsed so far, keyed by metadata file hash
+    layouts = {}
+    tasks = []
+    for plate_idx, plate in enumerate(plates):
+        tasks.extend(setup_plate(plate, plate_idx, output_dir, layouts))
+        assert plate['run_path'] not in [p['run_path'] for p in plates[:plate_idx]],\
+            "Plates must have unique directory names: {}".format(
+                plate['input_dir'])
+
+    logger.info("Extracting {} wells from {} plates".format(
+        len(tasks),
+        len(plates),
+    ))
+    with concurrent.futures.ProcessPoolExecutor(nbr_workers) as executor:
+        futures = {executor.submit(_extract_well_task, task): task
+                   for task in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            result = get_well_result(future, futures[future])
+            collect_well_result(plates[result['plate_idx']], result)
@@ -1,15 +1,19 @@
+import collections
 import time
 import os
 import numpy as np
-import pandas as pd
 import skimage.io as io
 
+import array_analyzer.extract.constants as constants
 import array_analyzer.extract.image_parser as image_parser
 import array_analyzer.extract.txt_parser as txt_parser
 import array_analyzer.extract.img_processing as img_processing
+import array_analyzer.load.debug_montage as debug_montage
 import array_analyzer.load.debug_plots as debug_plots
+import array_analyzer.load.debug_sampler as debug_sampler
 import array_analyzer.load.report as report
-import array_analyzer.extract.constants as constants
+import array_analyzer.load.well_cache as well_cache
+import array_analyzer.load.xlsx_writer as xlsx_writer
 import array_analyzer.transform.array_generation as array_gen
 import array_analyzer.extract.background_estimator as background_estimator
 import array_analyzer.utils.io_utils as io_utils
@@ -18,45 +22,81 @@ from array_analyzer.extract.metadata import MetaData
 
 def interp(input_dir, output_dir):
 
-    MetaData(input_dir, output_dir)
+    run_context = MetaData(input_dir, output_dir).run_context
+    params = run_context.params
 
     # Initialize background estimator
     bg_estimator = background_estimator.BackgroundEstimator2D(
         block_size=128,
         order=2,
         normalize=False,
+        robust=run_context.background == 'robust',
     )
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(run_context)
+    reporter.create_new_reports()
     well_xlsx_path = os.path.join(
-        constants.RUN_PATH,
+        run_context.run_path,
         'stats_per_well.xlsx',
     )
-    well_xlsx_writer = pd.ExcelWriter(well_xlsx_path)
-    antigen_df = reporter.get_antigen_df()
-    antigen_df.to_excel(well_xlsx_writer, sheet_name='antigens')
+    # Stats per well, written once all wells are done
+    well_sheets = collections.OrderedDict()
+    well_sheets['antigens'] = reporter.get_antigen_df()
 
     # ================
     # loop over images => good place for multiproc?  careful with columns in report
     # ================
     well_images = io_utils.get_image_paths(input_dir)
+    # Decide which wells get debug plots
+    sampler = debug_sampler.DebugSampler(
+        debug=run_context.debug,
+        **run_context.debug_sampling,
+    )
+    # Sampled wells are added to plate montages instead of separate plots
+    montage = None
+    if run_context.debug and run_context.debug_montage:
+        montage = debug_montage.PlateMontage(
+            plate=run_context.plate_geometry,
+            grid_shape=(params['rows'], params['columns']),
+        )
 
-    for well_name, im_path in well_images.items():
+    # Cache well results so reruns only recompute what has changed
+    cache = well_cache.WellCache(
+        run_path=run_context.run_path,
+        param_hash=well_cache.hash_params(
+            workflow='array_interp',
+            params=params,
+            fiducials_idx=run_context.fiducials_idx,
+            antigen_array=run_context.antigen_array,
+            background=run_context.background,
+        ),
+    )
+
+    for well_idx, (well_name, im_path) in enumerate(well_images.items()):
         start = time.time()
+        image_hash = well_cache.hash_file(im_path)
+        # Wells listed in rerun_wells are always recomputed
+        if (run_context.rerun or run_context.resume) and \
+                well_name not in run_context.rerun_wells:
+            spots_df = cache.load(well_name, image_hash)
+            if spots_df is not None:
+                well_sheets[well_name] = spots_df
+                reporter.assign_well_to_plate(well_name, spots_df)
+                continue
         image = io_utils.read_gray_im(im_path)
 
         spot_props_array = txt_parser.create_array(
-            constants.params['rows'],
-            constants.params['columns'],
+            params['rows'],
+            params['columns'],
             dtype=object,
         )
         bgprops_array = txt_parser.create_array(
-            constants.params['rows'],
-            constants.params['columns'],
+            params['rows'],
+            params['columns'],
             dtype=object,
         )
 
         # finding center of well and cropping
-        well_center, well_radi, well_mask = image_parser.find_well_border(image, detmethod='region', segmethod='otsu')
+        well_center, well_radi, well_mask = image_parser.find_well_border(image, detmethod='fast', segmethod='otsu')
         im_crop, _ = img_processing.crop_image_at_center(
             image,
             well_center,
@@ -72,21 +112,34 @@ def interp(input_dir, output_dir):
 
         crop_coords = image_parser.grid_from_centroids(
             spot_props,
-            constants.params['rows'],
-            constants.params['columns']
+            params['rows'],
+            params['columns'],
+            grid_spacing=run_context.spot_dist_pix,
         )
 
         # convert to float64
         im_crop = im_crop / np.iinfo(im_crop.dtype).max
-        background = bg_estimator.get_background(im_crop)
+        # Robust background excludes spots. Annulus backgrounds are
+        # computed around each spot by get_spot_intensity
+        background = None
+        if run_context.background != 'annulus':
+            exclude_mask = None
+            if bg_estimator.robust:
+                exclude_mask = img_processing.make_spot_mask(
+                    im_crop.shape,
+                    crop_coords,
+                    constants.BG_SPOT_RADIUS * params['spot_width'] / params['pixel_size'],
+                )
+            background = bg_estimator.get_background(im_crop, exclude=exclude_mask)
         spots_df, spot_props = array_gen.get_spot_intensity(
             coords=crop_coords,
             im=im_crop,
             background=background,
-            params=constants.params,
+            run_context=run_context,
         )
         # Write metrics for each spot in grid in current well
-        spots_df.to_excel(well_xlsx_writer, sheet_name=well_name)
+        well_sheets[well_name] = spots_df
+        cache.save(well_name, image_hash, spots_df)
         # Assign well OD, intensity, and background stats to plate
         reporter.assign_well_to_plate(well_name, spots_df)
 
@@ -94,9 +147,24 @@ def interp(input_dir, output_dir):
         print(f"\ttime to process={stop-start}")
 
         # SAVE FOR DEBUGGING
-        if constants.DEBUG:
+        well_stats = {
+            'od_median': spots_df['od_norm'].median(),
+            'od_std': spots_df['od_norm'].std(),
+        }
+        if sampler.sample_well(well_idx, well_stats=well_stats):
+            if montage is not None:
+                montage.add_well(well_name, {
+                    'status': 'done',
+                    'im_well': im_crop,
+                    'registered_coords': crop_coords,
+                    'im_crop': im_crop,
+                    'background': background,
+                    'spots_df': spots_df,
+                    'spot_props': spot_props,
+                })
+                continue
             # Save spot and background intensities.
-            output_name = os.path.join(constants.RUN_PATH, well_name)
+            output_name = os.path.join(run_context.run_path, well_name)
 
             # # Save mask of the well, cropped grayscale image, cropped spot segmentation.
             io.imsave(output_name + "_well_mask.png",
@@ -107,22 +175,23 @@ def interp(input_dir, output_dir):
                       (255 * spot_mask).astype('uint8'))
 
             # Evaluate accuracy of background estimation with green (image), magenta (background) overlay.
-            im_bg_overlay = np.stack([background, im_crop, background], axis=2)
+            if background is not None:
+                im_bg_overlay = np.stack([background, im_crop, background], axis=2)
 
-            io.imsave(output_name + "_crop_bg_overlay.png",
-                      (255 * im_bg_overlay).astype('uint8'))
+                io.imsave(output_name + "_crop_bg_overlay.png",
+                          (255 * im_bg_overlay).astype('uint8'))
 
             # This plot shows which spots have been assigned what index.
             debug_plots.plot_centroid_overlay(
                 im_crop,
-                constants.params,
-                spot_props,
+                params,
+                spots_df,
                 output_name,
             )
             debug_plots.plot_od(
                 spots_df=spots_df,
-                nbr_grid_rows=constants.params['rows'],
-                nbr_grid_cols=constants.params['columns'],
+                nbr_grid_rows=params['rows'],
+                nbr_grid_cols=params['columns'],
                 output_name=output_name,
             )
             # save a composite of all spots, where spots are from source or from region prop
@@ -141,5 +210,7 @@ def interp(input_dir, output_dir):
             print(f"\ttime to save debug={stop2-stop}")
 
     # After running all wells, write plate reports
-    well_xlsx_writer.close()
+    xlsx_writer.write_sheets(well_xlsx_path, well_sheets)
     reporter.write_reports()
+    if montage is not None:
+        montage.write(run_context.run_path)
@@ -1,8 +1,8 @@
+import collections
 import cv2 as cv
 import logging
 import numpy as np
 import os
-import pandas as pd
 import time
 
 import array_analyzer.extract.background_estimator as background_estimator
@@ -11,13 +11,185 @@ import array_analyzer.extract.img_processing as img_processing
 import array_analyzer.extract.metadata as metadata
 import array_analyzer.extract.txt_parser as txt_parser
 import array_analyzer.extract.constants as constants
+import array_analyzer.load.debug_montage as debug_montage
 import array_analyzer.load.debug_plots as debug_plots
+import array_analyzer.load.debug_sampler as debug_sampler
 import array_analyzer.load.report as report
+import array_analyzer.load.well_cache as well_cache
+import array_analyzer.load.xlsx_writer as xlsx_writer
 import array_analyzer.transform.point_registration as registration
 import array_analyzer.transform.array_generation as array_gen
 import array_analyzer.utils.io_utils as io_utils
 
 
+def extract_well(im_path, well_name, spot_detector, bg_estimator, run_context):
+    """
+    Detect spots in a well image, register the spot grid using particle
+    filtering and compute metrics for each spot.
+
+    :param str im_path: Path to well image
+    :param str well_name: Well name (e.g. 'B12')
+    :param SpotDetector spot_detector: Spot detector instance
+    :param BackgroundEstimator2D bg_estimator: Background estimator instance
+    :param RunContext run_context: Run context with parsed metadata
+    :return dict well_data: Well results. 'status' is 'done' if spots were
+        extracted, otherwise 'spot detection' or 'registration' depending on
+        which step failed. Results and intermediate images used for debug
+        plots are added as far as processing got.
+    """
+    logger = logging.getLogger(constants.LOG_NAME)
+    image = io_utils.read_gray_im(im_path)
+    # Get max intensity
+    max_intensity = io_utils.get_max_intensity(image)
+    logger.debug("Image max intensity: {}".format(max_intensity))
+    # Crop image to well only
+    """""
+    try:
+        well_center, well_radi, _ = image_parser.find_well_border(
+            image,
+            detmethod='region',
+            segmethod='otsu',
+        )
+        im_well, _ = img_processing.crop_image_at_center(
+            im=image,
+            center=well_center,
+            height=2 * well_radi,
+            width=2 * well_radi,
+        )
+    except IndexError:
+        logging.warning("Couldn't find well in {}".format(well_name))
+        im_well = image
+    """""
+    im_well = image
+    well_data = {
+        'im_well': im_well,
+        'max_intensity': max_intensity,
+    }
+    # Find spot center coordinates
+    spot_coords = spot_detector.get_spot_coords(
+        im=im_well,
+        max_intensity=max_intensity,
+    )
+    well_data['spot_coords'] = spot_coords
+    if spot_coords.shape[0] < constants.MIN_NBR_SPOTS:
+        well_data['status'] = 'spot detection'
+        return well_data
+    # Create particle filter registration instance
+    register_inst = registration.ParticleFilter(
+        spot_coords=spot_coords,
+        im_shape=im_well.shape,
+        run_context=run_context,
+    )
+    register_inst.particle_filter()
+    if not register_inst.registration_ok:
+        logger.warning("Registration failed for {}, "
+                       "repeat with outlier removal".format(well_name))
+        register_inst.particle_filter(
+            nbr_outliers=run_context.params['nbr_outliers'],
+        )
+    # Transform grid coordinates
+    registered_coords = register_inst.compute_registered_coords()
+    well_data['fiducial_coords'] = register_inst.fiducial_coords
+    well_data['registered_coords'] = registered_coords
+    well_data['registered_dist'] = register_inst.registered_dist
+    # Check that registered coordinates are inside well
+    if not register_inst.check_reg_coords():
+        well_data['status'] = 'registration'
+        return well_data
+
+    # Crop image. The robust and annulus backgrounds aren't skewed by the
+    # well edge, so a tighter crop is used
+    margin = 500
+    if run_context.background == 'annulus':
+        margin = constants.BG_CROP_MARGIN_SPOTS * run_context.spot_dist_pix
+    elif bg_estimator.robust:
+        margin = max(
+            constants.BG_CROP_MARGIN_SPOTS * run_context.spot_dist_pix,
+            2 * bg_estimator.block_size,
+        )
+    im_crop, crop_coords = img_processing.crop_image_from_coords(
+        im=im_well,
+        coords=registered_coords,
+        margin=margin,
+    )
+    im_crop = im_crop / max_intensity
+    # Estimate background, robust background excludes spots. Annulus
+    # backgrounds are computed around each spot by get_spot_intensity
+    background = None
+    if run_context.background != 'annulus':
+        spot_mask = None
+        if bg_estimator.robust:
+            spot_mask = img_processing.make_spot_mask(
+                im_crop.shape,
+                crop_coords,
+                constants.BG_SPOT_RADIUS * run_context.params['spot_width'] /
+                run_context.params['pixel_size'],
+            )
+        background = bg_estimator.get_background(im_crop, exclude=spot_mask)
+    # Find spots near grid locations and compute properties
+    spots_df, spot_props = array_gen.get_spot_intensity(
+        coords=crop_coords,
+        im=im_crop,
+        background=background,
+        run_context=run_context,
+    )
+    well_data['im_crop'] = im_crop
+    well_data['background'] = background
+    well_data['spots_df'] = spots_df
+    well_data['spot_props'] = spot_props
+    well_data['status'] = 'done'
+    return well_data
+
+
+def save_debug_plots(well_data, output_name, run_context):
+    """
+    Save debug plots for a well processed by extract_well. If registration
+    failed, only the registration is plotted.
+
+    :param dict well_data: Well results from extract_well
+    :param str output_name: Path and well name prefix for debug plots
+    :param RunContext run_context: Run context with parsed metadata
+    """
+    if well_data['status'] == 'registration':
+        debug_plots.plot_registration(
+            image=well_data['im_well'],
+            spot_coords=well_data['spot_coords'],
+            grid_coords=well_data['fiducial_coords'],
+            reg_coords=well_data['registered_coords'],
+            output_name=output_name + '_failed',
+            max_intensity=well_data['max_intensity'],
+        )
+        return
+    if well_data['status'] != 'done':
+        return
+    # Save OD plots, composite spots and registration
+    debug_plots.plot_od(
+        spots_df=well_data['spots_df'],
+        nbr_grid_rows=run_context.params['rows'],
+        nbr_grid_cols=run_context.params['columns'],
+        output_name=output_name,
+    )
+    debug_plots.save_composite_spots(
+        spot_props=well_data['spot_props'],
+        output_name=output_name,
+        image=well_data['im_crop'],
+    )
+    if well_data['background'] is not None:
+        debug_plots.plot_background_overlay(
+            well_data['im_crop'],
+            well_data['background'],
+            output_name,
+        )
+    debug_plots.plot_registration(
+        image=well_data['im_well'],
+        spot_coords=well_data['spot_coords'],
+        grid_coords=well_data['fiducial_coords'],
+        reg_coords=well_data['registered_coords'],
+        output_name=output_name,
+        max_intensity=well_data['max_intensity'],
+    )
+
+
 def point_registration(input_dir, output_dir):
     """
     For each image in input directory, detect spots using particle filtering
@@ -29,140 +201,134 @@ def point_registration(input_dir, output_dir):
     """
     logger = logging.getLogger(constants.LOG_NAME)
 
-    metadata.MetaData(input_dir, output_dir)
-    nbr_outliers = constants.params['nbr_outliers']
+    run_context = metadata.MetaData(input_dir, output_dir).run_context
+    run_path = run_context.run_path
 
     # Create reports instance for whole plate
-    reporter = report.ReportWriter()
-    # Create writer for stats per well
+    reporter = report.ReportWriter(run_context)
+    # Collect stats per well, written once all wells are done
     well_xlsx_path = os.path.join(
-        constants.RUN_PATH,
+        run_path,
         'stats_per_well.xlsx',
     )
-    well_xlsx_writer = pd.ExcelWriter(well_xlsx_path)
-    antigen_df = reporter.get_antigen_df()
-    antigen_df.to_excel(well_xlsx_writer, sheet_name='antigens')
+    well_sheets = collections.OrderedDict()
+    well_sheets['antigens'] = reporter.get_antigen_df()
 
     # Initialize background estimator
     bg_estimator = background_estimator.BackgroundEstimator2D(
         block_size=128,
         order=2,
         normalize=False,
+        robust=run_context.background == 'robust',
     )
 
-    # Get grid rows and columns from params
-    nbr_grid_rows = constants.params['rows']
-    nbr_grid_cols = constants.params['columns']
-    fiducials_idx = constants.FIDUCIALS_IDX
     # Create spot detector instance
     spot_detector = img_processing.SpotDetector(
-        imaging_params=constants.params,
+        imaging_params=run_context.params,
     )
 
+    # Decide which wells get debug plots
+    sampler = debug_sampler.DebugSampler(
+        debug=run_context.debug,
+        **run_context.debug_sampling,
+    )
+    # Sampled wells are added to plate montages instead of separate plots
+    montage = None
+    if run_context.debug and run_context.debug_montage:
+        montage = debug_montage.PlateMontage(
+            plate=run_context.plate_geometry,
+            grid_shape=(run_context.params['rows'], run_context.params['columns']),
+        )
+
     well_images = io_utils.get_image_paths(input_dir)
     well_names = list(well_images)
+    # Cache well results so reruns only recompute what has changed
+    cache = well_cache.WellCache(
+        run_path=run_path,
+        param_hash=well_cache.hash_params(
+            workflow='array_fit',
+            params=run_context.params,
+            fiducials_idx=run_context.fiducials_idx,
+            antigen_array=run_context.antigen_array,
+            background=run_context.background,
+        ),
+    )
+    # When resuming, or rerunning without a list of rerun wells, only
+    # process wells whose image or parameters changed since the last run
+    incremental = run_context.resume or \
+        (run_context.rerun and len(run_context.rerun_wells) == 0)
     # If rerunning only a subset of wells
-    if constants.RERUN:
-        logger.info("Rerunning wells: {}".format(constants.RERUN_WELLS))
-        txt_parser.rerun_xl_od(
+    if run_context.rerun and not incremental:
+        logger.info("Rerunning wells: {}".format(run_context.rerun_wells))
+        well_sheets.update(txt_parser.rerun_xl_od(
             well_names=well_names,
             well_xlsx_path=well_xlsx_path,
-            rerun_names=constants.RERUN_WELLS,
-            xlsx_writer=well_xlsx_writer,
-        )
+            rerun_names=run_context.rerun_wells,
+        ))
         reporter.load_existing_reports()
-        well_names = constants.RERUN_WELLS
+        well_names = list(run_context.rerun_wells)
         # remove debug images from old runs
-        for f in os.listdir(constants.RUN_PATH):
+        for f in os.listdir(run_path):
             if f.split('_')[0] in well_names:
-                os.remove(os.path.join(constants.RUN_PATH, f))
+                os.remove(os.path.join(run_path, f))
     else:
         reporter.create_new_reports()
 
     # ================
     # loop over well images
     # ================
-    for well_name in well_names:
+    for well_idx, well_name in enumerate(well_names):
         start_time = time.time()
         im_path = well_images[well_name]
-        image = io_utils.read_gray_im(im_path)
+        image_hash = well_cache.hash_file(im_path)
+        if incremental:
+            spots_df = cache.load(well_name, image_hash)
+            if spots_df is not None:
+                logger.info("Using cached results for well: {}".format(well_name))
+                well_sheets[well_name] = spots_df
+                reporter.assign_well_to_plate(well_name, spots_df)
+                continue
+            # Failed wells are retried on rerun but not when resuming
+            if run_context.resume and cache.is_failed(well_name, image_hash):
+                logger.info("Skipping previously failed well: {}".format(
+                    well_name))
+                continue
+            # Remove debug images from old runs
+            for f in os.listdir(run_path):
+                if f.split('_')[0] == well_name:
+                    os.remove(os.path.join(run_path, f))
         logger.info("Extracting well: {}".format(well_name))
-        # Get max intensity
-        max_intensity = io_utils.get_max_intensity(image)
-        logger.debug("Image max intensity: {}".format(max_intensity))
-        # Crop image to well only
-        """""
-        try:
-            well_center, well_radi, _ = image_parser.find_well_border(
-                image,
-                detmethod='region',
-                segmethod='otsu',
-            )
-            im_well, _ = img_processing.crop_image_at_center(
-                im=image,
-                center=well_center,
-                height=2 * well_radi,
-                width=2 * well_radi,
-            )
-        except IndexError:
-            logging.warning("Couldn't find well in {}".format(well_name))
-            im_well = image
-        """""
-        im_well = image
-        # Find spot center coordinates
-        spot_coords = spot_detector.get_spot_coords(
-            im=im_well,
-            max_intensity=max_intensity,
+        well_data = extract_well(
+            im_path=im_path,
+            well_name=well_name,
+            spot_detector=spot_detector,
+            bg_estimator=bg_estimator,
+            run_context=run_context,
         )
-        if spot_coords.shape[0] < constants.MIN_NBR_SPOTS:
+        if well_data['status'] == 'spot detection':
             logging.warning("Not enough spots detected in {},"
                             "continuing.".format(well_name))
+            cache.save_failed(well_name, image_hash, reason='spot detection')
             continue
-        # Create particle filter registration instance
-        register_inst = registration.ParticleFilter(
-            spot_coords=spot_coords,
-            im_shape=im_well.shape,
-            fiducials_idx=fiducials_idx,
-        )
-        register_inst.particle_filter()
-        if not register_inst.registration_ok:
-            logger.warning("Registration failed for {}, "
-                           "repeat with outlier removal".format(well_name))
-            register_inst.particle_filter(nbr_outliers=nbr_outliers)
-        # Transform grid coordinates
-        registered_coords = register_inst.compute_registered_coords()
-        # Check that registered coordinates are inside well
-        registration_ok = register_inst.check_reg_coords()
-        if not registration_ok:
+        if well_data['status'] == 'registration':
             logger.warning("Final registration failed,"
                            "will not write OD for {}".format(well_name))
-            if constants.DEBUG:
-                debug_plots.plot_registration(
-                    im_well,
-                    spot_coords,
-                    register_inst.fiducial_coords,
-                    registered_coords,
-                    os.path.join(constants.RUN_PATH, well_name + '_failed'),
-                    max_intensity=max_intensity,
-                )
+            if sampler.sample_well(well_idx, registration_ok=False):
+                if montage is not None:
+                    montage.add_well(well_name, well_data)
+                else:
+                    save_debug_plots(
+                        well_data,
+                        os.path.join(run_path, well_name),
+                        run_context,
+                    )
+            cache.save_failed(well_name, image_hash, reason='registration')
             continue
 
-        # Crop image
-        im_crop, crop_coords = img_processing.crop_image_from_coords(
-            im=im_well,
-            coords=registered_coords,
-        )
-        im_crop = im_crop / max_intensity
-        # Estimate background
-        background = bg_estimator.get_background(im_crop)
-        # Find spots near grid locations and compute properties
-        spots_df, spot_props = array_gen.get_spot_intensity(
-            coords=crop_coords,
-            im=im_crop,
-            background=background,
-        )
+        spots_df = well_data['spots_df']
         # Write metrics for each spot in grid in current well
-        spots_df.to_excel(well_xlsx_writer, sheet_name=well_name)
+        well_sheets[well_name] = spots_df
+        cache.save(well_name, image_hash, spots_df)
         # Assign well OD, intensity, and background stats to plate
         reporter.assign_well_to_plate(well_name, spots_df)
 
@@ -175,39 +341,26 @@ def point_registration(input_dir, output_dir):
 
         # ==================================
         # SAVE FOR DEBUGGING
-        if constants.DEBUG:
+        well_stats = {
+            'registered_dist': well_data['registered_dist'],
+            'od_median': spots_df['od_norm'].median(),
+        }
+        if sampler.sample_well(well_idx, well_stats=well_stats):
             start_time = time.time()
-            # Save spot and background intensities
-            output_name = os.path.join(constants.RUN_PATH, well_name)
-            # Save OD plots, composite spots and registration
-            debug_plots.plot_od(
-                spots_df=spots_df,
-                nbr_grid_rows=nbr_grid_rows,
-                nbr_grid_cols=nbr_grid_cols,
-                output_name=output_name,
-            )
-            debug_plots.save_composite_spots(
-                spot_props=spot_props,
-                output_name=output_name,
-                image=im_crop,
-            )
-            debug_plots.plot_background_overlay(
-                im_crop,
-                background,
-                output_name,
-            )
-            debug_plots.plot_registration(
-                image=im_well,
-                spot_coords=spot_coords,
-                grid_coords=register_inst.fiducial_coords,
-                reg_coords=registered_coords,
-                output_name=output_name,
-                max_intensity=max_intensity,
-            )
+            if montage is not None:
+                montage.add_well(well_name, well_data)
+            else:
+                save_debug_plots(
+                    well_data,
+                    os.path.join(run_path, well_name),
+                    run_context,
+                )
             logger.debug("Time to save debug images: {:.3f} s".format(
                 time.time() - start_time),
             )
 
     # After running all wells, write plate reports
-    well_xlsx_writer.close()
+    xlsx_writer.write_sheets(well_xlsx_path, well_sheets)
     reporter.write_reports()
+    if montage is not None:
+        montage.write(run_path)
@@ -0,0 +1,382 @@
+import concurrent.futures
+import http.server
+import json
+import logging
+import os
+import pandas as pd
+import tempfile
+import threading
+import time
+
+import array_analyzer.extract.constants as constants
+import array_analyzer.extract.metadata as metadata
+import array_analyzer.load.report as report
+import array_analyzer.load.well_cache as well_cache
+import array_analyzer.utils.io_utils as io_utils
+import array_analyzer.workflows.batch_wf as batch_wf
+
+
+def _warm_up_worker(delay):
+    """
+    Wait in a worker process so that each worker gets a warm up task.
+
+    :param float delay: Time in seconds
+    :return int: Process ID of worker
+    """
+    time.sleep(delay)
+    return os.getpid()
+
+
+def od_table(antigen_df, well_names, spots_dfs):
+    """
+    Collect ODs of extracted wells in a table with one row per well and
+    antigen, with antigens named like the report sheets.
+
+    :param pd.DataFrame antigen_df: Antigen names and grid rows, cols,
+        see ReportWriter.get_antigen_df
+    :param list well_names: Well names in plate order
+    :param dict spots_dfs: Metrics for all spots by well name, for wells
+        that were extracted
+    :return pd.DataFrame od_df: Well name, antigen, grid row and column,
+        intensity, background and OD of antigen spots
+    """
+    antigen_df = antigen_df.astype({'grid_row': int, 'grid_col': int})
+    well_dfs = []
+    for well_name in well_names:
+        if well_name not in spots_dfs:
+            continue
+        spots_df = spots_dfs[well_name]
+        spots_df = spots_df[['grid_row', 'grid_col', 'intensity_median',
+                             'bg_median', 'od_norm']].astype(float)
+        # Use the first spot if there are duplicates, like the reports
+        spots_df = spots_df.drop_duplicates(['grid_row', 'grid_col'])
+        well_df = antigen_df.merge(spots_df, how='left', on=['grid_row', 'grid_col'])
+        well_df.insert(0, 'well_name', well_name)
+        well_dfs.append(well_df)
+    if len(well_dfs) == 0:
+        return pd.DataFrame(columns=['well_name', 'antigen', 'grid_row',
+                                     'grid_col', 'intensity_median',
+                                     'bg_median', 'od_norm'])
+    return pd.concat(well_dfs, ignore_index=True)
+
+
+def _df_records(df):
+    """
+    :param pd.DataFrame df: Table
+    :return list: Rows as dicts, with None for missing values
+    """
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+
+class ExtractionService:
+    """
+    Extracts ODs for plates or single wells submitted by clients with the
+    array_fit workflow, using a pool of worker processes that is kept alive
+    between jobs. Parsed layouts are kept in memory and workers keep their
+    spot detectors per layout, so jobs only pay for image processing.
+    """
+    def __init__(self, input_dir, output_dir, nbr_workers=None):
+        """
+        :param str input_dir: Directory where relative plate directories
+            of jobs are found
+        :param str output_dir: Directory where plate run directories
+            are created
+        :param int/None nbr_workers: Number of worker processes,
+            defaults to number of CPUs
+        """
+        self.logger = logging.getLogger(constants.LOG_NAME)
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.nbr_workers = nbr_workers
+        if self.nbr_workers is None:
+            self.nbr_workers = os.cpu_count()
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.nbr_workers)
+        # Run contexts by metadata file hash, see batch_wf.setup_plate
+        self.layouts = {}
+        # Antigen names and grid positions by metadata file hash
+        self.antigen_dfs = {}
+        # Jobs are handled in threads, which share the layouts
+        self.layout_lock = threading.Lock()
+        self.nbr_jobs = 0
+
+    def get_layout(self, plate):
+        """
+        Get the run context of a plate layout, parsing metadata if the
+        layout hasn't been seen before. Parsed layouts are reused by
+        batch_wf.setup_plate for plate jobs.
+
+        :param dict plate: Plate 'input_dir' and 'metadata' file name
+        :return str layout_hash: Hash of metadata file
+        :return RunContext run_context: Run context of plate without run path
+        """
+        metadata_path = os.path.join(plate['input_dir'], plate['metadata'])
+        assert os.path.isfile(metadata_path), \
+            "Metadata file not found: {}".format(metadata_path)
+        layout_hash = well_cache.hash_file(metadata_path)
+        with self.layout_lock:
+            if layout_hash not in self.layouts:
+                # Metadata is copied to the run path, which isn't kept
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    self.layouts[layout_hash] = metadata.MetaData(
+                        plate['input_dir'],
+                        self.output_dir,
+                        metadata_file=plate['metadata'],
+                        run_path=tmp_dir,
+                        rerun=False,
+                        resume=False,
+                    ).run_context
+                self.antigen_dfs[layout_hash] = report.ReportWriter(
+                    self.layouts[layout_hash],
+                ).get_antigen_df()
+        run_context = self.layouts[layout_hash]._replace(
+            input_dir=plate['input_dir'],
+            run_path=None,
+            metadata_file=plate['metadata'],
+        )
+        return layout_hash, run_context
+
+    def warm_up(self, plate_dirs=()):
+        """
+        Start all worker processes, and preload layouts and spot detectors
+        of plates so the first jobs don't pay for them.
+
+        :param list plate_dirs: Plate directories with metadata file
+            constants.METADATA_FILE
+        """
+        futures = [self.executor.submit(_warm_up_worker, .1)
+                   for _ in range(self.nbr_workers)]
+        concurrent.futures.wait(futures)
+        for plate_dir in plate_dirs:
+            layout_hash, run_context = self.get_layout({
+                'input_dir': plate_dir,
+                'metadata': constants.METADATA_FILE,
+            })
+            # Each worker creates the spot detector for the layout
+            futures = [self.executor.submit(
+                batch_wf._get_worker_detectors,
+                layout_hash,
+                run_context,
+            ) for _ in range(self.nbr_workers)]
+            concurrent.futures.wait(futures)
+        self.logger.info("Warmed up {} workers and {} layouts".format(
+            self.nbr_workers,
+            len(self.layouts),
+        ))
+
+    def _get_plate(self, job):
+        """
+        :param dict job: Job with plate 'directory', absolute or relative to
+            the input directory, and optional 'metadata' file name
+        :return dict plate: Plate 'input_dir' and 'metadata' file name
+        """
+        assert 'directory' in job, "Job has no plate 'directory'"
+        input_dir = os.path.join(self.input_dir, job['directory'])
+        if not os.path.isdir(input_dir):
+            raise IOError("Plate directory doesn't exist: {}".format(input_dir))
+        return {
+            'input_dir': input_dir,
+            'metadata': job.get('metadata', constants.METADATA_FILE),
+        }
+
+    def extract_plate(self, job):
+        """
+        Extract all wells of a plate and write the same outputs as a single
+        plate run in a run directory.
+
+        :param dict job: Plate 'directory' and optional 'metadata' file name
+        :return dict response: 'run_path', well 'status' by well name and
+            'od' table rows, see od_table
+        """
+        start_time = time.time()
+        plate = self._get_plate(job)
+        self.get_layout(plate)
+        with self.layout_lock:
+            tasks = batch_wf.setup_plate(plate, 0, self.output_dir, self.layouts)
+        futures = {self.executor.submit(batch_wf._extract_well_task, task): task
+                   for task in tasks}
+        status = {}
+        for future in concurrent.futures.as_completed(futures):
+            result = batch_wf.get_well_result(future, futures[future])
+            status[result['well_name']] = result['status']
+            batch_wf.collect_well_result(plate, result)
+        self._count_job()
+        self.logger.info("Extracted plate {} in {:.3f} s".format(
+            plate['input_dir'],
+            time.time() - start_time,
+        ))
+        return {
+            'run_path': plate['run_path'],
+            'status': {well_name: status[well_name]
+                       for well_name in plate['well_names']},
+            'od': _df_records(od_table(
+                plate['reporter'].get_antigen_df(),
+                plate['well_names'],
+                plate['spots_dfs'],
+            )),
+        }
+
+    def extract_well(self, job):
+        """
+        Extract a single well of a plate. Nothing is written, results are
+        only returned.
+
+        :param dict job: Plate 'directory', 'well_name' and optional
+            'metadata' file name
+        :return dict response: Well 'status' and 'od' table rows,
+            see od_table
+        """
+        start_time = time.time()
+        plate = self._get_plate(job)
+        assert 'well_name' in job, "Job has no 'well_name'"
+        well_name = job['well_name']
+        well_images = io_utils.get_image_paths(plate['input_dir'])
+        if well_name not in well_images:
+            raise IOError("No image found for well {} in {}".format(
+                well_name,
+                plate['input_dir'],
+            ))
+        layout_hash, run_context = self.get_layout(plate)
+        result = self.executor.submit(batch_wf._extract_well_task, {
+            'plate_idx': 0,
+            'well_name': well_name,
+            'im_path': well_images[well_name],
+            'run_context': run_context,
+            'layout_hash': layout_hash,
+            'debug': False,
+            'debug_failed': False,
+            'thumb_size': None,
+        }).result()
+        spots_dfs = {}
+        if result['status'] == 'done':
+            spots_dfs[well_name] = result['spots_df']
+        self._count_job()
+        self.logger.info("Extracted well {} in {} in {:.3f} s".format(
+            well_name,
+            plate['input_dir'],
+            time.time() - start_time,
+        ))
+        return {
+            'status': result['status'],
+            'od': _df_records(od_table(
+                self.antigen_dfs[layout_hash],
+                [well_name],
+                spots_dfs,
+            )),
+        }
+
+    def _count_job(self):
+        with self.layout_lock:
+            self.nbr_jobs += 1
+
+    def status(self):
+        """
+        :return dict response: Number of workers, layouts and jobs done
+        """
+        return {
+            'nbr_workers': self.nbr_workers,
+            'nbr_layouts': len(self.layouts),
+            'nbr_jobs': self.nbr_jobs,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+class ServiceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles requests to the extraction service on localhost, with JSON
+    bodies and responses:
+        POST /plate {"directory": ..., "metadata": ...} extracts a plate
+        POST /well {"directory": ..., "well_name": ..., "metadata": ...}
+            extracts a well
+        GET /status returns the service status
+    """
+    # Extraction service, assigned by serve
+    service = None
+    job_methods = {
+        '/plate': 'extract_plate',
+        '/well': 'extract_well',
+    }
+
+    def _respond(self, code, response):
+        """
+        :param int code: HTTP status code
+        :param dict response: Response, sent as JSON
+        """
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._respond(200, self.service.status())
+        else:
+            self._respond(404, {'error': "Unknown path {}".format(self.path)})
+
+    def do_POST(self):
+        if self.path not in self.job_methods:
+            self._respond(404, {'error': "Unknown path {}".format(self.path)})
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(content_length))
+            job_method = getattr(self.service, self.job_methods[self.path])
+            response = job_method(job)
+        except (AssertionError, IOError, ValueError, TypeError) as ex:
+            self._respond(400, {'error': str(ex)})
+            return
+        except Exception as ex:
+            self.service.logger.exception("Job {} failed".format(self.path))
+            self._respond(500, {'error': str(ex)})
+            return
+        self._respond(200, response)
+
+    def log_message(self, format, *args):
+        self.service.logger.debug(format % args)
+
+
+def find_plate_dirs(input_dir):
+    """
+    Find the input directory and its subdirectories that contain a metadata
+    file named constants.METADATA_FILE.
+
+    :param str input_dir: Input directory
+    :return list plate_dirs: Plate directories
+    """
+    plate_dirs = [input_dir] + [
+        os.path.join(input_dir, dir_name)
+        for dir_name in sorted(os.listdir(input_dir))
+        if os.path.isdir(os.path.join(input_dir, dir_name))
+    ]
+    return [plate_dir for plate_dir in plate_dirs if os.path.isfile(
+        os.path.join(plate_dir, constants.METADATA_FILE))]
+
+
+def serve(input_dir, output_dir, port, nbr_workers=None):
+    """
+    Run the extraction service on localhost until it's interrupted.
+    Layouts of plates in the input directory are preloaded.
+
+    :param str input_dir: Directory where relative plate directories
+        of jobs are found
+    :param str output_dir: Directory where plate run directories are created
+    :param int port: Port on localhost
+    :param int/None nbr_workers: Number of worker processes,
+        defaults to number of CPUs
+    """
+    logger = logging.getLogger(constants.LOG_NAME)
+    service = ExtractionService(input_dir, output_dir, nbr_workers=nbr_workers)
+    service.warm_up(find_plate_dirs(input_dir))
+    handler = type('Handler', (ServiceHandler,), {'service': service})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    logger.info("Serving extraction on http://127.0.0.1:{}".format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
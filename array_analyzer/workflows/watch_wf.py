@@ -0,0 +1,225 @@
+import collections
+import logging
+import os
+import time
+
+import array_analyzer.extract.background_estimator as background_estimator
+import array_analyzer.extract.img_processing as img_processing
+import array_analyzer.extract.metadata as metadata
+import array_analyzer.extract.constants as constants
+import array_analyzer.load.debug_montage as debug_montage
+import array_analyzer.load.debug_sampler as debug_sampler
+import array_analyzer.load.report as report
+import array_analyzer.load.well_cache as well_cache
+import array_analyzer.load.xlsx_writer as xlsx_writer
+import array_analyzer.utils.io_utils as io_utils
+import array_analyzer.utils.plate_geometry as plate_geometry
+import array_analyzer.workflows.registration_workflow as registration_wf
+
+
+class ImageWatcher:
+    """
+    Polls an input directory for well images written by a scanner.
+    An image is ready once its size and modification time haven't changed
+    between two polls and it hasn't been modified for the settle time,
+    so images that are still being written aren't read. Images that can't
+    be read are retried once they change.
+    """
+    def __init__(self, input_dir, settle_time=constants.WATCH_SETTLE_TIME):
+        """
+        :param str input_dir: Directory where well images are written
+        :param float settle_time: Time in seconds since last modification
+            before an image is considered fully written
+        """
+        self.input_dir = input_dir
+        self.settle_time = settle_time
+        # Size and modification time of images at last poll
+        self.file_stats = {}
+        # Size and modification time of images that couldn't be read
+        self.failed_stats = {}
+        self.ready_wells = set()
+
+    def poll(self):
+        """
+        Find images that are ready since the last poll.
+
+        :return dict new_images: Well name key, image path value, ordered
+            by plate row then column
+        """
+        well_images = io_utils.find_image_paths(self.input_dir)
+        poll_time = time.time()
+        new_images = {}
+        for well_name in sorted(well_images, key=plate_geometry.well_sort_key):
+            if well_name in self.ready_wells:
+                continue
+            try:
+                file_stat = os.stat(well_images[well_name])
+            except FileNotFoundError:
+                continue
+            prev_stat = self.file_stats.get(well_name)
+            self.file_stats[well_name] = (file_stat.st_size, file_stat.st_mtime_ns)
+            if prev_stat == self.file_stats[well_name] and \
+                    self.failed_stats.get(well_name) != prev_stat and \
+                    file_stat.st_size > 0 and \
+                    poll_time - file_stat.st_mtime >= self.settle_time:
+                new_images[well_name] = well_images[well_name]
+                self.ready_wells.add(well_name)
+        return new_images
+
+    def retry(self, well_name):
+        """
+        Mark an image that couldn't be read, so it's returned again by poll
+        once it has changed and is ready.
+
+        :param str well_name: Well name
+        """
+        self.failed_stats[well_name] = self.file_stats[well_name]
+        self.ready_wells.discard(well_name)
+
+
+def watch_registration(input_dir,
+                       output_dir,
+                       timeout=constants.WATCH_TIMEOUT,
+                       poll_interval=constants.WATCH_POLL_INTERVAL):
+    """
+    Run the array_fit workflow on a plate while it's being imaged. Wells are
+    extracted as soon as their images are fully written, and stats per well
+    and plate reports are rewritten after each batch of new wells, so
+    results for the first wells are available while the plate is imaged.
+    Watching stops when all wells of the plate are extracted, when no new
+    image has been written for the timeout, or when interrupted.
+
+    :param str input_dir: Input directory where images are written
+    :param str output_dir: Directory where output is written to
+    :param float timeout: Time in seconds without new images before
+        watching stops
+    :param float poll_interval: Time in seconds between polls of input
+        directory
+    """
+    logger = logging.getLogger(constants.LOG_NAME)
+
+    run_context = metadata.MetaData(input_dir, output_dir).run_context
+    run_path = run_context.run_path
+    plate = run_context.plate_geometry
+    if plate is None:
+        plate = plate_geometry.PlateGeometry()
+
+    reporter = report.ReportWriter(run_context)
+    reporter.create_new_reports()
+    well_xlsx_path = os.path.join(run_path, 'stats_per_well.xlsx')
+    spots_dfs = {}
+    bg_estimator = background_estimator.BackgroundEstimator2D(
+        block_size=128,
+        order=2,
+        normalize=False,
+        robust=run_context.background == 'robust',
+    )
+    spot_detector = img_processing.SpotDetector(
+        imaging_params=run_context.params,
+    )
+    sampler = debug_sampler.DebugSampler(
+        debug=run_context.debug,
+        **run_context.debug_sampling,
+    )
+    montage = None
+    if run_context.debug and run_context.debug_montage:
+        montage = debug_montage.PlateMontage(
+            plate=run_context.plate_geometry,
+            grid_shape=(run_context.params['rows'], run_context.params['columns']),
+        )
+    cache = well_cache.WellCache(
+        run_path=run_path,
+        param_hash=well_cache.hash_params(
+            workflow='array_fit',
+            params=run_context.params,
+            fiducials_idx=run_context.fiducials_idx,
+            antigen_array=run_context.antigen_array,
+            background=run_context.background,
+        ),
+    )
+
+    def write_reports():
+        # Keep wells in plate order
+        well_sheets = collections.OrderedDict()
+        well_sheets['antigens'] = reporter.get_antigen_df()
+        for well_name in sorted(spots_dfs, key=plate_geometry.well_sort_key):
+            well_sheets[well_name] = spots_dfs[well_name]
+        xlsx_writer.write_sheets(well_xlsx_path, well_sheets)
+        reporter.write_reports()
+
+    watcher = ImageWatcher(input_dir)
+    logger.info("Watching {} for well images".format(input_dir))
+    last_image_time = time.time()
+    well_idx = 0
+    try:
+        while len(watcher.ready_wells) < plate.nbr_wells:
+            new_images = watcher.poll()
+            if len(new_images) == 0:
+                if time.time() - last_image_time > timeout:
+                    logger.info("No new images for {} s, stop watching".format(
+                        timeout))
+                    break
+                time.sleep(poll_interval)
+                continue
+            for well_name, im_path in new_images.items():
+                start_time = time.time()
+                image_hash = well_cache.hash_file(im_path)
+                logger.info("Extracting well: {}".format(well_name))
+                try:
+                    well_data = registration_wf.extract_well(
+                        im_path=im_path,
+                        well_name=well_name,
+                        spot_detector=spot_detector,
+                        bg_estimator=bg_estimator,
+                        run_context=run_context,
+                    )
+                except IOError:
+                    # Image may still be incomplete, e.g. if writing paused
+                    logger.warning("Can't read image of {}, retrying when "
+                                   "it changes".format(well_name))
+                    watcher.retry(well_name)
+                    continue
+                status = well_data['status']
+                well_stats = None
+                if status == 'done':
+                    spots_dfs[well_name] = well_data['spots_df']
+                    cache.save(well_name, image_hash, well_data['spots_df'])
+                    reporter.assign_well_to_plate(well_name, well_data['spots_df'])
+                    logger.info("Time to extract OD in {}: {:.3f} s".format(
+                        well_name,
+                        time.time() - start_time,
+                    ))
+                    well_stats = {
+                        'registered_dist': well_data['registered_dist'],
+                        'od_median': well_data['spots_df']['od_norm'].median(),
+                    }
+                else:
+                    logger.warning("{} failed, will not write OD for {}".format(
+                        status.capitalize(),
+                        well_name,
+                    ))
+                    cache.save_failed(well_name, image_hash, reason=status)
+                if status != 'spot detection' and sampler.sample_well(
+                        well_idx,
+                        registration_ok=status == 'done',
+                        well_stats=well_stats):
+                    if montage is not None:
+                        montage.add_well(well_name, well_data)
+                    else:
+                        registration_wf.save_debug_plots(
+                            well_data,
+                            os.path.join(run_path, well_name),
+                            run_context,
+                        )
+                well_idx += 1
+            # Update reports with the new wells
+            write_reports()
+            last_image_time = time.time()
+            logger.info("Updated reports, {} wells done".format(
+                len(watcher.ready_wells),
+            ))
+    except KeyboardInterrupt:
+        logger.info("Interrupted, stop watching")
+    write_reports()
+    if montage is not None:
+        montage.write(run_path)
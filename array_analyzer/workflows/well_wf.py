@@ -1,18 +1,58 @@
 import array_analyzer.extract.image_parser as image_parser
 import array_analyzer.extract.img_processing as processing
-import array_analyzer.extract.constants as constants
+import array_analyzer.load.xlsx_writer as xlsx_writer
 from array_analyzer.extract.metadata import MetaData
 import array_analyzer.utils.io_utils as io_utils
+import array_analyzer.utils.plate_geometry as plate_geometry
 
 import time
 import skimage.io as io
 import pandas as pd
-import string
 import os
 import re
 import numpy as np
 
 
+def get_plate_geometry(plate_info_path):
+    """
+    Infer the plate format from the sample sheet of Plate_Info. Plate
+    columns are the leading column headers 1, 2, ... and plate rows the
+    leading row names A, B, ..., so other cells such as notes are ignored.
+    The sheet is only read up to the size of the largest plate format.
+
+    :param str plate_info_path: Path to Plate_Info.xlsx
+    :return PlateGeometry plate: Geometry of the plate format
+    """
+    max_rows, max_cols = max(plate_geometry.PLATE_FORMATS.values())
+    sample_df = pd.read_excel(
+        plate_info_path,
+        sheet_name='sample',
+        nrows=max_rows,
+        index_col=0,
+    )
+    nbr_cols = 0
+    for col_name in sample_df.columns[:max_cols]:
+        if str(col_name).strip() != str(nbr_cols + 1):
+            break
+        nbr_cols += 1
+    nbr_rows = 0
+    for row_name in sample_df.index:
+        if str(row_name).strip().upper() != plate_geometry.row_name(nbr_rows):
+            break
+        nbr_rows += 1
+    for plate_format, plate_shape in plate_geometry.PLATE_FORMATS.items():
+        if plate_shape == (nbr_rows, nbr_cols):
+            return plate_geometry.PlateGeometry.from_format(plate_format)
+    raise IOError(
+        "Plate_Info sample sheet has {} x {} wells, which isn't one of the "
+        "plate formats {}".format(
+            nbr_rows,
+            nbr_cols,
+            list(plate_geometry.PLATE_FORMATS),
+        ),
+    )
+
+
 def well_analysis(input_dir, output_dir, method='segmentation'):
     """
     Workflow that pulls all images scanned on a multi-well plate in a standard ELISA format (one antigen per well)
@@ -28,31 +68,38 @@ def well_analysis(input_dir, output_dir, method='segmentation'):
     start = time.time()
 
     # metadata isn't used for the well format
-    MetaData(input_dir, output_dir)
+    run_context = MetaData(input_dir, output_dir).run_context
 
-    # Read plate info
+    # Read plate info within the plate format given by the sample sheet,
+    # the first column is the row names. Cells outside the plate are ignored
+    plate_info_path = os.path.join(input_dir, 'Plate_Info.xlsx')
+    plate = get_plate_geometry(plate_info_path)
     plate_info = pd.read_excel(
-        os.path.join(input_dir, 'Plate_Info.xlsx'),
-        usecols='A:M',
+        plate_info_path,
+        usecols=range(plate.nbr_cols + 1),
+        nrows=plate.nbr_rows,
         sheet_name=None,
         index_col=0,
     )
-    # Write an excel file that can be read into jupyter notebook with minimal parsing.
-    xlwriter_int = pd.ExcelWriter(os.path.join(constants.RUN_PATH, 'intensities.xlsx'))
     # get well directories
     well_images = io_utils.get_image_paths(input_dir)
 
     int_well = []
+    # Time spent measuring well intensities in this plate
+    time_int = 0.
     for well_name, im_path in well_images.items():
         # read image
         image = io_utils.read_gray_im(im_path)
         print(well_name)
 
         # measure intensity
+        start_int = time.time()
         if method == 'segmentation':
             # segment well using otsu thresholding
-            well_mask = image_parser.get_well_mask(image, segmethod='otsu')
-            int_well_ = image_parser.get_well_intensity(image, well_mask)
+            int_well_, well_mask = image_parser.get_well_intensity_fused(
+                image,
+                segmethod='otsu',
+            )
 
         elif method == 'crop':
             # get intensity at square crop in the middle of the image
@@ -64,11 +111,12 @@ def well_analysis(input_dir, output_dir, method='segmentation'):
             well_mask = np.ones_like(im_crop, dtype='bool')
             int_well_ = image_parser.get_well_intensity(im_crop, well_mask)
 
+        time_int += time.time() - start_int
         int_well.append(int_well_)
 
         # SAVE FOR DEBUGGING
-        if constants.DEBUG:
-            output_name = os.path.join(constants.RUN_PATH, well_name)
+        if run_context.debug:
+            output_name = os.path.join(run_context.run_path, well_name)
 
             # Save mask of the well, cropped grayscale image, cropped spot segmentation.
             io.imsave(output_name + "_well_mask.png",
@@ -87,9 +135,9 @@ def well_analysis(input_dir, output_dir, method='segmentation'):
                       (img_/256).astype('uint8'))
 
     df_int = pd.DataFrame(
-        np.reshape(int_well, (8, 12)),
-        index=list(string.ascii_uppercase[:8]),
-        columns=range(1, 13),
+        plate.to_array(list(well_images), int_well),
+        index=plate_info['sample'].index,
+        columns=plate_info['sample'].columns,
     )
     plate_info.update({'intensity': df_int})
 
@@ -105,10 +153,13 @@ def well_analysis(input_dir, output_dir, method='segmentation'):
         df_od = np.log10(int_blank / df_int)
         plate_info.update({'od': df_od})
 
-    # save analysis results
-    for k, v in plate_info.items():
-        v.to_excel(xlwriter_int, sheet_name=k)
-    xlwriter_int.close()
+    # save analysis results in an excel file that can be read into
+    # jupyter notebook with minimal parsing
+    xlsx_writer.write_sheets(
+        os.path.join(run_context.run_path, 'intensities.xlsx'),
+        plate_info,
+    )
 
     stop = time.time()
+    print(f"\ttime to measure well intensities={time_int}")
     print(f"\ttime to process={stop - start}")
@@ -2,10 +2,10 @@ import pandas as pd
 import numpy as np
 import os
 import re
-from matplotlib import pyplot as plt
-import seaborn as sns
-from interpretation.plotting import roc_plot_grid, total_plots
+from interpretation.plotting import cat_plot, fit2df, fourPL, get_roc_df, roc_plot_grid, total_plots
 from interpretation.report_reader import slice_df, normalize_od, read_output_batch
+import interpretation.render_scheduler as render_scheduler
+import interpretation.report_store as report_store
 import array_analyzer.extract.constants as constants
 
 
@@ -62,7 +62,73 @@ def read_config(input_dir):
                 scn_scn_df = pd.read_excel(config_file, sheet_name='scienion output dirs', comment='#')
     return ntl_dirs_df, scn_scn_df, plot_setting_df, roc_param_df, cat_param_df, fit_param_df
 
-def analyze_od(input_dir, output_dir, load_report):
+def get_store_filters(plot_setting_df, roc_param_df, cat_param_df, fit_param_df):
+    """
+    Find the antigens and sera needed by the plots in the config, so only
+    those are loaded from the master report store.
+    :param dataframe plot_setting_df: 'general plotting settings' tab in the config file.
+    :param dataframe roc_param_df: 'ROC plot' tab in the config file.
+    :param dataframe cat_param_df: 'categorical plot' tab in the config file.
+    :param dataframe fit_param_df: 'standard curves' tab in the config file.
+    :return list/None antigens: antigens to load, None for all
+    :return list/None sera: serum IDs to load, None for all
+    """
+    norm_antigen = plot_setting_df['normalize OD by']
+    antigens = plot_setting_df['antigens to plot']
+    if antigens is None or (isinstance(antigens, str) and antigens == 'all'):
+        antigens = None
+    else:
+        if isinstance(antigens, str):
+            antigens = [antigens]
+        antigens = list(antigens)
+        if norm_antigen is not None:
+            antigens.append(norm_antigen)
+    # Normalization uses all sera in a plate
+    sera = None
+    param_dfs = [df for df in [roc_param_df, cat_param_df, fit_param_df] if not df.empty]
+    if norm_antigen is None and len(param_dfs) > 0 and \
+            all(df['serum ID action'] == 'keep' and df['serum ID'] is not None
+                for df in param_dfs):
+        sera = sorted(set().union(*[df['serum ID'] for df in param_dfs]))
+    return antigens, sera
+
+
+def read_report_store(output_dir, ntl_dirs_df, scn_scn_df, load_report, antigens=None, sera=None,
+                      nbr_workers=None):
+    """
+    Update the master report store in the output directory with plates listed
+    in the config, and load the rows needed for the analysis.
+    :param str output_dir: Output directory
+    :param dataframe ntl_dirs_df: 'multisero output dirs' tab in the config file.
+    :param dataframe scn_scn_df: 'scienion output dirs' tab in the config file.
+    :param bool load_report: If True, load all plates in the store without reading the outputs
+    :param list/None antigens: antigens to load, None for all
+    :param list/None sera: serum IDs to load, None for all
+    :param int/None nbr_workers: number of processes reading new plates
+    :return dataframe stitched_multisero_df: combined multisero and scienion OD dataframe
+    """
+    store = report_store.MasterReportStore(os.path.join(output_dir, 'master_report_store'))
+    keys = pipelines = None
+    if not load_report:
+        keys = store.update(ntl_dirs_df, scn_scn_df, nbr_workers=nbr_workers)
+        pipelines = []
+        if not ntl_dirs_df.empty:
+            pipelines.append('nautilus')
+        if not scn_scn_df.empty:
+            pipelines.append('scienion')
+    stitched_multisero_df = store.load(
+        keys=keys,
+        antigens=antigens,
+        sera=sera,
+        pipelines=pipelines,
+    )
+    assert not stitched_multisero_df.empty, \
+        'No rows loaded from the master report store. Please check the plotting keys'
+    return stitched_multisero_df
+
+
+def analyze_od(input_dir, output_dir, load_report, report_store=False,
+               quick_look=False, nbr_workers=None):
     """
     Perform analysis on multisero or scienion OD outputs specified in the config files.
     Save the combined table as 'master report' in the output directory.
@@ -70,11 +136,25 @@ def analyze_od(input_dir, output_dir, load_report):
     :param str output_dir: Output directory
     :param bool load_report: If True, load the saved 'master report' in the output directory
     from the previous run. Load from the master report is much faster.
+    :param bool report_store: If True, keep the master report in a columnar store in the
+    output directory, only read plates that are new or changed, and only load the
+    antigens and sera needed for the plots (requires pyarrow).
+    :param bool quick_look: If True, save low resolution plots and use strip plots
+    instead of swarm plots for large categorical plots.
+    :param int/None nbr_workers: Number of processes computing ROC curves and
+    4PL fits, and rendering plots. Defaults to number of CPUs.
     """
     os.makedirs(output_dir, exist_ok=True)
     ntl_dirs_df, scn_scn_df, plot_setting_df, roc_param_df, cat_param_df, fit_param_df =\
         read_config(input_dir)
-    stitched_multisero_df = read_output_batch(output_dir, ntl_dirs_df, scn_scn_df, load_report)
+    if report_store:
+        antigens, sera = get_store_filters(plot_setting_df, roc_param_df, cat_param_df, fit_param_df)
+        stitched_multisero_df = read_report_store(
+            output_dir, ntl_dirs_df, scn_scn_df, load_report, antigens=antigens, sera=sera,
+            nbr_workers=nbr_workers,
+        )
+    else:
+        stitched_multisero_df = read_output_batch(output_dir, ntl_dirs_df, scn_scn_df, load_report)
     if plot_setting_df['antigens to plot'] == 'all':
         plot_setting_df['antigens to plot'] = stitched_multisero_df['antigen'].unique()
     split_plots_by = plot_setting_df['split plots by']
@@ -98,6 +178,8 @@ def analyze_od(input_dir, output_dir, load_report):
                                  'secondary dilution','PRNT'])['OD'].mean().reset_index()
         suffix = '_'.join([suffix, aggregate])
 
+    # Plot data frames are computed first, then all plots are rendered together
+    scheduler = render_scheduler.RenderScheduler(nbr_workers=nbr_workers, quick_look=quick_look)
     for split_val in split_plots_vals:
         split_suffix = suffix
         if split_val is not None:
@@ -126,7 +208,10 @@ def analyze_od(input_dir, output_dir, load_report):
             #%%
             print('{} unique positive sera'.format(len(roc_df.loc[roc_df['serum type']=='positive', 'serum ID'].unique())))
             print('{} unique negative sera'.format(len(roc_df.loc[roc_df['serum type'] == 'negative', 'serum ID'].unique())))
-            roc_plot_grid(roc_df, constants.RUN_PATH, '_'.join(['ROC', roc_suffix]), 'png', ci=ci, fpr=fpr, hue=hue)
+            print('Computing ROC curves...')
+            roc_curve_df = get_roc_df(roc_df, ci=ci, nbr_workers=nbr_workers)
+            scheduler.add(roc_plot_grid, roc_df, constants.RUN_PATH, '_'.join(['ROC', roc_suffix]), 'png',
+                          ci=ci, fpr=fpr, hue=hue, roc_df=roc_curve_df)
     #%% Plot categorical scatter plot for episurvey
         if not cat_param_df.empty:
             sera_cat_list = cat_param_df['serum ID']
@@ -136,25 +221,18 @@ def analyze_od(input_dir, output_dir, load_report):
             # plot specific slicing
             cat_df = slice_df(df_norm_sub, slice_action, 'serum ID', sera_cat_list) #serum ID --> antigen
             assert not cat_df.empty, 'Plotting dataframe is empty. Please check the plotting keys'
-            sns.set_context("talk")
-            g = sns.catplot(x="serum type", y="OD", hue=hue, col=split_subplots_by, kind="swarm",
-                            data=cat_df, col_wrap=3)
-            g.set_xticklabels(rotation=65, horizontalalignment='right')
-
-
-            plt.savefig(os.path.join(constants.RUN_PATH, 'catplot_{}.png'.format(split_suffix)),
-                                          dpi=300, bbox_inches='tight')
-            if cat_param_df['zoom']:
-                g.set(ylim=(-0.05, 0.4))
-                plt.savefig(os.path.join(constants.RUN_PATH, 'catplot_zoom_{}.png'.format(split_suffix)),
-                                              dpi=300, bbox_inches='tight')
+            scheduler.add(cat_plot, cat_df, constants.RUN_PATH, split_suffix, 'png', hue=hue,
+                          split_subplots_by=split_subplots_by, zoom=cat_param_df['zoom'],
+                          kind=scheduler.cat_kind(cat_df.shape[0]))
         #%% 4PL fit
         if not fit_param_df.empty:
             slice_action = fit_param_df['serum ID action']
             hue = fit_param_df['hue']
             dilution_df = slice_df(df_norm_sub, slice_action, 'serum ID', fit_param_df['serum ID'])
             split_subplots_by = fit_param_df['split subplots by']
-            total_plots(dilution_df, constants.RUN_PATH, 'fit_{}'.format(split_suffix), 'png', hue=hue,
-                                zoom=fit_param_df['zoom'], split_subplots_by=split_subplots_by, col_wrap=2)
-        plt.close('all')
+            dilution_df_fit = fit2df(dilution_df, fourPL, nbr_workers=nbr_workers)
+            scheduler.add(total_plots, dilution_df, constants.RUN_PATH, 'fit_{}'.format(split_suffix), 'png',
+                          hue=hue, zoom=fit_param_df['zoom'], split_subplots_by=split_subplots_by,
+                          col_wrap=2, dilution_df_fit=dilution_df_fit)
+    scheduler.run()
 
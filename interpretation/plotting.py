@@ -1,3 +1,4 @@
+import concurrent.futures
 import itertools
 import os
 import numpy as np
@@ -13,64 +14,113 @@ from scipy import optimize as optimization
 from sklearn.metrics import roc_auc_score
 from sklearn.metrics._ranking import _binary_clf_curve
 from sklearn.exceptions import UndefinedMetricWarning
-from sklearn.utils import resample
 
 
 def fourPL(x, A, B, C, D):
     """4 parameter logistic function"""
     return ((A-D)/(1.0+((x/C)**(B))) + D)
 
-def fit2df(df, model, serum_group='serum ID'):
+# Columns defining a dilution series fit with a 4PL curve, besides serum group
+FIT_GROUP_COLS = ['antigen', 'secondary ID', 'plate ID', 'PRNT', 'secondary dilution']
+# Columns describing a dilution series, copied from its first row
+FIT_INFO_COLS = ['antigen', 'serum type', 'serum cat', 'secondary ID',
+                 'secondary dilution', 'pipeline', 'PRNT', 'plate ID']
+# Default initial guess for 4PL parameters A, B, C, D
+FOURPL_GUESS = [0, 1, 5e-4, 1]
+
+
+def fit_dilution_chain(series_list, model=fourPL):
+    """
+    Fit a model to a chain of neighbouring dilution series. Each fit is
+    initialized with the parameters of the previous fit in the chain,
+    and with the default guess if that doesn't converge.
+    :param list series_list: (xdata, ydata) arrays of each dilution series
+    :param function model: model to fit, e.g. fourPL
+    :return list params_list: fit parameters of each series
+    """
+    params_list = []
+    guess = FOURPL_GUESS
+    for xdata, ydata in series_list:
+        try:
+            params, _ = optimization.curve_fit(model, xdata, ydata, guess,
+                                               bounds=(0, np.inf), maxfev=1e5)
+        except RuntimeError:
+            if guess is FOURPL_GUESS:
+                raise
+            params, _ = optimization.curve_fit(model, xdata, ydata, FOURPL_GUESS,
+                                               bounds=(0, np.inf), maxfev=1e5)
+        params_list.append(params)
+        guess = params
+    return params_list
+
+
+def fit_params_df(df, model=fourPL, serum_group='serum ID', nbr_workers=None):
+    """
+    Fit model to serum dilution series in dataframe, one fit per existing
+    combination of serum group, antigen, secondary, plate ID, PRNT and
+    secondary dilution. Series of the same antigen are fit as a chain in
+    one process, ordered so that neighbouring series warm start each other.
+    :param dataframe df: dataframe containing serum OD with serial dilution
+    :param function model: model to fit, e.g. fourPL
+    :param str serum_group: column identifying a serum
+    :param int/None nbr_workers: number of worker processes, defaults to number of CPUs
+    :return dataframe params_df: one row per dilution series with series info,
+        fit parameters A, B, C, D and the range of serum dilutions
+    """
+    group_cols = [serum_group] + FIT_GROUP_COLS
+    info_cols = [serum_group] + [col for col in FIT_INFO_COLS if col != serum_group]
+    df = df[df['serum dilution'] > 0]  # concentration has to be positive
+    # Neighbouring series of an antigen follow each other
+    chain_order = ['antigen', 'secondary ID', 'secondary dilution', serum_group, 'plate ID', 'PRNT']
+    first_rows = []
+    series = []
+    for _, sub_df in df.groupby(group_cols, sort=False):
+        first_rows.append(sub_df.iloc[0][info_cols])
+        series.append((sub_df['serum dilution'].to_numpy(), sub_df['OD'].to_numpy()))
+    first_rows = pd.DataFrame(first_rows, columns=info_cols).reset_index(drop=True)
+    first_rows['series_idx'] = np.arange(len(first_rows))
+    series_order = first_rows.sort_values(chain_order, kind='mergesort')
+    chains = [list(chain_df['series_idx']) for _, chain_df
+              in series_order.groupby('antigen', sort=False)]
+    chain_series = [[series[idx] for idx in chain] for chain in chains]
+    print('Fitting {} dilution series...'.format(len(series)))
+    if len(chains) <= 1 or nbr_workers == 1:
+        chain_params = [fit_dilution_chain(series_list, model) for series_list in chain_series]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(nbr_workers) as executor:
+            chain_params = list(executor.map(
+                fit_dilution_chain, chain_series, [model] * len(chain_series)))
+    params = np.zeros((len(series), 4))
+    for chain, params_list in zip(chains, chain_params):
+        params[chain] = params_list
+    params_df = first_rows.drop(columns='series_idx')
+    params_df[['A', 'B', 'C', 'D']] = params
+    params_df['dilution min'] = [np.min(xdata) for xdata, _ in series]
+    params_df['dilution max'] = [np.max(xdata) for xdata, _ in series]
+    print('4PL fitting finished')
+    return params_df
+
+
+def fit2df(df, model, serum_group='serum ID', nbr_workers=None):
     """fit model to x, y data in dataframe.
     Return a dataframe with fit x, y for plotting
     """
-    sera = df[serum_group].unique()
-    antigens = df['antigen'].unique()
-    secondaries = df['secondary ID'].unique()
-    plate_ids = df['plate ID'].unique()
-    prnt = df['PRNT'].unique()
-
-    keys = itertools.product(sera, antigens, secondaries, plate_ids, prnt)
-    df_fit = pd.DataFrame(columns=df.columns)
-    for serum, antigen, secondary, plate_id, prnt in keys:
-        print('Fitting {}, {}...'.format(serum, antigen))
-        sec_dilu_df = df[(df[serum_group] == serum) &
-                        (df['antigen'] == antigen) &
-                        (df['secondary ID'] == secondary) &
-                         (df['plate ID'] == plate_id) &
-                         (df['PRNT'] == prnt)]
-        sec_dilutions = sec_dilu_df['secondary dilution'].unique()
-        for sec_dilution in sec_dilutions:
-            sub_df = sec_dilu_df[(sec_dilu_df['secondary dilution'] == sec_dilution)].reset_index(drop=True)
-            df_fit_temp = pd.DataFrame()
-            guess = [0, 1, 5e-4, 1]
-            xdata = sub_df['serum dilution'].to_numpy()
-            ydata = sub_df['OD'].to_numpy()
-            ydata = ydata[xdata > 0]
-            xdata = xdata[xdata > 0]  # concentration has to be positive
-            params, params_covariance = optimization.curve_fit(model, xdata, ydata, guess, bounds=(0, np.inf), maxfev=1e5)
-            x_input = np.logspace(np.log10(np.min(xdata)), np.log10(np.max(xdata)), 50)
-            #y_fit = fivePL(x_input,*params)
-            y_fit = fourPL(x_input, *params)
-
-            df_fit_temp['serum dilution'] = x_input
-            df_fit_temp['OD'] = y_fit
-            df_fit_temp['b'] = params[1]
-            df_fit_temp['c'] = params[2]
-            df_fit_temp['d'] = params[3]
-            sub_df_expand = pd.concat(
-                [sub_df.loc[[0], [serum_group,
-                                  'antigen',
-                                 'serum type',
-                                 'serum cat',
-                                 'secondary ID',
-                                 'secondary dilution',
-                                 'pipeline',
-                                  'PRNT',
-                                  'plate ID']]] * len(df_fit_temp.index), axis=0).reset_index(drop=True)
-            df_fit_temp = pd.concat([df_fit_temp, sub_df_expand], axis=1)
-            df_fit = df_fit.append(df_fit_temp)
-    print('4PL fitting finished')
+    params_df = fit_params_df(df, model, serum_group=serum_group, nbr_workers=nbr_workers)
+    nbr_points = 50
+    # Log spaced serum dilutions over the range of each series
+    steps = np.linspace(0, 1, nbr_points)
+    log_min = np.log10(params_df['dilution min'].to_numpy())[:, np.newaxis]
+    log_max = np.log10(params_df['dilution max'].to_numpy())[:, np.newaxis]
+    x_input = 10 ** (log_min + (log_max - log_min) * steps)
+    params = params_df[['A', 'B', 'C', 'D']].to_numpy()
+    y_fit = model(x_input, *[params[:, [i]] for i in range(4)])
+    df_fit = params_df.loc[params_df.index.repeat(nbr_points)].reset_index(drop=True)
+    df_fit['serum dilution'] = x_input.ravel()
+    df_fit['OD'] = y_fit.ravel()
+    df_fit['b'] = df_fit['B']
+    df_fit['c'] = df_fit['C']
+    df_fit['d'] = df_fit['D']
+    df_fit = df_fit.drop(columns=['A', 'B', 'C', 'D', 'dilution min', 'dilution max'])
     return df_fit
 
 def roc_curve(y_true, y_score, pos_label=None, sample_weight=None,
@@ -204,28 +254,97 @@ def roc_curve(y_true, y_score, pos_label=None, sample_weight=None,
 
 
 
-def roc_ci(df, ci):
-    """Helper function to compute mean and confidence intervals
-    from the bootstrapped distribution"""
-    tpr_mean = df['tpr'].mean()
-    cis = sns.utils.ci(df['tpr'], ci).tolist()
-    return pd.Series([tpr_mean] + cis, ['True positive rate', 'ci_low', 'ci_high'])
+# Number of bootstrap replicates for ROC confidence intervals
+ROC_NBR_BOOTSTRAP = 1000
+# False positive rates at which bootstrapped ROC curves are evaluated
+ROC_FPR_GRID = np.linspace(0, 1, 101)
+# Columns defining a ROC curve
+ROC_GROUP_COLS = ['antigen', 'secondary ID', 'secondary dilution', 'pipeline']
+
+
+def stratified_resample_idx(y_true, nbr_samples, random_state):
+    """
+    Draw stratified bootstrap samples as one index matrix. Each sample keeps
+    the number of positives and negatives of the original data.
+    :param np.array y_true: boolean labels
+    :param int nbr_samples: number of bootstrap samples
+    :param np.random.RandomState random_state: random number generator
+    :return np.array resample_idx: nbr_samples x len(y_true) indices into y_true
+    """
+    resample_idx = []
+    for label in [True, False]:
+        class_idx = np.flatnonzero(y_true == label)
+        draws = random_state.randint(0, len(class_idx), size=(nbr_samples, len(class_idx)))
+        resample_idx.append(class_idx[draws])
+    return np.hstack(resample_idx)
 
-def roc_from_df(df, ci=None):
+
+def bootstrap_roc(y_true, y_score, nbr_samples=ROC_NBR_BOOTSTRAP,
+                  fpr_grid=ROC_FPR_GRID, random_state=None):
+    """
+    Compute ROC curves and AUCs of all bootstrap samples at once. Scores of
+    each sample are sorted and true and false positives are counted with
+    cumulative sums, counting tied scores as one threshold like roc_curve.
+    The true positive rate of each sample is evaluated on a fixed grid of
+    false positive rates as the highest rate reached without exceeding it.
+    :param np.array y_true: boolean labels
+    :param np.array y_score: scores, higher for positives
+    :param int nbr_samples: number of bootstrap samples
+    :param np.array fpr_grid: false positive rates to evaluate curves at
+    :param int/None random_state: random seed
+    :return np.array tprs: nbr_samples x len(fpr_grid) true positive rates
+    :return np.array aucs: area under ROC curve of each sample
+    """
+    y_true = np.asarray(y_true, dtype=bool)
+    y_score = np.asarray(y_score, dtype=float)
+    nbr_pos = np.sum(y_true)
+    nbr_neg = len(y_true) - nbr_pos
+    if nbr_pos == 0 or nbr_neg == 0:
+        return np.full((nbr_samples, len(fpr_grid)), np.nan), np.full(nbr_samples, np.nan)
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    resample_idx = stratified_resample_idx(y_true, nbr_samples, random_state)
+    scores = y_score[resample_idx]
+    order = np.argsort(-scores, axis=1, kind='mergesort')
+    scores = np.take_along_axis(scores, order, axis=1)
+    labels = np.take_along_axis(y_true[resample_idx], order, axis=1)
+    tps = np.cumsum(labels, axis=1)
+    fps = np.arange(1, labels.shape[1] + 1) - tps
+    # Tied scores share one threshold, use counts at the end of each tie
+    nbr_cols = labels.shape[1]
+    is_tie_end = np.ones_like(labels)
+    is_tie_end[:, :-1] = scores[:, :-1] != scores[:, 1:]
+    tie_end = np.where(is_tie_end, np.arange(nbr_cols), nbr_cols)
+    tie_end = np.minimum.accumulate(tie_end[:, ::-1], axis=1)[:, ::-1]
+    tps = np.hstack([np.zeros((nbr_samples, 1), dtype=tps.dtype),
+                     np.take_along_axis(tps, tie_end, axis=1)])
+    fps = np.hstack([np.zeros((nbr_samples, 1), dtype=fps.dtype),
+                     np.take_along_axis(fps, tie_end, axis=1)])
+    aucs = np.trapz(tps / nbr_pos, fps / nbr_neg, axis=1)
+    # Last threshold per sample with at most the grid's false positives.
+    # Offsetting rows makes the flattened counts sorted for one searchsorted
+    max_fps = np.floor(fpr_grid * nbr_neg + 1e-9).astype(np.int64)
+    row_offset = (nbr_neg + 1) * np.arange(nbr_samples)[:, np.newaxis]
+    flat_idx = np.searchsorted(
+        (fps + row_offset).ravel(),
+        (max_fps + row_offset).ravel(),
+        side='right',
+    ) - 1
+    tprs = tps.ravel()[flat_idx].reshape(nbr_samples, len(fpr_grid)) / nbr_pos
+    return tprs, aucs
+
+
+def roc_from_df(df, ci=None, random_state=None):
     """
     Helper function to compute ROC curves using pandas.groupby(). Confidence intervals
     are computed using bootstrapping with stratified resampling
     :param dataframe df: dataframe containing serum OD info
     :param int or None ci: Confidence interval of the ROC curves in the unit of percent
     (95 would be 95%). If None, confidence intervals are not computed.
+    :param int/None random_state: random seed for bootstrapping
     :return dataframe rate_df: dataframe contains ROC curves for each condition
     """
-    aucs = []
-    n_btstp = 1000
     s = {}
-    fprs = []
-    tprs = []
-    thrs = []
     y_test = df['serum type'] == 'positive'
     y_prob = df['OD']
     s['False positive rate'], s['True positive rate'], s['threshold'] = \
@@ -239,50 +358,63 @@ def roc_from_df(df, ci=None):
     if ci is None:
         return pd.Series(s)
     else:
-        for i in range(n_btstp):
-            df_rsmpl = resample(df, n_samples=len(df), stratify=df['serum type'])
-            y_test = df_rsmpl['serum type'] == 'positive'
-            y_prob = df_rsmpl['OD']
-            fpr_tmp, tpr_tmp, thr_tmp = \
-                roc_curve(y_test, y_prob, pos_label=1, drop_intermediate=False)
-            fprs += fpr_tmp.tolist()
-            tprs += tpr_tmp.tolist()
-            thrs += thr_tmp.tolist()
-            try:
-                aucs.append(roc_auc_score(y_test, y_prob))
-            except ValueError as err:
-                aucs.append(np.nan)
-        rate_df = pd.DataFrame({'False positive rate': fprs, 'tpr': tprs})
-        rate_df = rate_df.groupby('False positive rate').apply(
-            lambda x: roc_ci(x, ci)).reset_index()
-        if len(rate_df) > 0:
-            rate_df = pd.concat([pd.DataFrame(data=np.zeros((1, 4)), columns=rate_df.columns), rate_df]) # add the origin corresponding to maximum threshold
-        auc_low, auc_high = sns.utils.ci(aucs, ci)
+        tprs, aucs = bootstrap_roc(
+            y_test.to_numpy(),
+            y_prob.to_numpy(),
+            random_state=random_state,
+        )
+        with warnings.catch_warnings():
+            # Groups with one serum type have no ROC curve
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            tpr_mean = np.nanmean(tprs, axis=0)
+            ci_low, ci_high = np.nanpercentile(tprs, [50 - ci / 2, 50 + ci / 2], axis=0)
+            auc_low, auc_high = np.nanpercentile(aucs, [50 - ci / 2, 50 + ci / 2])
+        # add the origin corresponding to maximum threshold
+        rate_df = pd.DataFrame({
+            'False positive rate': np.append(0, ROC_FPR_GRID),
+            'True positive rate': np.append(0, tpr_mean),
+            'ci_low': np.append(0, ci_low),
+            'ci_high': np.append(0, ci_high),
+        })
         rate_df['auc_ci_low'] = auc_low
         rate_df['auc_ci_high'] = auc_high
         return rate_df
 
-def get_roc_df(df, ci=None):
+
+def get_roc_df(df, ci=None, nbr_workers=None):
     """
     Generate ROC curves for serum samples
     :param dataframe df: dataframe containing serum OD info
     :param int or None ci: Confidence interval of the ROC curves in the unit of percent
     (95 would be 95%). If None, confidence intervals are not computed.
+    :param int/None nbr_workers: number of worker processes bootstrapping ROC
+        curves, defaults to number of CPUs
     :return dataframe roc_df: dataframe contains ROC curves for each condition
     """
     df = df[df['serum type'].isin(['positive', 'negative'])]
-    roc_df = df[['antigen',
-                 'serum type',
-                 'secondary ID',
-                 'secondary dilution',
-                 'OD',
-                 'pipeline']]
-    roc_df = roc_df.groupby(['antigen',
-                             'secondary ID',
-                             'secondary dilution',
-                             'pipeline']).apply(lambda x: roc_from_df(x, ci))
-    # roc_df = roc_df.reset_index()
-    roc_df = roc_df.apply(pd.Series.explode).astype(float).reset_index()
+    roc_df = df[ROC_GROUP_COLS + ['serum type', 'OD']]
+    group_keys = []
+    group_dfs = []
+    for key, group_df in roc_df.groupby(ROC_GROUP_COLS):
+        group_keys.append(key)
+        group_dfs.append(group_df)
+    if ci is None or len(group_dfs) <= 1 or nbr_workers == 1:
+        rate_dfs = [roc_from_df(group_df, ci) for group_df in group_dfs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(nbr_workers) as executor:
+            rate_dfs = list(executor.map(roc_from_df, group_dfs, [ci] * len(group_dfs)))
+    for idx, (key, rate_df) in enumerate(zip(group_keys, rate_dfs)):
+        if ci is None:
+            rate_df = pd.DataFrame(rate_df.to_dict())
+        rate_df = rate_df.astype(float)
+        for col, value in zip(ROC_GROUP_COLS, key):
+            rate_df[col] = value
+        rate_dfs[idx] = rate_df
+    if len(rate_dfs) == 0:
+        return pd.DataFrame(columns=ROC_GROUP_COLS)
+    roc_df = pd.concat(rate_dfs, ignore_index=True)
+    roc_df = roc_df[ROC_GROUP_COLS + [col for col in roc_df.columns
+                                      if col not in ROC_GROUP_COLS]]
     roc_df.dropna(inplace=True)
     return roc_df
 
@@ -317,7 +449,7 @@ def roc_plot(x, y, **kwargs):
                 fontsize=12, color='g')  # add text
 
 def roc_plot_grid(df, fig_path, fig_name, ext='png', hue=None,
-                  col_wrap=2, ci=95, tpr=None, fpr=None):
+                  col_wrap=2, ci=95, tpr=None, fpr=None, roc_df=None, dpi=300):
     """
     Generate ROC plots for each antigen
     :param dataframe df: dataframe containing serum OD info
@@ -330,7 +462,9 @@ def roc_plot_grid(df, fig_path, fig_name, ext='png', hue=None,
     (95 would be 95%). If None, confidence intervals are not computed.
     :param float tpr: True positive rate at which the false positive rate is shown on the curve
     :param float fpr: False positive rate at which the true positive rate is shown on the curve
-    :return:
+    :param dataframe roc_df: ROC curves of df from get_roc_df, computed if None
+    :param int dpi: resolution of the saved figure
+    :return dataframe roc_df: ROC curves for each condition
     """
     assert tpr is None or fpr is None, \
         'Specify either true positive rate or false positive rate, not both.'
@@ -340,14 +474,15 @@ def roc_plot_grid(df, fig_path, fig_name, ext='png', hue=None,
     sns.set_context("notebook")
     assert not df.empty, 'Plotting dataframe is empty. Please check the plotting keys'
     palette = sns.color_palette(n_colors=len(df[hue].unique()))
-    print('Computing ROC curves...')
-    roc_df = get_roc_df(df, ci=ci)
+    if roc_df is None:
+        print('Computing ROC curves...')
+        roc_df = get_roc_df(df, ci=ci)
     g = sns.FacetGrid(roc_df, hue=hue, col="antigen", col_order=antigens, col_wrap=col_wrap, aspect=1,
                       xlim=(-0.05, 1), ylim=(0, 1.05))
                       # hue_kws={'linestyle': ['-', '--', '-.', ':']})
     g = (g.map_dataframe(roc_plot, 'False positive rate', 'True positive rate', ci=ci, fpr=fpr))
     plt.savefig(os.path.join(fig_path, '.'.join([fig_name, ext])),
-                             dpi=300, bbox_inches='tight')
+                             dpi=dpi, bbox_inches='tight')
     plt.close()
     return roc_df
 
@@ -377,6 +512,33 @@ def thr_plot_grid(roc_df, fig_path, fig_name, ext, col_wrap=3):
     plt.close()
 
 
+def cat_plot(cat_df, fig_path, fig_suffix, ext='png', hue=None, split_subplots_by=None,
+             zoom=False, kind='swarm', dpi=300):
+    """
+    Categorical scatter plot of OD per serum type for episurvey
+    :param dataframe cat_df: dataframe containing serum OD info
+    :param str fig_path: dir to save the plots
+    :param str fig_suffix: suffix of the figure file names
+    :param str ext: figure file extension
+    :param str hue: attribute to be plotted with different colors
+    :param str split_subplots_by: attribute to split subplots by
+    :param bool zoom: If true, output zoom-in of the low OD region
+    :param str kind: 'swarm' or 'strip', strip plots are faster for many sera
+    :param int dpi: resolution of the saved figures
+    """
+    assert not cat_df.empty, 'Plotting dataframe is empty. Please check the plotting keys'
+    sns.set_context("talk")
+    g = sns.catplot(x="serum type", y="OD", hue=hue, col=split_subplots_by, kind=kind,
+                    data=cat_df, col_wrap=3)
+    g.set_xticklabels(rotation=65, horizontalalignment='right')
+    plt.savefig(os.path.join(fig_path, 'catplot_{}.{}'.format(fig_suffix, ext)),
+                dpi=dpi, bbox_inches='tight')
+    if zoom:
+        g.set(ylim=(-0.05, 0.4))
+        plt.savefig(os.path.join(fig_path, 'catplot_zoom_{}.{}'.format(fig_suffix, ext)),
+                    dpi=dpi, bbox_inches='tight')
+
+
 def scatter_plot(df,
                  x_col,
                  y_col,
@@ -454,7 +616,8 @@ def joint_plot(df_ori,
                 dpi=300, bbox_inches='tight')
 
 def standard_curve_plot(dilution_df, fig_path, fig_name, ext, hue=None,
-                        zoom=False, split_subplots_by='antigen', col_wrap=2):
+                        zoom=False, split_subplots_by='antigen', col_wrap=2,
+                        dilution_df_fit=None, dpi=300):
     """
     Plot standard curves for ELISA
     :param dataframe dilution_df: dataframe containing serum OD with serial diluition
@@ -464,9 +627,12 @@ def standard_curve_plot(dilution_df, fig_path, fig_name, ext, hue=None,
     :param str hue: attribute to be plotted with different colors
     :param int col_wrap: number of columns in the facetgrid
     :param bool zoom: If true, output zoom-in of the low OD region
+    :param dataframe dilution_df_fit: 4PL fits of the dilution series from fit2df,
+        fit if None
+    :param int dpi: resolution of the saved figures
     """
-    dilution_df_fit = dilution_df.copy()
-    dilution_df_fit = fit2df(dilution_df_fit, fourPL)
+    if dilution_df_fit is None:
+        dilution_df_fit = fit2df(dilution_df, fourPL)
     hue_list = dilution_df[hue].unique()
     # %% plot standard curves
     # hue_fit_list = [' '.join([x, 'fit']) for x in hue_list]
@@ -492,15 +658,15 @@ def standard_curve_plot(dilution_df, fig_path, fig_name, ext, hue=None,
                      style=style, palette=palette,
                      ax=ax, legend=False)
         ax.set(xscale="log")
-    plt.savefig(os.path.join(fig_path, '.'.join([fig_name, ext])), dpi=300, bbox_inches='tight')
+    plt.savefig(os.path.join(fig_path, '.'.join([fig_name, ext])), dpi=dpi, bbox_inches='tight')
 
     if zoom:
         for val, ax in zip(split_subplots_vals, g.axes.flat):
             ax.set(ylim=[-0.05, 0.4])
         fig_name += '_zoom'
-        plt.savefig(os.path.join(fig_path, '.'.join([fig_name, ext])), dpi=300, bbox_inches='tight')
+        plt.savefig(os.path.join(fig_path, '.'.join([fig_name, ext])), dpi=dpi, bbox_inches='tight')
 
-def plot_heatmap(hmap,fig_path,ext,spot,type,vmin,vmax,x,y):
+def plot_heatmap(hmap,fig_path,ext,spot,type,vmin,vmax,x,y,dpi=300):
     """
     Generates heatmap of IC50 or slope at IC50 for various antigens
     :param dataframe hmap: DataFrame of slope, upper limit, and/or IC50 values per antigen per serum ID
@@ -511,6 +677,7 @@ def plot_heatmap(hmap,fig_path,ext,spot,type,vmin,vmax,x,y):
     :param float vmax: maximum for cmap range
     :param int x: width of heatmap plot
     :param int y: height of heatmap plot
+    :param int dpi: resolution of the saved figure
     """
     #dftt = hmap.filter(like=spot)
     dftt = hmap
@@ -523,15 +690,16 @@ def plot_heatmap(hmap,fig_path,ext,spot,type,vmin,vmax,x,y):
     plt.xticks(rotation=45,fontsize=28)
     plt.yticks(rotation=0,fontsize=28)
     plt.title(f'{type} Values per Antigen per Serum ID ({spot})', fontsize=20)
-    plt.savefig(os.path.join(fig_path, '.'.join([f'{spot}_{type}_map', ext])), dpi=300, bbox_inches='tight')
+    plt.savefig(os.path.join(fig_path, '.'.join([f'{spot}_{type}_map', ext])), dpi=dpi, bbox_inches='tight')
 
-def delta_ic50(ic_df,prnt_val,fig_path,ext,spot,hue):
+def delta_ic50(ic_df,prnt_val,fig_path,ext,spot,hue,dpi=300):
     """
     Generates a heatmap to look at the ratiometric difference between IC50 of various antigens
     :param dataframe ic_df: DataFrame IC50 values per antigen per serum ID
     :param str fig_path: dir to save the plots
     :param str ext: figure file extension
     :param str spot: what type of antigen is being evaluated (ie: EDIII, NS1, etc)
+    :param int dpi: resolution of the saved figure
     """
     if hue =='antigen':
         [i, j, m, p] = [-6, -1, 0, 5]
@@ -561,7 +729,7 @@ def delta_ic50(ic_df,prnt_val,fig_path,ext,spot,hue):
     ax2.set(ylabel=None)
     fig.tight_layout()
     #plt.title(f'Binding Affinity Measurements per Antigen per Serum ID ({spot})', fontsize=20)
-    plt.savefig(os.path.join(fig_path, '.'.join([f'deltaic{spot}map', ext])), dpi=300, bbox_inches='tight')
+    plt.savefig(os.path.join(fig_path, '.'.join([f'deltaic{spot}map', ext])), dpi=dpi, bbox_inches='tight')
 
 def plot_by_type(rvp_list,mks,dilution_df,dilution_df_fit,split_subplots_by,split_subplots_vals,fig_name,
                  fig_path,ext,hue,col_wrap,zoom=False):
@@ -610,7 +778,8 @@ def plot_by_type(rvp_list,mks,dilution_df,dilution_df_fit,split_subplots_by,spli
         plt.savefig(os.path.join(fig_path, '.'.join([fig_name, ext])), dpi=300, bbox_inches='tight')
 
 def total_plots(dilution_df, fig_path, fig_name, ext, hue=None,
-                        zoom=False, split_subplots_by='antigen', col_wrap=2):
+                        zoom=False, split_subplots_by='antigen', col_wrap=2,
+                        dilution_df_fit=None, dpi=300):
     """
     Plot standard curves with heatmap plots for holistic antigen candidate evaluation
     :param dataframe dilution_df: dataframe containing serum OD with serial diluition
@@ -620,10 +789,12 @@ def total_plots(dilution_df, fig_path, fig_name, ext, hue=None,
     :param str hue: attribute to be plotted with different colors
     :param int col_wrap: number of columns in the facetgrid
     :param bool zoom: If true, output zoom-in of the low OD region
+    :param dataframe dilution_df_fit: 4PL fits of the dilution series from fit2df,
+        fit if None
+    :param int dpi: resolution of the saved figures
     """
-    dilution_df_fit = dilution_df.copy()
-    dilution_df_fit = fit2df(dilution_df_fit,
-                             fourPL)
+    if dilution_df_fit is None:
+        dilution_df_fit = fit2df(dilution_df, fourPL)
     ic_50 = dilution_df_fit[['antigen', 'serum ID', 'c', 'b', 'd', 'PRNT', 'OD']]
 
     alt = ic_50.set_index('serum ID').drop_duplicates()
@@ -644,6 +815,7 @@ def total_plots(dilution_df, fig_path, fig_name, ext, hue=None,
     ic_vmax = 0
     y = ' '
 
-    plot_heatmap(lmap, fig_path, ext, spot=y, type='Log of IC50', vmin=-10, vmax=ic_vmax, x=45, y=15)
-    delta_ic50(spot_df, prnt_val, fig_path, ext, spot=y, hue=hue)
-    standard_curve_plot(dilution_df, fig_path, fig_name, ext, hue, zoom, split_subplots_by, col_wrap)
\ No newline at end of file
+    plot_heatmap(lmap, fig_path, ext, spot=y, type='Log of IC50', vmin=-10, vmax=ic_vmax, x=45, y=15, dpi=dpi)
+    delta_ic50(spot_df, prnt_val, fig_path, ext, spot=y, hue=hue, dpi=dpi)
+    standard_curve_plot(dilution_df, fig_path, fig_name, ext, hue, zoom, split_subplots_by, col_wrap,
+                        dilution_df_fit=dilution_df_fit, dpi=dpi)
\ No newline at end of file
@@ -0,0 +1,93 @@
+import concurrent.futures
+import matplotlib
+from matplotlib import pyplot as plt
+
+# Resolution of saved figures
+DPI = 300
+# Resolution of saved figures in quick look mode
+QUICK_LOOK_DPI = 100
+# Categorical plots with more points are drawn as strip plots in quick look mode
+SWARM_MAX_POINTS = 1000
+
+
+def _init_worker():
+    """
+    Render without a display in worker processes
+    """
+    matplotlib.use('Agg')
+
+
+def render(plot_fn, args, kwargs):
+    """
+    Render one figure. Plot style changes made by the plot function are
+    undone afterwards, so each figure looks the same whichever process
+    or order it's rendered in.
+
+    :param function plot_fn: Plotting function that saves its figure(s)
+    :param tuple args: Positional arguments of plot_fn
+    :param dict kwargs: Keyword arguments of plot_fn
+    """
+    with plt.rc_context():
+        plot_fn(*args, **kwargs)
+    plt.close('all')
+
+
+class RenderScheduler:
+    """
+    Collects plotting jobs whose data frames are already computed and renders
+    them once all are known, in a pool of processes using the Agg backend.
+    Quick look mode lowers the resolution of saved figures and replaces
+    swarm plots of large datasets by strip plots.
+    """
+    def __init__(self, nbr_workers=None, quick_look=False):
+        """
+        :param int/None nbr_workers: Number of rendering processes,
+            defaults to number of CPUs. Renders in this process if 1.
+        :param bool quick_look: Render low resolution previews
+        """
+        self.nbr_workers = nbr_workers
+        self.quick_look = quick_look
+        self.jobs = []
+
+    @property
+    def dpi(self):
+        return QUICK_LOOK_DPI if self.quick_look else DPI
+
+    def cat_kind(self, nbr_points):
+        """
+        :param int nbr_points: Number of points in categorical plot
+        :return str kind: Seaborn catplot kind, 'swarm' or 'strip'
+        """
+        if self.quick_look and nbr_points > SWARM_MAX_POINTS:
+            return 'strip'
+        return 'swarm'
+
+    def add(self, plot_fn, *args, **kwargs):
+        """
+        Add a plotting job. Figures are saved at the scheduler's resolution
+        unless dpi is given.
+
+        :param function plot_fn: Module level plotting function that takes
+            a dpi keyword argument
+        """
+        kwargs.setdefault('dpi', self.dpi)
+        self.jobs.append((plot_fn, args, kwargs))
+
+    def run(self):
+        """
+        Render all added jobs and clear them.
+
+        :return int nbr_jobs: Number of rendered jobs
+        """
+        jobs, self.jobs = self.jobs, []
+        if len(jobs) == 0:
+            return 0
+        print('Rendering {} plots...'.format(len(jobs)))
+        if len(jobs) == 1 or self.nbr_workers == 1:
+            for job in jobs:
+                render(*job)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    self.nbr_workers, initializer=_init_worker) as executor:
+                list(executor.map(render, *zip(*jobs)))
+        return len(jobs)
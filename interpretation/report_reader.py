@@ -1,3 +1,4 @@
+import concurrent.futures
 import os
 import numpy as np
 import pandas as pd
@@ -92,6 +93,8 @@ def read_antigen_info(metadata_path):
 def read_multisero_output(file_path, antigen_df, file_type='od'):
     """
     read and re-format multisero spot fitting output
+    The workbook is parsed once and all antigen sheets are linearized
+    in a single concatenation.
     :param str file_path: path to the multisero output xlsx file
     :param dataframe antigen_df:
     :param str file_type: output file type. 'od', 'int', or 'bg'
@@ -99,20 +102,28 @@ def read_multisero_output(file_path, antigen_df, file_type='od'):
     """
     print('Reading {}...'.format(file_type))
     data_col = {'od': 'OD', 'int': 'intensity', 'bg': 'background'}
-    data_df = pd.DataFrame()
-
-    with pd.ExcelFile(file_path) as file:
-        sheet_names = file.sheet_names
-        for _, row in antigen_df.iterrows():
-            if sheet_names[0][0].isnumeric(): # new format
-                sheet_name = '{}_{}_{}'.format(row['antigen_row'], row['antigen_col'], row['antigen'])
-            else:
-                sheet_name = '{}_{}_{}_{}'.format(file_type, row['antigen_row'], row['antigen_col'], row['antigen'])
-            data_1_antiten_df = well2D_to_df1D(xlsx_path=file, sheet=sheet_name, data_col=data_col[file_type])
-            data_1_antiten_df['antigen_row'] = row['antigen_row']
-            data_1_antiten_df['antigen_col'] = row['antigen_col']
-            data_1_antiten_df['antigen'] = row['antigen']
-            data_df = data_df.append(data_1_antiten_df, ignore_index=True)
+    sheets = pd.read_excel(file_path, sheet_name=None, index_col=0)
+    sheet_names = list(sheets)
+    new_format = sheet_names[0][0].isnumeric()
+    antigen_df = antigen_df[['antigen_row', 'antigen_col', 'antigen']].reset_index(drop=True)
+    plate_dfs = []
+    for row in antigen_df.itertuples(index=False):
+        if new_format:
+            sheet_name = '{}_{}_{}'.format(row.antigen_row, row.antigen_col, row.antigen)
+        else:
+            sheet_name = '{}_{}_{}_{}'.format(file_type, row.antigen_row, row.antigen_col, row.antigen)
+        plate_dfs.append(sheets[sheet_name].unstack())
+    if len(plate_dfs) == 0:
+        return pd.DataFrame(columns=['well_id', data_col[file_type], 'antigen_row', 'antigen_col', 'antigen'])
+    # unpivot (linearize) all plates, keeping the antigen index
+    data_df = pd.concat(
+        plate_dfs,
+        keys=range(len(plate_dfs)),
+        names=['antigen_idx', 'col_id', 'row_id'],
+    ).reset_index(name=data_col[file_type])
+    data_df['well_id'] = data_df['row_id'] + data_df['col_id'].map(str)
+    antigen_info = antigen_df.iloc[data_df['antigen_idx'].values].reset_index(drop=True)
+    data_df = pd.concat([data_df[['well_id', data_col[file_type]]], antigen_info], axis=1)
     return data_df
 
 
@@ -124,12 +135,11 @@ def read_scn_output(file_path, plate_info_df):
     :return dataframe: scienion OD dataframe
     """
     # Read analysis output from Scienion
-    scienion_df = pd.DataFrame()
-    with pd.ExcelFile(file_path) as scienion_xlsx:
-        for well_id in plate_info_df['well_id']:
-            OD_1_antiten_df = pd.read_excel(scienion_xlsx, sheet_name=well_id)
-            OD_1_antiten_df['well_id'] = well_id
-            scienion_df = scienion_df.append(OD_1_antiten_df, ignore_index=True)
+    sheets = pd.read_excel(file_path, sheet_name=list(plate_info_df['well_id']))
+    scienion_df = pd.concat(
+        [sheets[well_id].assign(well_id=well_id) for well_id in plate_info_df['well_id']],
+        ignore_index=True,
+    )
     # parse spot ids
     spot_id_df = scienion_df['ID'].str.extract(r'spot-(\d)-(\d)')
     spot_id_df = spot_id_df.astype(int) - 1  # index starting from 0
@@ -235,6 +245,34 @@ def offset_od(df, norm_antigen=None, group='plate'):
     return df
 
 
+def read_scn_plate(scn_dir, plate_id):
+    """
+    read scienion outputs of one plate
+    :param str scn_dir: directory of scienion output xlsx file, assuming the file name
+    ends with '_analysis.xlsx'
+    :param str plate_id: plate ID
+    :return dataframe scn_df: scienion OD dataframe of the plate
+    """
+    metadata_path = os.path.join(scn_dir, 'multisero_output_data_metadata.xlsx')
+    with pd.ExcelFile(metadata_path) as meta_file:
+        antigen_df = read_antigen_info(meta_file)
+        plate_info_df = read_plate_info(meta_file)
+    plate_info_df['plate ID'] = plate_id
+    scn_fname = [f for f in os.listdir(scn_dir) if '_analysis.xlsx' in f]
+    scn_path = os.path.join(scn_dir, scn_fname[0])
+    scn_df = read_scn_output(scn_path, plate_info_df)
+    # Join Scienion data with plateInfo
+    scn_df = pd.merge(scn_df,
+                      antigen_df,
+                      how='left', on=['antigen_row', 'antigen_col'])
+    scn_df = pd.merge(scn_df,
+                      plate_info_df,
+                      how='right', on=['well_id'])
+    scn_df['pipeline'] = 'scienion'
+    scn_df.dropna(subset=['OD'], inplace=True)
+    return scn_df
+
+
 def read_scn_output_batch(scn_dirs_df):
     """
     batch read scienion outputs
@@ -243,73 +281,94 @@ def read_scn_output_batch(scn_dirs_df):
     ends with '_analysis.xlsx'
     :return dataframe scn_df: combined scienion OD dataframe from multiple outputs
     """
-    scn_df = pd.DataFrame()
-    for scn_dir, plate_id, in zip(scn_dirs_df['directory'], scn_dirs_df['plate ID']):
-        metadata_path = os.path.join(scn_dir, 'multisero_output_data_metadata.xlsx')
-        with pd.ExcelFile(metadata_path) as meta_file:
-            antigen_df = read_antigen_info(meta_file)
-            plate_info_df = read_plate_info(meta_file)
-        plate_info_df['plate ID'] = plate_id
-        scn_fname = [f for f in os.listdir(scn_dir) if '_analysis.xlsx' in f]
-        scn_path = os.path.join(scn_dir, scn_fname[0])
-        scn_df_tmp = read_scn_output(scn_path, plate_info_df)
-        # Join Scienion data with plateInfo
-        scn_df_tmp = pd.merge(scn_df_tmp,
-                          antigen_df,
-                          how='left', on=['antigen_row', 'antigen_col'])
-        scn_df_tmp = pd.merge(scn_df_tmp,
-                          plate_info_df,
-                          how='right', on=['well_id'])
-        scn_df = scn_df.append(scn_df_tmp, ignore_index=True)
-    scn_df['pipeline'] = 'scienion'
-    scn_df.dropna(subset=['OD'], inplace=True)
+    scn_dfs = [read_scn_plate(scn_dir, plate_id) for scn_dir, plate_id
+               in zip(scn_dirs_df['directory'], scn_dirs_df['plate ID'])]
+    scn_df = pd.concat(scn_dfs, ignore_index=True)
     return scn_df
 
 
-def read_multisero_output_batch(ntl_dirs_df):
+def read_multisero_plate(data_folder, slice_action, well_id, plate_id):
+    """
+    read multisero outputs of one plate
+    :param str data_folder: directory of multisero output xlsx files
+    :param str slice_action: 'keep' or 'drop' wells given by well_id
+    :param well_id: well IDs to keep or drop
+    :param str plate_id: plate ID
+    :return dataframe multisero_df: multisero OD dataframe of the plate
+    """
+    print('Load {}...'.format(data_folder))
+    metadata_path = os.path.join(data_folder, 'multisero_output_data_metadata.xlsx')
+    OD_path = os.path.join(data_folder, 'median_ODs.xlsx')
+    int_path = os.path.join(data_folder, 'median_intensities.xlsx')
+    bg_path = os.path.join(data_folder, 'median_backgrounds.xlsx')
+
+    with pd.ExcelFile(metadata_path) as meta_file:
+        antigen_df = read_antigen_info(meta_file)
+        plate_info_df = read_plate_info(meta_file)
+    plate_info_df['plate ID'] = plate_id
+    OD_df = read_multisero_output(OD_path, antigen_df, file_type='od')
+    int_df = read_multisero_output(int_path, antigen_df, file_type='int')
+    bg_df = read_multisero_output(bg_path, antigen_df, file_type='bg')
+    OD_df = pd.merge(OD_df,
+                     antigen_df[['antigen_row', 'antigen_col', 'antigen type']],
+                     how='left', on=['antigen_row', 'antigen_col'])
+    OD_df = pd.merge(OD_df,
+                     plate_info_df,
+                     how='right', on=['well_id'])
+    multisero_df = pd.merge(OD_df,
+                            int_df,
+                            how='left', on=['antigen_row', 'antigen_col', 'well_id'])
+    multisero_df = pd.merge(multisero_df,
+                            bg_df,
+                            how='left', on=['antigen_row', 'antigen_col', 'well_id'])
+    multisero_df['pipeline'] = 'nautilus'
+    multisero_df.replace([np.inf, -np.inf], np.nan, inplace=True)
+    multisero_df.dropna(subset=['OD'], inplace=True)
+    multisero_df = slice_df(multisero_df, slice_action, 'well_id', well_id)
+    return multisero_df
+
+
+def read_multisero_output_batch(ntl_dirs_df, nbr_workers=None):
     """
-    batch read multisero outputs
+    batch read multisero outputs, plates are loaded in parallel
     :param dataframe ntl_dirs_df: dataframe loaded from the analysis config
     containing directories of multisero output xlsx file
+    :param int/None nbr_workers: number of worker processes, defaults to number of CPUs
     :return dataframe scn_df: combined multisero OD dataframe from multiple outputs
     """
-    multisero_df = pd.DataFrame()
-    for data_folder, slice_action, well_id, plate_id in \
-            zip(ntl_dirs_df['directory'], ntl_dirs_df['well action'],
-                ntl_dirs_df['well ID'], ntl_dirs_df['plate ID']):
-        print('Load {}...'.format(data_folder))
-        metadata_path = os.path.join(data_folder, 'multisero_output_data_metadata.xlsx')
-        OD_path = os.path.join(data_folder, 'median_ODs.xlsx')
-        int_path = os.path.join(data_folder, 'median_intensities.xlsx')
-        bg_path = os.path.join(data_folder, 'median_backgrounds.xlsx')
-
-        with pd.ExcelFile(metadata_path) as meta_file:
-            antigen_df = read_antigen_info(meta_file)
-            plate_info_df = read_plate_info(meta_file)
-        plate_info_df['plate ID'] = plate_id
-        OD_df = read_multisero_output(OD_path, antigen_df, file_type='od')
-        int_df = read_multisero_output(int_path, antigen_df, file_type='int')
-        bg_df = read_multisero_output(bg_path, antigen_df, file_type='bg')
-        OD_df = pd.merge(OD_df,
-                         antigen_df[['antigen_row', 'antigen_col', 'antigen type']],
-                         how='left', on=['antigen_row', 'antigen_col'])
-        OD_df = pd.merge(OD_df,
-                         plate_info_df,
-                         how='right', on=['well_id'])
-        multisero_df_tmp = pd.merge(OD_df,
-                                 int_df,
-                                 how='left', on=['antigen_row', 'antigen_col', 'well_id'])
-        multisero_df_tmp = pd.merge(multisero_df_tmp,
-                                 bg_df,
-                                 how='left', on=['antigen_row', 'antigen_col', 'well_id'])
-        multisero_df_tmp['pipeline'] = 'nautilus'
-        multisero_df_tmp.replace([np.inf, -np.inf], np.nan, inplace=True)
-        multisero_df_tmp.dropna(subset=['OD'], inplace=True)
-        multisero_df_tmp = slice_df(multisero_df_tmp, slice_action, 'well_id', well_id)
-        multisero_df = multisero_df.append(multisero_df_tmp, ignore_index=True)
+    plate_args = list(zip(ntl_dirs_df['directory'], ntl_dirs_df['well action'],
+                          ntl_dirs_df['well ID'], ntl_dirs_df['plate ID']))
+    plate_dfs = read_multisero_plates(plate_args, nbr_workers=nbr_workers)
+    multisero_df = pd.concat(plate_dfs, ignore_index=True)
     return multisero_df
 
 
+def read_multisero_plates(plate_args, nbr_workers=None):
+    """
+    read multisero outputs of several plates in parallel
+    :param list plate_args: arguments of read_multisero_plate for each plate
+    :param int/None nbr_workers: number of worker processes, defaults to number of CPUs
+    :return list plate_dfs: multisero OD dataframe of each plate, in the given order
+    """
+    if len(plate_args) <= 1 or nbr_workers == 1:
+        return [read_multisero_plate(*args) for args in plate_args]
+    with concurrent.futures.ProcessPoolExecutor(nbr_workers) as executor:
+        # map keeps the plate order
+        return list(executor.map(read_multisero_plate, *zip(*plate_args)))
+
+
+def clean_master_report(stitched_multisero_df):
+    """
+    remove empty xkappa-biotin spots, round off dilution
+    :param dataframe stitched_multisero_df: combined multisero and scienion OD dataframe
+    :return dataframe stitched_multisero_df: cleaned dataframe
+    """
+    stitched_multisero_df = stitched_multisero_df[(stitched_multisero_df['antigen'] != 'xkappa-biotin') |
+                            (stitched_multisero_df['antigen type'] == 'Fiducial')]
+    stitched_multisero_df['serum dilution'] = stitched_multisero_df['serum dilution'].round(7)
+    return stitched_multisero_df
+
+
 def read_output_batch(output_dir, ntl_dirs_df, scn_dirs_df, load_report):
     """
     batch read multisero and scienion outputs
@@ -335,10 +394,7 @@ def read_output_batch(output_dir, ntl_dirs_df, scn_dirs_df, load_report):
         #% Concatenate dataframes
         stitched_multisero_df = pd.concat(df_list)
         stitched_multisero_df.reset_index(drop=True, inplace=True)
-        # remove empty xkappa-biotin spots, round off dilution
-        stitched_multisero_df = stitched_multisero_df[(stitched_multisero_df['antigen'] != 'xkappa-biotin') |
-                                (stitched_multisero_df['antigen type'] == 'Fiducial')]
-        stitched_multisero_df['serum dilution'] = stitched_multisero_df['serum dilution'].round(7)
+        stitched_multisero_df = clean_master_report(stitched_multisero_df)
         stitched_multisero_df.to_csv(os.path.join(output_dir, 'master_report.csv'))
     else:
         stitched_multisero_df = pd.read_csv(os.path.join(output_dir, 'master_report.csv'), index_col=0, low_memory=False)
@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+import interpretation.report_reader as report_reader
+
+# Manifest listing the plates in the store
+MANIFEST_NAME = 'manifest.json'
+# Increment if stored plates are no longer compatible
+STORE_VERSION = 2
+# Output files that are read for a multisero plate
+MULTISERO_FILES = [
+    'multisero_output_data_metadata.xlsx',
+    'median_ODs.xlsx',
+    'median_intensities.xlsx',
+    'median_backgrounds.xlsx',
+]
+# Columns that can be used as load filters, stored as strings
+FILTER_COLUMNS = ['antigen', 'serum ID', 'pipeline']
+# Stored dtype of columns with values of more than one type
+MIXED_DTYPE = 'mixed'
+
+
+def _import_pyarrow():
+    """
+    Import pyarrow when the store is used, so it's only required
+    for analyses that use the store.
+
+    :return module pa: pyarrow
+    :return module pq: pyarrow.parquet
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(
+            "The master report store requires pyarrow, "
+            "install it with 'pip install pyarrow'"
+        )
+    return pa, pq
+
+
+def _source_signature(data_folder, file_names):
+    """
+    Summarize size and modification time of the output files of a plate,
+    so plates are reread when their outputs change.
+
+    :param str data_folder: Plate output directory
+    :param list file_names: Output file names in directory
+    :return list signature: (file name, size, modification time) per file
+    """
+    signature = []
+    for file_name in file_names:
+        file_stat = os.stat(os.path.join(data_folder, file_name))
+        signature.append([file_name, file_stat.st_size, file_stat.st_mtime_ns])
+    return signature
+
+
+def _is_mixed(col_values):
+    """
+    :param pd.Series col_values: Column of a plate dataframe
+    :return bool: True if the column's values that aren't null have more
+        than one type, e.g. serum IDs that are both numbers and strings
+    """
+    return col_values.dtype == object and \
+        len(set(type(value) for value in col_values.dropna())) > 1
+
+
+def _from_str(value):
+    """
+    Convert a value of a mixed column back from string. Only numbers are
+    converted back, other values are kept as strings.
+
+    :param value: Stored value, string or None
+    :return value: Value as int or float if it's a number
+    """
+    if not isinstance(value, str):
+        return value
+    for number_type in [int, float]:
+        try:
+            return number_type(value)
+        except ValueError:
+            pass
+    return value
+
+
+class MasterReportStore:
+    """
+    On-disk columnar store of the master report, with one Parquet file per
+    plate output directory listed in the analysis config and a manifest
+    describing them. Plates are only read from Excel when they're new or
+    their outputs changed, and loading pushes filters on antigen, serum ID
+    and pipeline down to the Parquet reader.
+    """
+    def __init__(self, store_dir):
+        """
+        :param str store_dir: Directory where the store is kept
+        """
+        self.pa, self.pq = _import_pyarrow()
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.store_dir, MANIFEST_NAME)
+        self.plates = self._read_manifest()
+
+    def _read_manifest(self):
+        """
+        :return dict plates: Plate entries by source key, empty if there's
+            no manifest or it's from another store version
+        """
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') != STORE_VERSION:
+            return {}
+        return manifest['plates']
+
+    def _write_manifest(self):
+        manifest = {'version': STORE_VERSION, 'plates': self.plates}
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def source_key(pipeline, directory, plate_id, slice_action=None, well_id=None):
+        """
+        Key identifying a plate as listed in the analysis config.
+
+        :param str pipeline: 'nautilus' or 'scienion'
+        :param str directory: Plate output directory
+        :param str plate_id: Plate ID
+        :param str/None slice_action: 'keep' or 'drop' wells given by well_id
+        :param list/None well_id: Well IDs to keep or drop
+        :return str key: Source key
+        """
+        if not isinstance(slice_action, str):
+            slice_action = None
+        if not isinstance(well_id, (list, tuple)):
+            well_id = None
+        source = [pipeline, os.path.abspath(directory), str(plate_id),
+                  slice_action, well_id]
+        return hashlib.sha1(json.dumps(source).encode()).hexdigest()[:16]
+
+    def _is_current(self, key, signature):
+        entry = self.plates.get(key)
+        return entry is not None and \
+            entry['signature'] == signature and \
+            os.path.isfile(os.path.join(self.store_dir, entry['file']))
+
+    def _write_plate(self, key, plate_df, entry):
+        """
+        Write a plate dataframe to its Parquet file and add it to the manifest.
+
+        :param str key: Source key
+        :param pd.DataFrame plate_df: Master report rows of the plate
+        :param dict entry: Manifest entry describing the plate
+        """
+        plate_df = plate_df.reset_index(drop=True)
+        # Original dtypes of columns stored as strings, restored on load
+        entry['str_columns'] = {}
+        for col in plate_df.columns:
+            # Mixed types can't be stored, and filter columns need one type
+            if _is_mixed(plate_df[col]):
+                entry['str_columns'][col] = MIXED_DTYPE
+            elif col in FILTER_COLUMNS and plate_df[col].dtype != object:
+                entry['str_columns'][col] = str(plate_df[col].dtype)
+            else:
+                continue
+            not_null = plate_df[col].notna()
+            plate_df[col] = plate_df[col].astype(object)
+            plate_df.loc[not_null, col] = plate_df.loc[not_null, col].astype(str)
+        table = self.pa.Table.from_pandas(plate_df, preserve_index=False)
+        entry['file'] = key + '.parquet'
+        entry['nbr_rows'] = plate_df.shape[0]
+        file_path = os.path.join(self.store_dir, entry['file'])
+        self.pq.write_table(table, file_path + '.tmp')
+        os.replace(file_path + '.tmp', file_path)
+        self.plates[key] = entry
+
+    def update(self, ntl_dirs_df, scn_dirs_df, nbr_workers=None):
+        """
+        Add plates listed in the analysis config that are new or whose
+        outputs changed since they were stored.
+
+        :param pd.DataFrame ntl_dirs_df: 'multisero output dirs' config tab
+        :param pd.DataFrame scn_dirs_df: 'scienion output dirs' config tab
+        :param int/None nbr_workers: Number of processes reading plates
+        :return list keys: Source keys of all plates listed in the config
+        """
+        keys = []
+        new_plates = []
+        if not ntl_dirs_df.empty:
+            for plate_args in zip(ntl_dirs_df['directory'],
+                                  ntl_dirs_df['well action'],
+                                  ntl_dirs_df['well ID'],
+                                  ntl_dirs_df['plate ID']):
+                data_folder, slice_action, well_id, plate_id = plate_args
+                key = self.source_key(
+                    'nautilus', data_folder, plate_id, slice_action, well_id,
+                )
+                keys.append(key)
+                signature = _source_signature(data_folder, MULTISERO_FILES)
+                if not self._is_current(key, signature):
+                    new_plates.append((key, plate_args, signature))
+        if len(new_plates) > 0:
+            print('Adding {} plates to master report store...'.format(len(new_plates)))
+            plate_dfs = report_reader.read_multisero_plates(
+                [plate_args for _, plate_args, _ in new_plates],
+                nbr_workers=nbr_workers,
+            )
+            for (key, plate_args, signature), plate_df in zip(new_plates, plate_dfs):
+                self._write_plate(key, plate_df, {
+                    'pipeline': 'nautilus',
+                    'directory': os.path.abspath(plate_args[0]),
+                    'plate ID': str(plate_args[3]),
+                    'signature': signature,
+                })
+        if not scn_dirs_df.empty:
+            for scn_dir, plate_id in zip(scn_dirs_df['directory'], scn_dirs_df['plate ID']):
+                key = self.source_key('scienion', scn_dir, plate_id)
+                keys.append(key)
+                scn_files = ['multisero_output_data_metadata.xlsx'] + \
+                    [f for f in os.listdir(scn_dir) if '_analysis.xlsx' in f]
+                signature = _source_signature(scn_dir, scn_files)
+                if not self._is_current(key, signature):
+                    plate_df = report_reader.read_scn_plate(scn_dir, plate_id)
+                    self._write_plate(key, plate_df, {
+                        'pipeline': 'scienion',
+                        'directory': os.path.abspath(scn_dir),
+                        'plate ID': str(plate_id),
+                        'signature': signature,
+                    })
+        self._write_manifest()
+        return keys
+
+    def load(self, keys=None, antigens=None, sera=None, pipelines=None):
+        """
+        Load stored plates, reading only rows that match the filters.
+
+        :param list/None keys: Source keys of plates to load, all if None
+        :param list/None antigens: Antigens to load, all if None
+        :param list/None sera: Serum IDs to load, all if None
+        :param list/None pipelines: Pipelines to load, all if None
+        :return pd.DataFrame master_df: Master report rows
+        """
+        if keys is None:
+            keys = list(self.plates)
+        filters = []
+        for col, values in zip(FILTER_COLUMNS, [antigens, sera, pipelines]):
+            if values is not None:
+                filters.append((col, 'in', [str(v) for v in values]))
+        plate_dfs = []
+        for key in keys:
+            assert key in self.plates, \
+                "Plate {} isn't in the master report store".format(key)
+            entry = self.plates[key]
+            if pipelines is not None and entry['pipeline'] not in pipelines:
+                continue
+            table = self.pq.read_table(
+                os.path.join(self.store_dir, entry['file']),
+                filters=filters if len(filters) > 0 else None,
+            )
+            plate_df = table.to_pandas()
+            for col, dtype in entry['str_columns'].items():
+                if dtype == MIXED_DTYPE:
+                    plate_df[col] = plate_df[col].map(_from_str)
+                else:
+                    plate_df[col] = plate_df[col].astype(dtype)
+            plate_dfs.append(plate_df)
+        if len(plate_dfs) == 0:
+            return pd.DataFrame()
+        master_df = pd.concat(plate_dfs, ignore_index=True)
+        return report_reader.clean_master_report(master_df)
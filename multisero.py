@@ -3,13 +3,13 @@ import logging
 import os
 
 import array_analyzer.extract.constants as constants
-import array_analyzer.utils.io_utils as io_utils
-import array_analyzer.workflows.registration_workflow as registration_wf
-import array_analyzer.workflows.interpolation_wf as interpolation_wf
-import array_analyzer.workflows.well_wf as well_wf
-import interpretation.od_analyzer as od_analyzer
-import matplotlib
-matplotlib.use('Agg')
+
+# Workflows and their dependencies (OpenCV, scikit-image, pandas,
+# matplotlib...) are imported when a stage is run, so the CLI only
+# imports what the chosen stage needs.
+# Plots are only saved, set the backend before matplotlib is imported
+os.environ['MPLBACKEND'] = 'Agg'
+
 
 def parse_args():
     """
@@ -37,7 +37,7 @@ def parse_args():
         '-i', '--input',
         type=str,
         required=True,
-        help="Input directory path",
+        help="Input directory path, or manifest path in batch mode",
     )
     parser.add_argument(
         '-o', '--output',
@@ -56,6 +56,20 @@ def parse_args():
              "'Array' experiments are for ELISA assays using antigen arrays printed with Scienion Array Printer "
              "Default: array_fit",
     )
+    parser.add_argument(
+        '--background',
+        type=str,
+        choices=constants.BACKGROUND_METHODS,
+        default=constants.BACKGROUND,
+        help="Background estimation for array workflows. 'polynomial' fits "
+             "a polynomial surface to block medians by least squares. "
+             "'robust' excludes spots from block medians and fits the "
+             "surface with Huber weights, so the well edge and spot clusters "
+             "don't skew it, which allows tighter crops around the array. "
+             "'annulus' uses the median of a ring around each spot instead "
+             "of a surface. "
+             "Default: {}".format(constants.BACKGROUND),
+    )
     parser.add_argument(
         '-d', '--debug',
         dest='debug',
@@ -63,11 +77,111 @@ def parse_args():
         help="Write debug plots of well and spots. Default: False",
     )
     parser.set_defaults(debug=False)
+    parser.add_argument(
+        '--debug_nth',
+        type=int,
+        default=None,
+        help="With --debug, write debug plots for every Nth well. Default: None",
+    )
+    parser.add_argument(
+        '--debug_fraction',
+        type=float,
+        default=None,
+        help="With --debug, write debug plots for a random fraction "
+             "of wells (0-1). Default: None",
+    )
+    parser.add_argument(
+        '--debug_failed',
+        dest='debug_failed',
+        action='store_true',
+        help="With --debug, write debug plots for wells where registration "
+             "failed. Default: False",
+    )
+    parser.add_argument(
+        '--debug_outliers',
+        dest='debug_outliers',
+        action='store_true',
+        help="With --debug, write debug plots for wells where registration "
+             "distance or OD statistics are outliers. Not available with "
+             "--batch or --serve. Default: False",
+    )
+    parser.set_defaults(debug_failed=False, debug_outliers=False)
+    parser.add_argument(
+        '--debug_montage',
+        dest='debug_montage',
+        action='store_true',
+        help="With --debug, write a few plate montages of well thumbnails "
+             "and spot heatmaps instead of debug plots for each well. "
+             "Default: False",
+    )
+    parser.set_defaults(debug_montage=False)
     parser.add_argument(
         '-r', '--rerun',
         dest='rerun',
         action='store_true',
-        help="Rerun wells listed in 'rerun_wells sheets of metadata file. Default: False",
+        help="Rerun wells listed in 'rerun_wells' sheet of metadata file. "
+             "If there is no such sheet, only wells whose image or parameters "
+             "changed since the last run are recomputed. Default: False",
+    )
+    parser.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        help="Resume an interrupted run in the run directory given as output. "
+             "Wells that are already done are skipped and reports are "
+             "finalized. Default: False",
+    )
+    parser.set_defaults(resume=False)
+    parser.add_argument(
+        '-b', '--batch',
+        dest='batch',
+        action='store_true',
+        help="Extract ODs for all plates listed in a manifest (csv or xlsx) "
+             "given as input, with a 'directory' column and an optional "
+             "'metadata' column. Only for array_fit workflow. Default: False",
+    )
+    parser.set_defaults(batch=False)
+    parser.add_argument(
+        '--watch',
+        dest='watch',
+        action='store_true',
+        help="Extract ODs while the plate is imaged: wells are extracted as "
+             "soon as their images are written to the input directory and "
+             "reports are updated after each batch of new wells. "
+             "Only for array_fit workflow. Default: False",
+    )
+    parser.set_defaults(watch=False)
+    parser.add_argument(
+        '--watch_timeout',
+        type=float,
+        default=constants.WATCH_TIMEOUT,
+        help="With --watch, stop watching when no new image has been written "
+             "for this many seconds. Default: {}".format(constants.WATCH_TIMEOUT),
+    )
+    parser.add_argument(
+        '--serve',
+        dest='serve',
+        action='store_true',
+        help="Run a local extraction service with warm worker processes, "
+             "which extracts ODs for plates or wells posted to "
+             "http://127.0.0.1:PORT/plate or /well. Plate directories are "
+             "relative to the input directory, and layouts of plates in it "
+             "are preloaded. Only for array_fit workflow. Default: False",
+    )
+    parser.set_defaults(serve=False)
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=constants.SERVICE_PORT,
+        help="Port of the extraction service on localhost. "
+             "Default: {}".format(constants.SERVICE_PORT),
+    )
+    parser.add_argument(
+        '--nbr_workers',
+        type=int,
+        default=None,
+        help="Number of worker processes in batch mode, and for computing "
+             "and rendering OD analysis plots. Default: number of CPUs",
     )
 
     parser.add_argument(
@@ -87,10 +201,29 @@ def parse_args():
              "rather than the original OD reports in the config file"
              " which is slower. Default: False",
     )
+    parser.add_argument(
+        '--report_store',
+        dest='report_store',
+        action='store_true',
+        help="Keep the master report in a columnar store (Parquet) in the "
+             "output directory. Only new or changed plates are read, and only "
+             "antigens and sera needed for the plots are loaded. "
+             "Requires pyarrow. Default: False",
+    )
+    parser.set_defaults(report_store=False)
+    parser.add_argument(
+        '--quick_look',
+        dest='quick_look',
+        action='store_true',
+        help="Save OD analysis plots at low resolution, and draw categorical "
+             "plots of many sera as strip plots instead of swarm plots. "
+             "Default: False",
+    )
+    parser.set_defaults(quick_look=False)
     return parser.parse_args()
 
 
-def extract_od(input_dir, output_dir, workflow):
+def extract_od(input_dir, output_dir, workflow, watch=False, watch_timeout=None):
     """
     For each image in input directory, run either interpolation
     or registration of fiducials (default) workflow.
@@ -102,25 +235,43 @@ def extract_od(input_dir, output_dir, workflow):
         <plate>_<method> format:
             <plate> describes the printing style of the antigen (array or ELISA)
             <method> describes the spot segmentation and extraction approach
+    :param bool watch: Extract wells as their images are written (array_fit only)
+    :param float/None watch_timeout: Time in seconds without new images
+        before watching stops, defaults to constants.WATCH_TIMEOUT
     """
-
-    if workflow == 'array_interp':
+    if watch:
+        if workflow != 'array_fit':
+            raise ValueError("watch mode is only available for the "
+                             "array_fit workflow")
+        import array_analyzer.workflows.watch_wf as watch_wf
+        if watch_timeout is None:
+            watch_timeout = constants.WATCH_TIMEOUT
+        watch_wf.watch_registration(
+            input_dir,
+            output_dir,
+            timeout=watch_timeout,
+        )
+    elif workflow == 'array_interp':
+        import array_analyzer.workflows.interpolation_wf as interpolation_wf
         interpolation_wf.interp(
             input_dir,
             output_dir,
         )
     elif workflow == 'array_fit':
+        import array_analyzer.workflows.registration_workflow as registration_wf
         registration_wf.point_registration(
             input_dir,
             output_dir,
         )
     elif workflow == 'well_segmentation':
+        import array_analyzer.workflows.well_wf as well_wf
         well_wf.well_analysis(
             input_dir,
             output_dir,
             method='segmentation',
         )
     elif workflow == 'well_crop':
+        import array_analyzer.workflows.well_wf as well_wf
         well_wf.well_analysis(
             input_dir,
             output_dir,
@@ -128,6 +279,110 @@ def extract_od(input_dir, output_dir, workflow):
         )
 
 
+def run_batch(args):
+    """
+    Extract ODs for all plates listed in a manifest in one process,
+    with a log file in the output directory and a run directory per plate.
+
+    :param args: Argparse arguments
+    """
+    import array_analyzer.utils.io_utils as io_utils
+    import array_analyzer.workflows.batch_wf as batch_wf
+
+    manifest_path = args.input
+    output_dir = args.output
+    if not os.path.isfile(manifest_path):
+        raise ValueError("batch manifest is not a file or doesn't exist")
+    if not args.extract_od or args.workflow != 'array_fit':
+        raise ValueError("batch mode is only available for extracting ODs "
+                         "with the array_fit workflow")
+    if args.rerun or args.resume:
+        raise ValueError("batch mode can't be combined with rerun or resume")
+    if args.debug_outliers:
+        raise ValueError("batch mode can't be combined with debug_outliers, "
+                         "wells are processed out of order")
+    os.makedirs(output_dir, exist_ok=True)
+
+    constants.METADATA_FILE = args.metadata
+    constants.DEBUG = args.debug
+    constants.DEBUG_SAMPLING = {
+        'every_nth': args.debug_nth,
+        'fraction': args.debug_fraction,
+        'failed': args.debug_failed,
+        'outliers': args.debug_outliers,
+    }
+    constants.DEBUG_MONTAGE = args.debug_montage
+    constants.BACKGROUND = args.background
+    log_level = 20
+    if constants.DEBUG:
+        log_level = 10
+    logger = io_utils.make_logger(
+        log_dir=output_dir,
+        logger_name=constants.LOG_NAME,
+        log_level=log_level,
+    )
+    logger.info("batch manifest: {}".format(manifest_path))
+    logger.info("output dir: {}".format(output_dir))
+    batch_wf.batch_analysis(
+        manifest_path=manifest_path,
+        output_dir=output_dir,
+        nbr_workers=args.nbr_workers,
+    )
+
+
+def run_service(args):
+    """
+    Run the extraction service until it's interrupted, with a log file in
+    the output directory.
+
+    :param args: Argparse arguments
+    """
+    import array_analyzer.utils.io_utils as io_utils
+    import array_analyzer.workflows.service_wf as service_wf
+
+    input_dir = args.input
+    output_dir = args.output
+    if not os.path.isdir(input_dir):
+        raise ValueError("input directory is not a directory or doesn't exist")
+    if not args.extract_od or args.workflow != 'array_fit':
+        raise ValueError("the extraction service is only available for "
+                         "extracting ODs with the array_fit workflow")
+    if args.rerun or args.resume or args.batch:
+        raise ValueError("the extraction service can't be combined with "
+                         "rerun, resume or batch")
+    if args.debug_outliers:
+        raise ValueError("the extraction service can't be combined with "
+                         "debug_outliers, wells are processed out of order")
+    os.makedirs(output_dir, exist_ok=True)
+
+    constants.METADATA_FILE = args.metadata
+    constants.DEBUG = args.debug
+    constants.DEBUG_SAMPLING = {
+        'every_nth': args.debug_nth,
+        'fraction': args.debug_fraction,
+        'failed': args.debug_failed,
+        'outliers': args.debug_outliers,
+    }
+    constants.DEBUG_MONTAGE = args.debug_montage
+    constants.BACKGROUND = args.background
+    log_level = 20
+    if constants.DEBUG:
+        log_level = 10
+    logger = io_utils.make_logger(
+        log_dir=output_dir,
+        logger_name=constants.LOG_NAME,
+        log_level=log_level,
+    )
+    logger.info("input dir: {}".format(input_dir))
+    logger.info("output dir: {}".format(output_dir))
+    service_wf.serve(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        port=args.port,
+        nbr_workers=args.nbr_workers,
+    )
+
+
 def run_multisero(args):
     """
     Main function, handling logic for all subroutines
@@ -137,20 +392,42 @@ def run_multisero(args):
     input_dir = args.input
     output_dir = args.output
 
+    if args.serve:
+        run_service(args)
+        return
+    if args.watch and (args.rerun or args.resume or args.batch):
+        raise ValueError("watch mode can't be combined with rerun, resume "
+                         "or batch")
+    if args.batch:
+        run_batch(args)
+        return
+
     if not os.path.isdir(input_dir):
         raise ValueError("input directory is not a directory or doesn't exist")
 
     os.makedirs(output_dir, exist_ok=True)
 
+    import array_analyzer.utils.io_utils as io_utils
+
     constants.METADATA_FILE = args.metadata
     constants.DEBUG = args.debug
+    # If no sampling policy is given, debug plots are written for all wells
+    constants.DEBUG_SAMPLING = {
+        'every_nth': args.debug_nth,
+        'fraction': args.debug_fraction,
+        'failed': args.debug_failed,
+        'outliers': args.debug_outliers,
+    }
+    constants.DEBUG_MONTAGE = args.debug_montage
+    constants.BACKGROUND = args.background
     constants.RERUN = args.rerun
+    constants.RESUME = args.resume
     constants.LOAD_REPORT = args.load_report
 
     constants.RUN_PATH = io_utils.make_run_dir(
         input_dir=input_dir,
         output_dir=output_dir,
-        rerun=constants.RERUN,
+        rerun=constants.RERUN or constants.RESUME,
     )
     # Default log level is info, otherwise debug
     log_level = 20
@@ -171,12 +448,18 @@ def run_multisero(args):
             input_dir=input_dir,
             output_dir=output_dir,
             workflow=args.workflow,
+            watch=args.watch,
+            watch_timeout=args.watch_timeout,
         )
     elif args.analyze_od:
+        import interpretation.od_analyzer as od_analyzer
         od_analyzer.analyze_od(
             input_dir=input_dir,
             output_dir=output_dir,
             load_report=args.load_report,
+            report_store=args.report_store,
+            quick_look=args.quick_look,
+            nbr_workers=args.nbr_workers,
         )
 
 
@@ -5,6 +5,29 @@ import pandas as pd
 import cv2 as cv
 import numpy as np
 
+import array_analyzer.extract.constants as constants
+import array_analyzer.utils.plate_geometry as plate_geometry
+
+
+@pytest.fixture(autouse=True)
+def layout_cache_dir(tmp_path, monkeypatch):
+    """
+    Keep compiled array layouts in a temporary directory instead of the
+    user's cache directory.
+    """
+    cache_dir = str(tmp_path / 'layout_cache')
+    monkeypatch.setattr(constants, 'LAYOUT_CACHE_DIR', cache_dir)
+    return cache_dir
+
+
+@pytest.fixture(autouse=True)
+def reference_kernels(monkeypatch):
+    """
+    Use the NumPy reference kernels, compiled kernels are compared to them
+    in kernels_test.
+    """
+    monkeypatch.setenv(constants.KERNELS_ENV, 'numpy')
+
 
 @pytest.fixture(scope="session")
 def create_good_xml(tmp_path_factory):
@@ -174,3 +197,51 @@ def micromanager_dir(tmpdir_factory):
         sub_dir.mkdir()
         cv.imwrite(os.path.join(sub_dir, 'micromanager_name.tif'), im)
     return input_dir
+
+
+def make_plate_df(value):
+    """
+    96 well plate dataframe with values increasing in row major order.
+    """
+    plate = plate_geometry.PlateGeometry()
+    plate_array = value * np.arange(96, dtype=np.float64).reshape(8, 12)
+    return plate.to_df(plate_array)
+
+
+def write_sheets(xlsx_path, sheets):
+    """
+    Write dataframes to sheets of an xlsx file.
+    """
+    with pd.ExcelWriter(xlsx_path) as writer:
+        for sheet_name, sheet_df in sheets.items():
+            sheet_df.to_excel(writer, sheet_name=sheet_name)
+
+
+@pytest.fixture
+def multisero_plate_dir(tmpdir_factory):
+    """
+    Multisero output directory with metadata and reports for two antigens.
+    """
+    plate_dir = tmpdir_factory.mktemp("plate_dir")
+    antigen_array = pd.DataFrame([['ag_a', 'ag_b']], index=[0], columns=[0, 1])
+    antigen_type = pd.DataFrame([['Diagnostic', 'Diagnostic']], index=[0], columns=[0, 1])
+    # One serum per plate row
+    serum_id = make_plate_df(0).astype(object)
+    for row_name in serum_id.index:
+        serum_id.loc[row_name, :] = 'serum_' + row_name
+    write_sheets(
+        os.path.join(plate_dir, 'multisero_output_data_metadata.xlsx'),
+        {'antigen_array': antigen_array,
+         'antigen_type': antigen_type,
+         'serum ID': serum_id,
+         'serum dilution': make_plate_df(0) + .01},
+    )
+    for file_name, value in [('median_ODs.xlsx', 1.),
+                             ('median_intensities.xlsx', 2.),
+                             ('median_backgrounds.xlsx', 3.)]:
+        write_sheets(
+            os.path.join(plate_dir, file_name),
+            {'0_0_ag_a': make_plate_df(value),
+             '0_1_ag_b': make_plate_df(-value)},
+        )
+    return str(plate_dir)
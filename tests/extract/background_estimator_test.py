@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import array_analyzer.extract.background_estimator as background_estimator
+
+
+@pytest.fixture
+def poly_im():
+    rows, cols = np.meshgrid(np.arange(300), np.arange(420), indexing='ij')
+    im = 1. + 1e-3 * rows - 2e-3 * cols + 1e-5 * rows * cols - 3e-6 * rows ** 2
+    return im
+
+
+def test_sample_block_medians():
+    bg_estimator = background_estimator.BackgroundEstimator2D(block_size=2)
+    im = np.arange(5 * 7).reshape(5, 7)
+    coords, values = bg_estimator.sample_block_medians(im)
+    # Block (x, y) has index y * nbr_blocks_x + x
+    assert coords.shape == (6, 2)
+    np.testing.assert_array_equal(coords[1], [2.5, .5])
+    np.testing.assert_array_equal(coords[2], [.5, 2.5])
+    np.testing.assert_array_equal(values[:3], [4., 18., 6.])
+
+
+def test_fit_polynomial_surface_2d(poly_im):
+    bg_estimator = background_estimator.BackgroundEstimator2D(
+        block_size=60,
+        order=2,
+        normalize=False,
+    )
+    rows, cols = np.meshgrid(np.arange(0, 300, 30), np.arange(0, 420, 30), indexing='ij')
+    coords = np.stack([rows.ravel(), cols.ravel()], axis=1).astype(np.float64)
+    values = poly_im[rows.ravel(), cols.ravel()]
+    surface = bg_estimator.fit_polynomial_surface_2d(coords, values, poly_im.shape)
+    # Second order polynomial is reconstructed
+    np.testing.assert_allclose(surface, poly_im)
+    # Pseudo-inverse is computed once for the same sample coordinates
+    bg_estimator.fit_polynomial_surface_2d(coords, 2 * values, (10, 20))
+    assert len(bg_estimator._pinv_cache) == 1
+    bg_estimator.order = 1
+    bg_estimator.fit_polynomial_surface_2d(coords, values, (10, 20))
+    assert len(bg_estimator._pinv_cache) == 2
+
+
+def test_get_background(poly_im):
+    bg_estimator = background_estimator.BackgroundEstimator2D(
+        block_size=50,
+        order=2,
+        normalize=True,
+    )
+    background = bg_estimator.get_background(poly_im)
+    assert background.shape == poly_im.shape
+    assert background.mean() == pytest.approx(1.)
+    # Smooth image is approximated by its background
+    np.testing.assert_allclose(
+        background * poly_im.mean(),
+        poly_im,
+        rtol=1e-2,
+    )
+
+
+def test_too_few_blocks():
+    bg_estimator = background_estimator.BackgroundEstimator2D(block_size=40)
+    with pytest.raises(AssertionError):
+        bg_estimator.get_background(np.ones((90, 90)))
+
+
+def test_sample_block_medians_exclude():
+    bg_estimator = background_estimator.BackgroundEstimator2D(block_size=4)
+    im = np.ones((8, 12))
+    exclude = np.zeros(im.shape, dtype=bool)
+    # Excluded pixels don't contribute to medians
+    im[:3, :4] = 10.
+    exclude[:3, :4] = True
+    im[3, :4] = 2.
+    # Block with less than a quarter of pixels left is dropped
+    exclude[4:, 4:8] = True
+    exclude[4, 4:7] = False
+    coords, values = bg_estimator.sample_block_medians(im, exclude=exclude)
+    assert coords.shape == (5, 2)
+    assert [5.5, 5.5] not in coords.tolist()
+    assert values[0] == 2.
+    np.testing.assert_array_equal(values[1:], 1.)
+
+
+def test_robust_background(poly_im):
+    corrupted_im = poly_im.copy()
+    # Bright well edge and dark spots
+    corrupted_im[:, -40:] = 3.
+    spot_mask = np.zeros(poly_im.shape, dtype=bool)
+    spot_mask[100:200, 100:300] = True
+    corrupted_im[spot_mask] = .1
+    bg_estimator = background_estimator.BackgroundEstimator2D(
+        block_size=40,
+        normalize=False,
+    )
+    lstsq_error = np.abs(bg_estimator.get_background(corrupted_im) - poly_im).mean()
+    bg_estimator.robust = True
+    robust_background = bg_estimator.get_background(
+        corrupted_im,
+        exclude=spot_mask,
+    )
+    robust_error = np.abs(robust_background - poly_im).mean()
+    assert robust_error < .05
+    assert robust_error < lstsq_error / 10
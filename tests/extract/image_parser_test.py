@@ -0,0 +1,189 @@
+import numpy as np
+import pytest
+from types import SimpleNamespace
+
+import array_analyzer.extract.image_parser as image_parser
+
+
+def make_lattice(n_rows, n_cols, spacing, angle, origin):
+    """
+    Create lattice node coordinates (row, col) in row major order.
+    """
+    grid_rows, grid_cols = np.meshgrid(
+        np.arange(n_rows),
+        np.arange(n_cols),
+        indexing='ij',
+    )
+    nodes = spacing * np.stack([grid_rows.ravel(), grid_cols.ravel()], axis=1)
+    angle = np.deg2rad(angle)
+    rot = np.array([[np.cos(angle), np.sin(angle)],
+                    [-np.sin(angle), np.cos(angle)]])
+    return nodes @ rot + origin
+
+
+@pytest.mark.parametrize('angle', [0., 4., -7.])
+def test_fit_lattice(angle):
+    expected = make_lattice(6, 8, 82., angle, [150., 200.])
+    coords = image_parser.fit_lattice(expected, 6, 8, grid_spacing=82)
+    assert coords.shape == (48, 2)
+    np.testing.assert_allclose(coords, expected, atol=1e-6)
+
+
+def test_fit_lattice_missing_and_spurious():
+    expected = make_lattice(6, 6, 80., 5., [300., 250.])
+    random_state = np.random.RandomState(0)
+    centroids = expected + random_state.normal(0, 1., expected.shape)
+    # Remove some spots, including the first row
+    keep = np.ones(36, dtype=bool)
+    keep[[0, 1, 2, 3, 4, 5, 14, 22]] = False
+    centroids = centroids[keep]
+    # Add spurious spots outside and inside the grid
+    centroids = np.vstack([
+        centroids,
+        [[100., 100.], [260., 700.], [340., 290.]],
+    ])
+    coords = image_parser.fit_lattice(centroids, 6, 6, grid_spacing=80)
+    assert np.max(np.linalg.norm(coords - expected, axis=1)) < 2.
+
+
+def test_fit_lattice_estimate_spacing():
+    expected = make_lattice(4, 5, 60., 2., [100., 120.])
+    coords = image_parser.fit_lattice(expected, 4, 5)
+    np.testing.assert_allclose(coords, expected, atol=1e-6)
+
+
+def test_grid_from_centroids():
+    expected = make_lattice(6, 6, 82., -3., [200., 210.])
+    props = [SimpleNamespace(weighted_centroid=tuple(c)) for c in expected]
+    coords = image_parser.grid_from_centroids(props, 6, 6)
+    np.testing.assert_allclose(coords, expected, atol=1e-6)
+
+
+def make_well_image(center, radius, shape=(1000, 1200)):
+    """
+    Create a noisy image of a bright well with darker spots on a background.
+    """
+    random_state = np.random.RandomState(0)
+    rows, cols = np.mgrid[:shape[0], :shape[1]]
+    im = np.full(shape, 8000.)
+    well = (rows - center[0]) ** 2 + (cols - center[1]) ** 2 < radius ** 2
+    im[well] = 40000.
+    for spot_row, spot_col in make_lattice(4, 4, 80., 0., center - 120.):
+        spot = (rows - spot_row) ** 2 + (cols - spot_col) ** 2 < 15 ** 2
+        im[spot] = 20000.
+    im += random_state.normal(0, 1000., shape)
+    return np.clip(im, 0, 65535).astype(np.uint16), well
+
+
+def test_fit_circle():
+    angles = np.linspace(0, 2 * np.pi, 50, endpoint=False)
+    points = np.stack([50 + 20 * np.sin(angles), 70 + 20 * np.cos(angles)], axis=1)
+    center, radius = image_parser.fit_circle(points)
+    np.testing.assert_allclose(center, [50., 70.])
+    assert radius == pytest.approx(20.)
+
+
+@pytest.mark.parametrize('downsample', [4, 8])
+def test_find_well_border_fast(downsample):
+    im, well = make_well_image(np.array([480.3, 610.7]), 350.)
+    center, radius, well_mask = image_parser.find_well_border_fast(
+        im,
+        segmethod='otsu',
+        downsample=downsample,
+    )
+    np.testing.assert_allclose(center, [480.3, 610.7], atol=1.)
+    assert radius == int(350. / np.sqrt(2))
+    assert well_mask.shape == im.shape
+    assert well_mask.dtype == bool
+    assert np.sum(well_mask != well) < .01 * np.sum(well)
+
+
+def test_find_well_border_fast_matches_region():
+    im, _ = make_well_image(np.array([500., 600.]), 380.)
+    center_region, radius_region, _ = image_parser.find_well_border(
+        im,
+        segmethod='otsu',
+        detmethod='region',
+    )
+    center_fast, radius_fast, _ = image_parser.find_well_border(
+        im,
+        segmethod='otsu',
+        detmethod='fast',
+    )
+    np.testing.assert_allclose(center_fast, center_region, atol=2.)
+    assert abs(radius_fast - radius_region) <= 5
+
+
+def test_find_well_border_fast_no_well():
+    im = np.random.RandomState(0).normal(1000., 10., (400, 400))
+    with pytest.raises(IndexError):
+        image_parser.find_well_border_fast(im.astype(np.uint16), segmethod='otsu')
+
+
+@pytest.mark.parametrize('width', [1200, 1201])
+def test_get_well_intensity_fused(width):
+    im, _ = make_well_image(np.array([500., 600.]), 400., shape=(1000, width))
+    # Vary well intensities so the median depends on the pixels in the mask
+    im = im + np.random.RandomState(1).randint(0, 500, im.shape).astype(np.uint16)
+    well_mask = image_parser.get_well_mask(im, segmethod='otsu')
+    expected = image_parser.get_well_intensity(im, well_mask)
+    well_int, fused_mask = image_parser.get_well_intensity_fused(
+        im,
+        segmethod='otsu',
+    )
+    np.testing.assert_array_equal(fused_mask, well_mask)
+    assert well_int == expected
+
+
+def test_get_well_intensity_fused_float():
+    im, _ = make_well_image(np.array([500., 600.]), 400.)
+    im = im.astype(np.float32) / 65535
+    well_mask = image_parser.get_well_mask(im, segmethod='otsu')
+    well_int, _ = image_parser.get_well_intensity_fused(im, segmethod='otsu')
+    assert well_int == pytest.approx(
+        image_parser.get_well_intensity(im, well_mask),
+    )
+
+
+def test_get_well_intensity_fused_no_well():
+    im = np.random.RandomState(0).normal(1000., 10., (400, 400))
+    with pytest.raises(IndexError):
+        image_parser.get_well_intensity_fused(im.astype(np.uint16))
+
+
+def test_generate_annulus_labels():
+    spot_labels = np.zeros((100, 120), dtype=np.uint16)
+    spot_labels[20:30, 20:28] = 1
+    spot_labels[60:75, 80:92] = 2
+    # Spot touching the image border
+    spot_labels[:5, 100:110] = 3
+    annulus_labels = image_parser.generate_annulus_labels(
+        spot_labels,
+        distance=3,
+        annulus=5,
+    )
+    for label in range(1, 4):
+        expected = image_parser.generate_spot_background(spot_labels == label)
+        np.testing.assert_array_equal(annulus_labels == label, expected)
+
+
+def test_generate_annulus_labels_overlap():
+    spot_labels = np.zeros((50, 50), dtype=np.uint16)
+    spot_labels[20:25, 10:15] = 1
+    spot_labels[20:25, 22:27] = 2
+    annulus_labels = image_parser.generate_annulus_labels(
+        spot_labels,
+        distance=2,
+        annulus=6,
+    )
+    # Annuli don't cover any spot or the gap within distance of them
+    expected = image_parser.generate_spot_background(
+        spot_labels > 0,
+        distance=2,
+        annulus=6,
+    )
+    np.testing.assert_array_equal(annulus_labels > 0, expected)
+    assert annulus_labels[22, 16] == 0
+    # The larger label is kept where annuli overlap
+    assert annulus_labels[22, 18] == 2
+    assert annulus_labels[22, 6] == 1
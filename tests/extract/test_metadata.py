@@ -1,7 +1,12 @@
+import numpy as np
+import os
+import pickle
 import pytest
 
 from array_analyzer.extract.metadata import MetaData
 import array_analyzer.extract.constants as constants
+import array_analyzer.extract.layout_cache as layout_cache
+import array_analyzer.extract.txt_parser as txt_parser
 
 """
 Tests to add:
@@ -41,7 +46,24 @@ def test_one_xml(create_good_xml):
     input_dir, output_dir = create_good_xml
     constants.METADATA_FILE = 'temp.xml'
     constants.RUN_PATH = output_dir
-    MetaData(input_dir, output_dir)
+    run_context = MetaData(input_dir, output_dir).run_context
+    assert run_context.params['rows'] == 6
+    assert run_context.params['pixel_size'] == \
+        constants.params['pixel_size_scienion']
+    assert run_context.fiducials_idx == [0, 6]
+    assert run_context.antigen_array.shape == (6, 6)
+    # The context is shared, so arrays and parameters can't be modified
+    with pytest.raises(ValueError):
+        run_context.antigen_array[0, 0] = 'antigen'
+    with pytest.raises(TypeError):
+        run_context.params['rows'] = 8
+    with pytest.raises(TypeError):
+        run_context.params.update({'rows': 8})
+    # Parameters can still be sent to worker processes
+    params = pickle.loads(pickle.dumps(run_context.params))
+    assert params == run_context.params
+    with pytest.raises(TypeError):
+        params['rows'] = 8
 
 
 def test_wrong_xml_name(create_good_xml):
@@ -56,25 +78,104 @@ def test_xlsx(create_good_xlsx):
     input_dir, output_dir = create_good_xlsx
     constants.METADATA_FILE = 'multisero_output_data_metadata.xlsx'
     constants.RUN_PATH = output_dir
-    MetaData(input_dir, output_dir)
-    assert constants.params['rows'] == 6
-    assert constants.params['columns'] == 6
-    assert constants.params['v_pitch'] == 0.4
-    assert constants.params['h_pitch'] == 0.45
-    assert constants.params['spot_width'] == 0.2
-    assert constants.params['pixel_size'] == 0.0049
+    params = MetaData(input_dir, output_dir).run_context.params
+    assert params['rows'] == 6
+    assert params['columns'] == 6
+    assert params['v_pitch'] == 0.4
+    assert params['h_pitch'] == 0.45
+    assert params['spot_width'] == 0.2
+    assert params['pixel_size'] == 0.0049
+    # Parsed values don't change the defaults
+    assert constants.params['rows'] is None
 
 
 def test_xlsx_rerun(create_good_xlsx):
     input_dir, output_dir = create_good_xlsx
-    constants.METADATA_FILE = 'multisero_output_data_metadata.xlsx'
-    constants.RUN_PATH = output_dir
-    constants.RERUN = True
-    MetaData(input_dir, output_dir)
-    assert constants.RERUN_WELLS == ['A3', 'B7']
-    assert constants.params['rows'] == 6
-    assert constants.params['columns'] == 6
-    assert constants.params['v_pitch'] == 0.4
-    assert constants.params['h_pitch'] == 0.45
-    assert constants.params['spot_width'] == 0.2
-    assert constants.params['pixel_size'] == 0.0049
+    run_context = MetaData(
+        input_dir,
+        output_dir,
+        metadata_file='multisero_output_data_metadata.xlsx',
+        run_path=output_dir,
+        rerun=True,
+    ).run_context
+    assert run_context.rerun_wells == ('A3', 'B7')
+    assert run_context.rerun
+    params = run_context.params
+    assert params['rows'] == 6
+    assert params['columns'] == 6
+    assert params['v_pitch'] == 0.4
+    assert params['h_pitch'] == 0.45
+    assert params['spot_width'] == 0.2
+    assert params['pixel_size'] == 0.0049
+
+
+def test_xml_layout(create_good_xml):
+    input_dir, output_dir = create_good_xml
+    fiduc, spots, repl, params = txt_parser.create_xml_dict(
+        os.path.join(input_dir, 'temp.xml'),
+    )
+    assert [(f['@row'], f['@col']) for f in fiduc] == [('0', '0'), ('1', '0')]
+    assert [s['@id'] for s in spots] == ['spot-1-2', 'spot-2-3', 'spot-4-5']
+    # Single replicate spots are listed too
+    assert repl[1] == {'@row': '0', '@col': '1', '@id': 'H3 HA', 'id': ['spot-4-5']}
+    assert params['rows'] == 6
+    assert params['h_pitch'] == 0.4
+
+
+def test_xml_layout_cache(create_good_xml, layout_cache_dir):
+    input_dir, output_dir = create_good_xml
+    metadata = MetaData(
+        input_dir,
+        output_dir,
+        metadata_file='temp.xml',
+        run_path=output_dir,
+    )
+    assert metadata.fiduc is not None
+    run_context = metadata.run_context
+    assert run_context.antigen_array[0, 1] == 'H1 HA'
+    assert run_context.antigen_array[3, 4] == 'H3 HA'
+    assert len(os.listdir(layout_cache_dir)) == 1
+    # Metadata with a cached layout isn't parsed
+    cached_metadata = MetaData(
+        input_dir,
+        output_dir,
+        metadata_file='temp.xml',
+        run_path=output_dir,
+    )
+    assert cached_metadata.fiduc is None
+    cached_context = cached_metadata.run_context
+    assert cached_context.params == run_context.params
+    assert cached_context.fiducials == run_context.fiducials
+    assert cached_context.fiducials_idx == run_context.fiducials_idx
+    assert cached_context.spot_dist_pix == run_context.spot_dist_pix
+    for array_name in ['fiducial_array', 'antigen_array',
+                       'spot_id_array', 'spot_type_array']:
+        np.testing.assert_array_equal(
+            getattr(cached_context, array_name),
+            getattr(run_context, array_name),
+        )
+        assert not getattr(cached_context, array_name).flags.writeable
+
+
+def test_layout_cache_corrupt(layout_cache_dir):
+    cache = layout_cache.LayoutCache(layout_cache_dir)
+    antigen_array = np.array([['a', ''], ['', 'b']], dtype='U100')
+    layout = {
+        'params': {'rows': 2, 'columns': 2},
+        'rerun_wells': ['A3', 'B7'],
+        'fiducials_array': antigen_array,
+        'antigen_array': antigen_array,
+        'spot_id_array': None,
+        'spot_type_array': None,
+    }
+    cache.save('abc', layout)
+    cached_layout = cache.load('abc')
+    assert cached_layout['params'] == layout['params']
+    assert cached_layout['rerun_wells'] == layout['rerun_wells']
+    assert cached_layout['antigen_array'].dtype == antigen_array.dtype
+    np.testing.assert_array_equal(cached_layout['antigen_array'], antigen_array)
+    assert cached_layout['spot_id_array'] is None
+    assert cache.load('def') is None
+    with open(os.path.join(layout_cache_dir, 'abc.npz'), 'wb') as f:
+        f.write(b'not a layout')
+    assert cache.load('abc') is None
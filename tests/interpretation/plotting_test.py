@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn import metrics
+
+import interpretation.plotting as plotting
+
+
+@pytest.fixture
+def dilution_df():
+    """
+    Serum dilution series following 4PL curves for two sera and antigens.
+    """
+    rows = []
+    serum_dilutions = 10 ** np.linspace(-5, -1, 8)
+    for serum_idx, serum_id in enumerate(['serum_a', 'serum_b']):
+        for antigen_idx, antigen in enumerate(['ag_1', 'ag_2']):
+            params = [.05, 1. + serum_idx, 1e-3 * (1 + antigen_idx), 1.5]
+            for serum_dilution in serum_dilutions:
+                rows.append({
+                    'serum ID': serum_id,
+                    'antigen': antigen,
+                    'secondary ID': 'IgG',
+                    'secondary dilution': 1e-4,
+                    'plate ID': 'plate_1',
+                    'PRNT': 10.,
+                    'serum type': 'positive',
+                    'serum cat': 'cat',
+                    'pipeline': 'nautilus',
+                    'serum dilution': serum_dilution,
+                    'OD': plotting.fourPL(serum_dilution, *params),
+                })
+    # Zero dilution is excluded from fits
+    rows.append(dict(rows[0], **{'serum dilution': 0.}))
+    return pd.DataFrame(rows)
+
+
+@pytest.mark.parametrize('nbr_workers', [1, 2])
+def test_fit_params_df(dilution_df, nbr_workers):
+    params_df = plotting.fit_params_df(dilution_df, nbr_workers=nbr_workers)
+    assert params_df.shape[0] == 4
+    assert list(params_df['serum ID']) == ['serum_a', 'serum_a', 'serum_b', 'serum_b']
+    assert list(params_df['antigen']) == ['ag_1', 'ag_2', 'ag_1', 'ag_2']
+    np.testing.assert_allclose(params_df['B'], [1., 1., 2., 2.], rtol=1e-3)
+    np.testing.assert_allclose(params_df['C'], [1e-3, 2e-3, 1e-3, 2e-3], rtol=1e-3)
+    np.testing.assert_allclose(params_df['dilution min'], 1e-5)
+    np.testing.assert_allclose(params_df['dilution max'], 1e-1)
+
+
+def test_fit_params_df_missing_prnt(dilution_df):
+    dilution_df.loc[dilution_df['serum ID'] == 'serum_b', 'PRNT'] = np.nan
+    params_df = plotting.fit_params_df(dilution_df, nbr_workers=1)
+    assert list(params_df['serum ID'].unique()) == ['serum_a']
+
+
+def test_fit2df(dilution_df):
+    df_fit = plotting.fit2df(dilution_df, plotting.fourPL, nbr_workers=1)
+    assert df_fit.shape[0] == 4 * 50
+    series_df = df_fit[(df_fit['serum ID'] == 'serum_b') & (df_fit['antigen'] == 'ag_2')]
+    assert series_df['serum dilution'].min() == pytest.approx(1e-5)
+    assert series_df['serum dilution'].max() == pytest.approx(1e-1)
+    np.testing.assert_allclose(
+        series_df['OD'],
+        plotting.fourPL(series_df['serum dilution'].to_numpy(), .05, 2., 2e-3, 1.5),
+        atol=1e-4,
+    )
+    assert series_df['c'].unique() == pytest.approx(2e-3, rel=1e-3)
+    for col in ['serum type', 'pipeline', 'PRNT', 'plate ID', 'b', 'd']:
+        assert col in df_fit.columns
+
+
+@pytest.fixture
+def roc_input_df():
+    random_state = np.random.RandomState(0)
+    rows = []
+    for antigen in ['ag_1', 'ag_2']:
+        for idx in range(60):
+            is_pos = idx % 3 == 0
+            rows.append({
+                'antigen': antigen,
+                'secondary ID': 'IgG',
+                'secondary dilution': 1e-4,
+                'pipeline': 'nautilus',
+                'serum type': 'positive' if is_pos else 'negative',
+                # Rounding gives tied scores
+                'OD': np.round(random_state.rand() + .5 * is_pos, 1),
+            })
+    return pd.DataFrame(rows)
+
+
+def test_bootstrap_roc(roc_input_df):
+    y_true = (roc_input_df['serum type'] == 'positive').to_numpy()
+    y_score = roc_input_df['OD'].to_numpy()
+    tprs, aucs = plotting.bootstrap_roc(y_true, y_score, nbr_samples=20, random_state=1)
+    assert tprs.shape == (20, len(plotting.ROC_FPR_GRID))
+    resample_idx = plotting.stratified_resample_idx(
+        y_true, 20, np.random.RandomState(1))
+    for sample_idx in range(20):
+        sample_true = y_true[resample_idx[sample_idx]]
+        sample_score = y_score[resample_idx[sample_idx]]
+        assert sample_true.sum() == y_true.sum()
+        assert aucs[sample_idx] == pytest.approx(
+            metrics.roc_auc_score(sample_true, sample_score))
+        fpr, tpr, _ = metrics.roc_curve(
+            sample_true, sample_score, drop_intermediate=False)
+        expected_tpr = [tpr[fpr <= fpr_max + 1e-12].max()
+                        for fpr_max in plotting.ROC_FPR_GRID]
+        np.testing.assert_allclose(tprs[sample_idx], expected_tpr)
+
+
+def test_bootstrap_roc_one_class():
+    tprs, aucs = plotting.bootstrap_roc(
+        np.ones(5, dtype=bool), np.arange(5), nbr_samples=3)
+    assert np.all(np.isnan(tprs))
+    assert np.all(np.isnan(aucs))
+
+
+@pytest.mark.parametrize('nbr_workers', [1, 2])
+def test_get_roc_df_ci(roc_input_df, nbr_workers):
+    roc_df = plotting.get_roc_df(roc_input_df, ci=95, nbr_workers=nbr_workers)
+    assert list(roc_df['antigen'].unique()) == ['ag_1', 'ag_2']
+    assert roc_df.shape[0] == 2 * (len(plotting.ROC_FPR_GRID) + 1)
+    assert np.all(roc_df['ci_low'] <= roc_df['ci_high'])
+    assert np.all(np.diff(roc_df['True positive rate'].to_numpy()[1:102]) >= 0)
+    assert np.all(roc_df['auc_ci_low'] < roc_df['auc_ci_high'])
+
+
+def test_get_roc_df(roc_input_df):
+    roc_df = plotting.get_roc_df(roc_input_df)
+    ag_df = roc_df[roc_df['antigen'] == 'ag_1']
+    ag_input_df = roc_input_df[roc_input_df['antigen'] == 'ag_1']
+    assert ag_df['AUC'].unique() == pytest.approx(metrics.roc_auc_score(
+        ag_input_df['serum type'] == 'positive', ag_input_df['OD']))
+    assert list(roc_df.columns[:4]) == plotting.ROC_GROUP_COLS
@@ -0,0 +1,59 @@
+import numpy as np
+import os
+import pandas as pd
+import pytest
+from PIL import Image
+
+import interpretation.plotting as plotting
+import interpretation.render_scheduler as render_scheduler
+
+
+@pytest.fixture
+def cat_df():
+    random_state = np.random.RandomState(0)
+    return pd.DataFrame({
+        'serum type': ['positive', 'negative'] * 20,
+        'OD': random_state.rand(40),
+        'antigen': ['ag_1'] * 20 + ['ag_2'] * 20,
+        'pipeline': 'nautilus',
+    })
+
+
+def test_cat_kind():
+    scheduler = render_scheduler.RenderScheduler()
+    assert scheduler.dpi == render_scheduler.DPI
+    assert scheduler.cat_kind(10 * render_scheduler.SWARM_MAX_POINTS) == 'swarm'
+    scheduler = render_scheduler.RenderScheduler(quick_look=True)
+    assert scheduler.dpi == render_scheduler.QUICK_LOOK_DPI
+    assert scheduler.cat_kind(10) == 'swarm'
+    assert scheduler.cat_kind(render_scheduler.SWARM_MAX_POINTS + 1) == 'strip'
+
+
+@pytest.mark.parametrize('nbr_workers', [1, 2])
+def test_run(cat_df, tmpdir_factory, nbr_workers):
+    output_dir = str(tmpdir_factory.mktemp('plots'))
+    scheduler = render_scheduler.RenderScheduler(nbr_workers=nbr_workers)
+    scheduler.add(plotting.cat_plot, cat_df, output_dir, 'a', hue='pipeline',
+                  split_subplots_by='antigen', zoom=True)
+    scheduler.add(plotting.cat_plot, cat_df, output_dir, 'b', hue='pipeline',
+                  split_subplots_by='antigen', kind='strip', dpi=50)
+    assert scheduler.run() == 2
+    assert scheduler.jobs == []
+    assert sorted(os.listdir(output_dir)) == \
+        ['catplot_a.png', 'catplot_b.png', 'catplot_zoom_a.png']
+    im_a = Image.open(os.path.join(output_dir, 'catplot_a.png'))
+    im_b = Image.open(os.path.join(output_dir, 'catplot_b.png'))
+    # Resolution scales image size
+    assert im_a.size[0] > 5 * im_b.size[0]
+
+
+def test_run_quick_look(cat_df, tmpdir_factory):
+    output_dir = str(tmpdir_factory.mktemp('plots'))
+    for quick_look in [False, True]:
+        scheduler = render_scheduler.RenderScheduler(nbr_workers=1, quick_look=quick_look)
+        scheduler.add(plotting.cat_plot, cat_df, output_dir, str(quick_look),
+                      split_subplots_by='antigen')
+        scheduler.run()
+    im_full = Image.open(os.path.join(output_dir, 'catplot_False.png'))
+    im_quick = Image.open(os.path.join(output_dir, 'catplot_True.png'))
+    assert im_full.size[0] > 2 * im_quick.size[0]
@@ -0,0 +1,51 @@
+import os
+import pandas as pd
+import pytest
+
+import interpretation.report_reader as report_reader
+
+
+def test_read_multisero_output(multisero_plate_dir):
+    antigen_df = pd.DataFrame({
+        'antigen_row': [0, 0],
+        'antigen_col': [0, 1],
+        'antigen': ['ag_a', 'ag_b'],
+    })
+    data_df = report_reader.read_multisero_output(
+        os.path.join(multisero_plate_dir, 'median_ODs.xlsx'),
+        antigen_df,
+        file_type='od',
+    )
+    assert list(data_df) == ['well_id', 'OD', 'antigen_row', 'antigen_col', 'antigen']
+    assert data_df.shape == (192, 5)
+    # Wells are linearized column by column
+    assert list(data_df['well_id'][:3]) == ['A1', 'B1', 'C1']
+    well_df = data_df[data_df['well_id'] == 'B3']
+    assert list(well_df['antigen']) == ['ag_a', 'ag_b']
+    assert list(well_df['OD']) == [14., -14.]
+    assert list(well_df['antigen_col']) == [0, 1]
+
+
+@pytest.mark.parametrize('nbr_workers', [1, 2])
+def test_read_multisero_output_batch(multisero_plate_dir, nbr_workers):
+    ntl_dirs_df = pd.DataFrame({
+        'directory': [multisero_plate_dir, multisero_plate_dir],
+        'well action': ['keep', None],
+        'well ID': [['A1', 'B2'], None],
+        'plate ID': ['plate_1', 'plate_2'],
+    })
+    multisero_df = report_reader.read_multisero_output_batch(
+        ntl_dirs_df,
+        nbr_workers=nbr_workers,
+    )
+    assert list(multisero_df['plate ID'].unique()) == ['plate_1', 'plate_2']
+    plate_1_df = multisero_df[multisero_df['plate ID'] == 'plate_1']
+    assert sorted(plate_1_df['well_id'].unique()) == ['A1', 'B2']
+    plate_2_df = multisero_df[multisero_df['plate ID'] == 'plate_2']
+    assert plate_2_df.shape[0] == 192
+    well_df = plate_2_df[(plate_2_df['well_id'] == 'B2') &
+                         (plate_2_df['antigen'] == 'ag_b')]
+    assert well_df['OD'].values[0] == -13.
+    assert well_df['intensity'].values[0] == -26.
+    assert well_df['background'].values[0] == -39.
+    assert well_df['antigen type'].values[0] == 'Diagnostic'
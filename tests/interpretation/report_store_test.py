@@ -0,0 +1,97 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import interpretation.report_store as report_store
+
+
+def make_dirs_df(plate_dirs):
+    return pd.DataFrame({
+        'directory': plate_dirs,
+        'well action': [None] * len(plate_dirs),
+        'well ID': [None] * len(plate_dirs),
+        'plate ID': ['plate_{}'.format(i) for i in range(len(plate_dirs))],
+    })
+
+
+def test_update_and_load(multisero_plate_dir, tmpdir_factory):
+    store_dir = str(tmpdir_factory.mktemp("store_dir"))
+    store = report_store.MasterReportStore(store_dir)
+    keys = store.update(make_dirs_df([multisero_plate_dir]), pd.DataFrame())
+    assert len(keys) == 1
+    assert os.path.isfile(os.path.join(store_dir, report_store.MANIFEST_NAME))
+    master_df = store.load(keys)
+    assert master_df.shape[0] == 192
+    assert set(master_df['antigen']) == {'ag_a', 'ag_b'}
+    assert set(master_df['pipeline']) == {'nautilus'}
+    # Manifest is read by a new store instance
+    store = report_store.MasterReportStore(store_dir)
+    assert list(store.plates) == keys
+
+
+def test_load_filters(multisero_plate_dir, tmpdir_factory):
+    store = report_store.MasterReportStore(str(tmpdir_factory.mktemp("store_dir")))
+    keys = store.update(make_dirs_df([multisero_plate_dir]), pd.DataFrame())
+    master_df = store.load(keys, antigens=['ag_b'], sera=['serum_A', 'serum_C'])
+    assert set(master_df['antigen']) == {'ag_b'}
+    assert set(master_df['serum ID']) == {'serum_A', 'serum_C'}
+    assert master_df.shape[0] == 24
+    well_df = master_df[master_df['well_id'] == 'C2']
+    assert well_df['OD'].values[0] == -25.
+    assert store.load(keys, pipelines=['scienion']).empty
+
+
+def test_load_dtypes(tmpdir_factory):
+    store = report_store.MasterReportStore(str(tmpdir_factory.mktemp("store_dir")))
+    plate_df = pd.DataFrame({
+        'antigen': ['ag_a', 'ag_b', 'ag_a'],
+        'antigen type': ['Diagnostic'] * 3,
+        'serum ID': [1, 'serum_2', None],
+        'serum dilution': [.01, .02, .03],
+        'OD': [.1, .2, .3],
+        'plate ID': ['plate_0'] * 3,
+        'pipeline': ['nautilus'] * 3,
+    })
+    store._write_plate('key_0', plate_df.copy(), {'pipeline': 'nautilus'})
+    int_df = plate_df.assign(**{'serum ID': [4, 5, 6]})
+    store._write_plate('key_1', int_df.copy(), {'pipeline': 'nautilus'})
+    # Only mixed and non-string filter columns are stored as strings
+    assert store.plates['key_0']['str_columns'] == {'serum ID': 'mixed'}
+    assert store.plates['key_1']['str_columns'] == {'serum ID': 'int64'}
+    master_df = store.load(['key_0'])
+    assert list(master_df['serum ID'][:2]) == [1, 'serum_2']
+    assert master_df['serum ID'].isna()[2]
+    master_df = store.load(['key_1'], sera=[5, 6])
+    assert master_df['serum ID'].dtype == 'int64'
+    assert list(master_df['serum ID']) == [5, 6]
+
+
+def test_update_incremental(multisero_plate_dir, tmpdir_factory, monkeypatch):
+    store = report_store.MasterReportStore(str(tmpdir_factory.mktemp("store_dir")))
+    keys = store.update(make_dirs_df([multisero_plate_dir]), pd.DataFrame())
+    plate_file = os.path.join(store.store_dir, store.plates[keys[0]]['file'])
+    mtime = os.stat(plate_file).st_mtime_ns
+    # A new plate listed in the config is added without rereading the first
+    read_args = []
+
+    def read_plates(plate_args, nbr_workers=None):
+        read_args.extend(plate_args)
+        return [report_store.report_reader.read_multisero_plate(*args)
+                for args in plate_args]
+
+    monkeypatch.setattr(report_store.report_reader, 'read_multisero_plates', read_plates)
+    dirs_df = make_dirs_df([multisero_plate_dir, multisero_plate_dir])
+    keys = store.update(dirs_df, pd.DataFrame())
+    assert len(keys) == 2
+    assert [args[3] for args in read_args] == ['plate_1']
+    assert os.stat(plate_file).st_mtime_ns == mtime
+    master_df = store.load(keys)
+    assert set(master_df['plate ID']) == {'plate_0', 'plate_1'}
+    # Changed outputs are reread
+    read_args.clear()
+    od_path = os.path.join(multisero_plate_dir, 'median_ODs.xlsx')
+    os.utime(od_path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    store.update(dirs_df, pd.DataFrame())
+    assert [args[3] for args in read_args] == ['plate_0', 'plate_1']
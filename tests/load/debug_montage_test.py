@@ -0,0 +1,113 @@
+import cv2 as cv
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+import array_analyzer.load.debug_montage as debug_montage
+import array_analyzer.utils.plate_geometry as plate_geometry
+
+
+@pytest.fixture
+def well_data():
+    im_crop = np.full((60, 80), .5)
+    spots_df = pd.DataFrame({
+        'grid_row': [0, 1, 2],
+        'grid_col': [0, 1, 3],
+        'intensity_median': [.2, .3, .4],
+        'bg_median': [.5, .5, .6],
+        'od_norm': [.1, .2, .3],
+    })
+    return {
+        'status': 'done',
+        'im_well': np.full((400, 300), 1000, dtype=np.uint16),
+        'max_intensity': 4095,
+        'spot_coords': np.array([[100., 100.], [200., 150.]]),
+        'fiducial_coords': np.array([[110., 100.]]),
+        'registered_coords': np.array([[105., 100.], [205., 150.]]),
+        'im_crop': im_crop,
+        'background': np.full((60, 80), .4),
+        'spots_df': spots_df,
+        'spot_props': np.empty((3, 4), dtype=object),
+    }
+
+
+def test_get_color_lut():
+    lut = debug_montage.get_color_lut('viridis')
+    assert lut.shape == (256, 1, 3)
+    assert lut.dtype == np.uint8
+    # Viridis goes from dark purple to yellow, in BGR
+    np.testing.assert_array_equal(lut[0, 0], [84, 1, 68])
+    np.testing.assert_array_equal(lut[255, 0], [37, 231, 253])
+    assert debug_montage.get_color_lut('viridis') is lut
+
+
+def test_get_thumb_size():
+    assert debug_montage.get_thumb_size(plate_geometry.PlateGeometry()) == 128
+    plate = plate_geometry.PlateGeometry.from_format(1536)
+    assert debug_montage.get_thumb_size(plate) == 64
+
+
+def test_well_tiles(well_data):
+    tiles = debug_montage.well_tiles(well_data, thumb_size=32, grid_shape=(3, 4))
+    assert sorted(tiles) == sorted(
+        debug_montage.IMAGE_PANELS + list(debug_montage.GRID_PANELS))
+    # Longest side fits in thumbnail
+    assert tiles['registration'].shape == (32, 24, 3)
+    assert tiles['bg_overlay'].shape == (24, 32, 3)
+    assert tiles['composite_spots'].shape == (24, 32, 3)
+    np.testing.assert_array_equal(tiles['registration'][0, 0], [62, 62, 62])
+    # Registered spots are drawn in green
+    np.testing.assert_array_equal(tiles['registration'][8, 8], [0, 255, 0])
+    assert tiles['intensity'][2, 3] == .4
+
+
+def test_well_tiles_no_background(well_data):
+    # Annulus backgrounds have no background image
+    well_data['background'] = None
+    tiles = debug_montage.well_tiles(well_data, thumb_size=32, grid_shape=(3, 4))
+    assert 'bg_overlay' not in tiles
+    assert tiles['composite_spots'].shape == (24, 32, 3)
+
+
+def test_well_tiles_failed(well_data):
+    well_data['status'] = 'registration'
+    tiles = debug_montage.well_tiles(well_data, thumb_size=32, grid_shape=(3, 4))
+    assert list(tiles) == ['registration']
+    np.testing.assert_array_equal(
+        tiles['registration'][0, 0], debug_montage.FAILED_COLOR)
+
+
+def test_plate_montage(well_data, tmpdir_factory):
+    output_dir = str(tmpdir_factory.mktemp('montage'))
+    plate = plate_geometry.PlateGeometry.from_format(384)
+    montage = debug_montage.PlateMontage(plate, grid_shape=(3, 4))
+    montage.add_well('A1', well_data)
+    well_data['spots_df']['od_norm'] *= 2
+    montage.add_well('P24', well_data)
+    failed_data = dict(well_data, status='registration')
+    montage.add_well('B2', failed_data)
+    with pytest.raises(ValueError):
+        montage.add_well('Q1', well_data)
+    montage_paths = montage.write(output_dir)
+    assert len(montage_paths) == 6
+    assert sorted(os.listdir(output_dir)) == sorted(
+        ['plate_{}.png'.format(panel_name) for panel_name in
+         debug_montage.IMAGE_PANELS + list(debug_montage.GRID_PANELS)])
+    thumb_size = montage.thumb_size
+    im = cv.imread(os.path.join(output_dir, 'plate_registration.png'))
+    assert im.shape == (16 * thumb_size, 24 * thumb_size, 3)
+    # Failed well B2 is framed
+    np.testing.assert_array_equal(
+        im[thumb_size + thumb_size // 2, thumb_size], debug_montage.FAILED_COLOR)
+    # Empty wells are black
+    assert im[3 * thumb_size:4 * thumb_size, 5 * thumb_size:6 * thumb_size].max() == 0
+    im = cv.imread(os.path.join(output_dir, 'plate_od.png'))
+    header = debug_montage.HEADER_HEIGHT
+    assert im.shape == (header + 16 * thumb_size, 24 * thumb_size, 3)
+    # OD range is shared across the plate, highest OD in P24 is brightest
+    spot_size = thumb_size // 4
+    od_min = im[header + spot_size // 2 + spot_size * 2, spot_size // 2 + spot_size * 3]
+    od_max = im[header + 15 * thumb_size + spot_size * 2 + spot_size // 2,
+                23 * thumb_size + spot_size * 3 + spot_size // 2]
+    assert od_max.astype(int).sum() > od_min.astype(int).sum()
@@ -0,0 +1,132 @@
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+import array_analyzer.extract.txt_parser as txt_parser
+import array_analyzer.load.debug_plots as debug_plots
+import array_analyzer.utils.spot_regionprop as regionprop
+
+
+@pytest.fixture
+def spot_grid():
+    """
+    Image with a 2 x 3 grid of spots of different sizes, with spot props
+    for all spots but one.
+    """
+    random_state = np.random.RandomState(0)
+    image = random_state.rand(50, 70)
+    background = np.full(image.shape, .5)
+    spot_props = txt_parser.create_array(2, 3, dtype=object)
+    for row_idx in range(2):
+        for col_idx in range(3):
+            if (row_idx, col_idx) == (1, 1):
+                continue
+            row_min = 5 + 30 * row_idx
+            col_min = 2 + 25 * col_idx
+            spot_size = 11 + 2 * col_idx
+            bbox = [row_min, col_min, row_min + spot_size, col_min + spot_size]
+            spot_prop = regionprop.SpotRegionprop(row_idx, col_idx)
+            spot_prop.generate_props_from_disk(
+                image=image[bbox[0]:bbox[2], bbox[1]:bbox[3]],
+                background=background[bbox[0]:bbox[2], bbox[1]:bbox[3]],
+                bbox=bbox,
+                centroid=(row_min + spot_size // 2, col_min + spot_size // 2),
+            )
+            spot_props[row_idx, col_idx] = spot_prop
+    return image, spot_props
+
+
+def composite_spots_loop(spot_props, image, from_source=False):
+    """
+    Reference implementation pasting spots one by one.
+    """
+    bbox_image = np.mean(image) * np.ones(image.shape)
+    for spot_prop in spot_props.ravel():
+        if spot_prop is None:
+            continue
+        spot_dict = spot_prop.spot_dict
+        min_row, min_col = spot_dict['bbox_row_min'], spot_dict['bbox_col_min']
+        max_row, max_col = spot_dict['bbox_row_max'], spot_dict['bbox_col_max']
+        if from_source:
+            bbox_image[min_row:max_row, min_col:max_col] = \
+                image[min_row:max_row, min_col:max_col]
+        else:
+            bbox_mask = bbox_image[min_row:max_row, min_col:max_col]
+            bbox_mask[spot_prop.mask > 0] = spot_prop.image[spot_prop.mask > 0]
+    return bbox_image
+
+
+def test_stack_spot_rois(spot_grid):
+    _, spot_props = spot_grid
+    rois, masks, extents, origins = debug_plots.stack_spot_rois(spot_props)
+    assert rois.shape == (5, 15, 15)
+    assert masks.shape == rois.shape
+    assert origins.shape == (5, 2)
+    np.testing.assert_array_equal(origins[0], [5, 2])
+    # Padding isn't masked
+    assert not masks[0, 11:, :].any()
+    assert extents[0, :11, :11].all()
+    assert not extents[0, 11:, :].any()
+    assert extents[2].all()
+    np.testing.assert_array_equal(rois[0, :11, :11], spot_props[0, 0].image)
+
+
+@pytest.mark.parametrize('from_source', [False, True])
+def test_composite_spots(spot_grid, from_source):
+    image, spot_props = spot_grid
+    composite = debug_plots.composite_spots(spot_props, image, from_source)
+    expected = composite_spots_loop(spot_props, image, from_source)
+    np.testing.assert_array_equal(composite, expected)
+
+
+def test_composite_spots_empty():
+    image = np.ones((10, 10))
+    spot_props = txt_parser.create_array(2, 2, dtype=object)
+    composite = debug_plots.composite_spots(spot_props, image)
+    np.testing.assert_array_equal(composite, image)
+
+
+def test_spots_to_grid():
+    spots_df = pd.DataFrame({
+        'grid_row': [0, 1, 2],
+        'grid_col': [0, 1, 3],
+        'od_norm': [.1, .2, .3],
+    })
+    grid = debug_plots.spots_to_grid(spots_df, 'od_norm', (3, 4))
+    assert grid.shape == (3, 4)
+    assert grid[1, 1] == .2
+    assert grid[2, 3] == .3
+    assert np.sum(np.isnan(grid)) == 9
+
+
+def test_plot_centroid_overlay(tmpdir_factory):
+    output_dir = str(tmpdir_factory.mktemp('centroids'))
+    spots_df = pd.DataFrame({
+        'grid_row': [0, 0, 1, 1],
+        'grid_col': [0, 1, 0, 1],
+        'centroid_row': [5., 5., 15., 15.],
+        'centroid_col': [5., 15., 5., 15.],
+    })
+    output_name = os.path.join(output_dir, 'A1')
+    debug_plots.plot_centroid_overlay(
+        np.random.rand(20, 20),
+        {'rows': 2, 'columns': 2},
+        spots_df,
+        output_name,
+    )
+    assert os.listdir(output_dir) == ['A1_overlay_centroids.png']
+
+
+def test_plot_od(tmpdir_factory):
+    output_dir = str(tmpdir_factory.mktemp('od'))
+    spots_df = pd.DataFrame({
+        'grid_row': [0, 0, 1],
+        'grid_col': [0, 1, 1],
+        'intensity_median': [.2, .3, .4],
+        'bg_median': [.5, .5, .6],
+        'od_norm': [.1, .2, .3],
+    })
+    output_name = os.path.join(output_dir, 'A1')
+    debug_plots.plot_od(spots_df, 2, 2, output_name)
+    assert os.listdir(output_dir) == ['A1_od.png']
@@ -0,0 +1,67 @@
+import pytest
+
+import array_analyzer.load.debug_sampler as debug_sampler
+
+
+def test_no_debug():
+    sampler = debug_sampler.DebugSampler(debug=False, every_nth=1)
+    for well_idx in range(5):
+        assert not sampler.sample_well(well_idx, registration_ok=False)
+
+
+def test_sample_all():
+    sampler = debug_sampler.DebugSampler(debug=True)
+    assert sampler.sample_all
+    for well_idx in range(5):
+        assert sampler.sample_well(well_idx)
+
+
+def test_every_nth():
+    sampler = debug_sampler.DebugSampler(debug=True, every_nth=3)
+    samples = [sampler.sample_well(well_idx) for well_idx in range(7)]
+    assert samples == [True, False, False, True, False, False, True]
+
+
+def test_every_nth_invalid():
+    with pytest.raises(AssertionError):
+        debug_sampler.DebugSampler(debug=True, every_nth=0)
+
+
+def test_fraction():
+    sampler = debug_sampler.DebugSampler(
+        debug=True,
+        fraction=.25,
+        random_seed=42,
+    )
+    samples = [sampler.sample_well(well_idx) for well_idx in range(400)]
+    assert 60 < sum(samples) < 140
+
+
+def test_fraction_invalid():
+    with pytest.raises(AssertionError):
+        debug_sampler.DebugSampler(debug=True, fraction=1.5)
+
+
+def test_failed():
+    sampler = debug_sampler.DebugSampler(debug=True, failed=True)
+    assert not sampler.sample_well(0, registration_ok=True)
+    assert sampler.sample_well(1, registration_ok=False)
+
+
+def test_outliers():
+    sampler = debug_sampler.DebugSampler(
+        debug=True,
+        outliers=True,
+        min_history=5,
+    )
+    dists = [2., 2.2, 1.9, 2.1, 2.0, 1.8]
+    for well_idx, dist in enumerate(dists):
+        assert not sampler.sample_well(
+            well_idx,
+            well_stats={'registered_dist': dist},
+        )
+    assert sampler.sample_well(6, well_stats={'registered_dist': 20.})
+    assert len(sampler.history['registered_dist']) == 7
+    # Nan values are neither outliers nor added to history
+    assert not sampler.sample_well(7, well_stats={'registered_dist': float('nan')})
+    assert len(sampler.history['registered_dist']) == 7
@@ -4,18 +4,25 @@ import os
 import pandas as pd
 import pytest
 
-import array_analyzer.extract.constants as constants
+import array_analyzer.extract.run_context as run_context
 import array_analyzer.load.report as report
+import array_analyzer.utils.plate_geometry as plate_geometry
 
 
 @pytest.fixture
-def report_test(tmpdir_factory):
+def test_context(tmpdir_factory):
     input_dir = tmpdir_factory.mktemp("input_dir")
-    constants.RUN_PATH = input_dir
     antigen_array = np.empty(shape=(2, 3), dtype='U100')
     antigen_array[0, 0] = 'antigen_0_0'
     antigen_array[1, 2] = 'antigen_1_2'
-    constants.ANTIGEN_ARRAY = antigen_array
+    return run_context.RunContext(
+        run_path=str(input_dir),
+        antigen_array=antigen_array,
+    )
+
+
+@pytest.fixture
+def report_test():
     rows = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
     cols = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
     plate_df = pd.DataFrame(None, index=rows, columns=cols)
@@ -35,10 +42,12 @@ def test_report_init():
     antigen_array[0, 0] = 'antigen_0_0'
     antigen_array[1, 2] = 'antigen_1_2'
     antigen_array[0, 1] = 'suuuuuuuuper_loooooooong_antigen_name'
-    constants.ANTIGEN_ARRAY = antigen_array
-    constants.RUN_PATH = 'test_run_dir'
+    test_context = run_context.RunContext(
+        run_path='test_run_dir',
+        antigen_array=antigen_array,
+    )
     # Create instance
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     # Check paths
     assert reporter.od_path == 'test_run_dir/median_ODs.xlsx'
     assert reporter.int_path == 'test_run_dir/median_intensities.xlsx'
@@ -63,9 +72,12 @@ def test_antigen_df():
     antigen_array = np.empty(shape=(2, 3), dtype='U100')
     antigen_array[0, 0] = 'antigen_0_0'
     antigen_array[1, 2] = 'antigen_1_2'
-    constants.ANTIGEN_ARRAY = antigen_array
+    test_context = run_context.RunContext(
+        run_path='test_run_dir',
+        antigen_array=antigen_array,
+    )
     # Create instance
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     antigen_df = reporter.get_antigen_df()
     assert antigen_df.shape == (2, 3)
     assert list(antigen_df) == ['antigen', 'grid_row', 'grid_col']
@@ -73,9 +85,9 @@ def test_antigen_df():
            ['0_0_antigen_0_0', '1_2_antigen_1_2']
 
 
-def test_create_new_reports(report_test):
+def test_create_new_reports(report_test, test_context):
     # Check the dicts that will be reports
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     reporter.create_new_reports()
     assert list(reporter.report_int) == [
         '0_0_antigen_0_0',
@@ -89,26 +101,26 @@ def test_create_new_reports(report_test):
     assert list(plate_df.index) == ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
 
 
-def test_load_existing_reports(report_test):
+def test_load_existing_reports(report_test, test_context):
     # Write od, intensity and background reports
     antigen_names = ['0_0_antigen_0_0', '1_2_antigen_1_2']
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_intensities.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_intensities.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_backgrounds.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_backgrounds.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_ODs.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_ODs.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
     # Load existing reports and make sure they're the same
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     reporter.load_existing_reports()
     for antigen_name in antigen_names:
         int_df = reporter.report_int[antigen_name]
@@ -119,110 +131,110 @@ def test_load_existing_reports(report_test):
         od_df.equals(report_test[antigen_name])
 
 
-def test_load_missing_reports(report_test):
+def test_load_missing_reports(report_test, test_context):
     # Make sure we get an assertion error
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     with pytest.raises(AssertionError):
         reporter.load_existing_reports()
 
 
-def test_load_missing_int_reports(report_test):
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_ODs.xlsx')
+def test_load_missing_int_reports(report_test, test_context):
+    xlsx_path = os.path.join(test_context.run_path, 'median_ODs.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in ['0_0_antigen_0_0', '1_2_antigen_1_2']:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
     # Make sure we get an assertion error
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     with pytest.raises(AssertionError):
         reporter.load_existing_reports()
 
 
-def test_load_missing_bg_reports(report_test):
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_ODs.xlsx')
+def test_load_missing_bg_reports(report_test, test_context):
+    xlsx_path = os.path.join(test_context.run_path, 'median_ODs.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in ['0_0_antigen_0_0', '1_2_antigen_1_2']:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_intensities.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_intensities.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in ['0_0_antigen_0_0', '1_2_antigen_1_2']:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
     # Make sure we get an assertion error
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     with pytest.raises(AssertionError):
         reporter.load_existing_reports()
 
 
-def test_load_existing_reports_wrong_antigens_od(report_test):
+def test_load_existing_reports_wrong_antigens_od(report_test, test_context):
     # Write od, intensity and background reports
     antigen_names = ['0_0_antigen_0_0', '1_2_antigen_1_2']
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_intensities.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_intensities.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_backgrounds.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_backgrounds.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_ODs.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_ODs.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name + 'wrong')
     # Make sure we get an assertion error
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     with pytest.raises(AssertionError):
         reporter.load_existing_reports()
 
 
-def test_load_existing_reports_wrong_antigens_int(report_test):
+def test_load_existing_reports_wrong_antigens_int(report_test, test_context):
     # Write od, intensity and background reports
     antigen_names = ['0_0_antigen_0_0', '1_2_antigen_1_2']
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_intensities.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_intensities.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name + 'wrong')
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_backgrounds.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_backgrounds.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_ODs.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_ODs.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
     # Make sure we get an assertion error
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     with pytest.raises(AssertionError):
         reporter.load_existing_reports()
 
 
-def test_load_existing_reports_wrong_antigens_bg(report_test):
+def test_load_existing_reports_wrong_antigens_bg(report_test, test_context):
     # Write od, intensity and background reports
     antigen_names = ['0_0_antigen_0_0', '1_2_antigen_1_2']
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_intensities.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_intensities.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name + 'wrong')
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_backgrounds.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_backgrounds.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
-    xlsx_path = os.path.join(constants.RUN_PATH, 'median_ODs.xlsx')
+    xlsx_path = os.path.join(test_context.run_path, 'median_ODs.xlsx')
     with pd.ExcelWriter(xlsx_path) as writer:
         for antigen_name in antigen_names:
             sheet_df = report_test[antigen_name]
             sheet_df.to_excel(writer, sheet_name=antigen_name)
     # Make sure we get an assertion error
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     with pytest.raises(AssertionError):
         reporter.load_existing_reports()
 
@@ -254,9 +266,12 @@ def test_assign_well_to_plate():
     antigen_array = np.empty(shape=(2, 3), dtype='U100')
     antigen_array[0, 0] = 'antigen_0_0'
     antigen_array[1, 2] = 'antigen_1_2'
-    constants.ANTIGEN_ARRAY = antigen_array
+    test_context = run_context.RunContext(
+        run_path='test_run_dir',
+        antigen_array=antigen_array,
+    )
     # Assign wells to plate and check values
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     reporter.create_new_reports()
     reporter.assign_well_to_plate(well_name=well_name, spots_df=spots_df)
     assert list(reporter.report_int['0_0_antigen_0_0']) ==\
@@ -274,11 +289,13 @@ def test_assign_well_to_plate():
 
 def test_write_reports(tmpdir_factory):
     output_dir = tmpdir_factory.mktemp("output_dir")
-    constants.RUN_PATH = output_dir
     antigen_array = np.empty(shape=(2, 3), dtype='U100')
     antigen_array[0, 0] = 'antigen_0_0'
     antigen_array[1, 2] = 'antigen_1_2'
-    constants.ANTIGEN_ARRAY = antigen_array
+    test_context = run_context.RunContext(
+        run_path=str(output_dir),
+        antigen_array=antigen_array,
+    )
     # Create fake spots dataframe
     df_cols = ['grid_row', 'grid_col', 'intensity_median', 'bg_median', 'od_norm']
     spots_df = pd.DataFrame(columns=df_cols)
@@ -295,7 +312,7 @@ def test_write_reports(tmpdir_factory):
               'od_norm': .3}
     spots_df = spots_df.append(df_row, ignore_index=True)
     # Create report instance and write a few wells
-    reporter = report.ReportWriter()
+    reporter = report.ReportWriter(test_context)
     reporter.create_new_reports()
     reporter.assign_well_to_plate('C11', spots_df)
     reporter.assign_well_to_plate('D4', spots_df)
@@ -311,3 +328,30 @@ def test_write_reports(tmpdir_factory):
     assert report_od['1_2_antigen_1_2'].at['D', '4'] == .3
     assert report_od['0_0_antigen_0_0'].at['A', '7'] == .75
     assert report_od['1_2_antigen_1_2'].at['A', '7'] == 10.
+
+
+def test_assign_well_to_384_plate():
+    spots_df = pd.DataFrame({
+        'grid_row': [0, 1],
+        'grid_col': [0, 2],
+        'intensity_median': [1., .1],
+        'bg_median': [.5, .2],
+        'od_norm': [.75, .3],
+    })
+    antigen_array = np.empty(shape=(2, 3), dtype='U100')
+    antigen_array[0, 0] = 'antigen_0_0'
+    antigen_array[1, 2] = 'antigen_1_2'
+    test_context = run_context.RunContext(
+        run_path='test_run_dir',
+        antigen_array=antigen_array,
+        plate_geometry=plate_geometry.PlateGeometry.from_format(384),
+    )
+    reporter = report.ReportWriter(test_context)
+    reporter.create_new_reports()
+    reporter.assign_well_to_plate(well_name='P24', spots_df=spots_df)
+    plate_df = reporter.report_od['1_2_antigen_1_2']
+    assert plate_df.shape == (16, 24)
+    assert plate_df.at['P', '24'] == .3
+    assert reporter.report_int['0_0_antigen_0_0'].at['P', '24'] == 1.
+    with pytest.raises(ValueError):
+        reporter.assign_well_to_plate(well_name='Q1', spots_df=spots_df)
@@ -0,0 +1,99 @@
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+import array_analyzer.extract.constants as constants
+import array_analyzer.load.well_cache as well_cache
+
+
+@pytest.fixture
+def spots_df():
+    spots_df = pd.DataFrame({
+        'grid_row': [0, 0, 1],
+        'grid_col': [0, 1, 0],
+        'intensity_median': [.1, np.float64(1 / 3), .3],
+        'bg_median': [.5, .6, np.nan],
+        'od_norm': [.2, .3, .4],
+    })
+    return spots_df
+
+
+def test_hash_file(image_dir):
+    hash_a1 = well_cache.hash_file(os.path.join(image_dir, 'A1.png'))
+    hash_a2 = well_cache.hash_file(os.path.join(image_dir, 'A2.png'))
+    hash_b11 = well_cache.hash_file(os.path.join(image_dir, 'B11.png'))
+    assert hash_a1 == hash_a2
+    assert hash_a1 != hash_b11
+
+
+def test_hash_params():
+    antigen_array = np.empty(shape=(2, 3), dtype='U100')
+    antigen_array[0, 0] = 'antigen_0_0'
+    params = {'rows': 2, 'columns': 3, 'pixel_size': .0049}
+    hash_1 = well_cache.hash_params(
+        'array_fit', params, [np.int64(0), np.int64(5)], antigen_array,
+    )
+    hash_2 = well_cache.hash_params(
+        'array_fit', dict(params), [0, 5], antigen_array.copy(),
+    )
+    assert hash_1 == hash_2
+    hash_3 = well_cache.hash_params('array_interp', params, [0, 5], antigen_array)
+    assert hash_1 != hash_3
+    params['pixel_size'] = .00185
+    hash_4 = well_cache.hash_params('array_fit', params, [0, 5], antigen_array)
+    assert hash_1 != hash_4
+    hash_5 = well_cache.hash_params(
+        'array_fit', params, [0, 5], antigen_array, background='polynomial',
+    )
+    assert hash_4 == hash_5
+    hash_6 = well_cache.hash_params(
+        'array_fit', params, [0, 5], antigen_array, background='robust',
+    )
+    assert hash_4 != hash_6
+
+
+def test_save_load(tmpdir_factory, spots_df):
+    run_dir = tmpdir_factory.mktemp("run_dir")
+    cache = well_cache.WellCache(run_dir, param_hash='params')
+    assert os.path.isdir(os.path.join(run_dir, constants.CACHE_DIR_NAME))
+    assert cache.load('B12', 'image') is None
+    cache.save('B12', 'image', spots_df)
+    cached_df = cache.load('B12', 'image')
+    assert list(cached_df) == list(spots_df)
+    pd.testing.assert_frame_equal(cached_df, spots_df)
+
+
+def test_load_changed(tmpdir_factory, spots_df):
+    run_dir = tmpdir_factory.mktemp("run_dir")
+    cache = well_cache.WellCache(run_dir, param_hash='params')
+    cache.save('C3', 'image', spots_df)
+    # Changed image
+    assert cache.load('C3', 'other_image') is None
+    # Changed parameters
+    cache = well_cache.WellCache(run_dir, param_hash='other_params')
+    assert cache.load('C3', 'image') is None
+
+
+def test_save_failed(tmpdir_factory, spots_df):
+    run_dir = tmpdir_factory.mktemp("run_dir")
+    cache = well_cache.WellCache(run_dir, param_hash='params')
+    assert not cache.is_failed('A1', 'image')
+    cache.save_failed('A1', 'image', reason='registration')
+    assert cache.is_failed('A1', 'image')
+    assert cache.load('A1', 'image') is None
+    # Image changed since failure
+    assert not cache.is_failed('A1', 'other_image')
+    # Well succeeds on rerun
+    cache.save('A1', 'image', spots_df)
+    assert not cache.is_failed('A1', 'image')
+    # Writes are atomic, no temporary files are left
+    assert os.listdir(cache.cache_dir) == ['A1.json']
+
+
+def test_load_corrupt(tmpdir_factory, spots_df):
+    run_dir = tmpdir_factory.mktemp("run_dir")
+    cache = well_cache.WellCache(run_dir, param_hash='params')
+    with open(os.path.join(cache.cache_dir, 'D4.json'), 'w') as f:
+        f.write('{"status": "do')
+    assert cache.load('D4', 'image') is None
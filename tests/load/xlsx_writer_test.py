@@ -0,0 +1,60 @@
+import collections
+import numpy as np
+import os
+import pandas as pd
+
+import array_analyzer.load.xlsx_writer as xlsx_writer
+
+
+def test_write_sheets(tmpdir_factory):
+    output_dir = tmpdir_factory.mktemp("output_dir")
+    xlsx_path = os.path.join(output_dir, 'test.xlsx')
+    plate_df = pd.DataFrame(
+        None,
+        index=['A', 'B'],
+        columns=['1', '2', '3'],
+    )
+    plate_df.at['A', '2'] = .75
+    plate_df.at['B', '3'] = 10
+    spots_df = pd.DataFrame({
+        'grid_row': np.array([0, 1], dtype=np.int64),
+        'antigen': ['a', 'b'],
+        'od_norm': np.array([.5, np.nan], dtype=np.float32),
+    })
+    sheets = collections.OrderedDict()
+    sheets['plate'] = plate_df
+    sheets['spots'] = spots_df
+    xlsx_writer.write_sheets(xlsx_path, sheets)
+    assert os.listdir(output_dir) == ['test.xlsx']
+    # Read back like the reports are read
+    read_sheets = pd.read_excel(xlsx_path, sheet_name=None, index_col=0)
+    assert list(read_sheets) == ['plate', 'spots']
+    read_plate = read_sheets['plate']
+    assert list(read_plate.index) == ['A', 'B']
+    assert read_plate.shape == (2, 3)
+    assert read_plate.iat[0, 1] == .75
+    assert read_plate.iat[1, 2] == 10
+    assert np.isnan(read_plate.iat[0, 0])
+    read_spots = read_sheets['spots']
+    assert list(read_spots) == ['grid_row', 'antigen', 'od_norm']
+    assert list(read_spots['grid_row']) == [0, 1]
+    assert list(read_spots['antigen']) == ['a', 'b']
+    assert read_spots.at[0, 'od_norm'] == .5
+    assert np.isnan(read_spots.at[1, 'od_norm'])
+
+
+def test_write_sheets_matches_pandas(tmpdir_factory):
+    output_dir = tmpdir_factory.mktemp("output_dir")
+    df = pd.DataFrame(
+        np.random.RandomState(0).rand(6, 4),
+        columns=['a', 'b', 'c', 'd'],
+    )
+    pandas_path = os.path.join(output_dir, 'pandas.xlsx')
+    with pd.ExcelWriter(pandas_path) as writer:
+        df.to_excel(writer, sheet_name='well')
+    xlsx_path = os.path.join(output_dir, 'stream.xlsx')
+    xlsx_writer.write_sheets(xlsx_path, {'well': df})
+    pd.testing.assert_frame_equal(
+        pd.read_excel(xlsx_path, sheet_name='well', index_col=0),
+        pd.read_excel(pandas_path, sheet_name='well', index_col=0),
+    )
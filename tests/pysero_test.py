@@ -1,6 +1,8 @@
 import argparse
 import os
 import pytest
+import subprocess
+import sys
 from unittest.mock import patch
 
 import multisero as multisero
@@ -57,6 +59,19 @@ def test_run_multisero_analyze(tmpdir_factory):
     args.analyze_od = True
     args.rerun = False
     args.load_report = True
+    args.resume = False
+    args.batch = False
+    args.watch = False
+    args.serve = False
+    args.background = 'polynomial'
+    args.debug_nth = None
+    args.debug_fraction = None
+    args.debug_failed = False
+    args.debug_outliers = False
+    args.debug_montage = False
+    args.report_store = False
+    args.quick_look = False
+    args.nbr_workers = None
     with pytest.raises(OSError):
         multisero.run_multisero(args)
     # Check that run path is created and log file is written
@@ -65,3 +80,51 @@ def test_run_multisero_analyze(tmpdir_factory):
     output_subdir = os.path.join(output_dir, output_subdir[0])
     log_file = os.listdir(output_subdir)
     assert log_file[0] == 'multisero.log'
+
+
+def test_run_batch_debug_outliers(tmpdir):
+    manifest_path = os.path.join(tmpdir, 'manifest.csv')
+    with open(manifest_path, 'w') as f:
+        f.write('directory\n')
+    with patch('argparse._sys.argv',
+               ['python',
+                '-e',
+                '--batch',
+                '--input', manifest_path,
+                '--output', str(tmpdir),
+                '--debug',
+                '--debug_outliers']):
+        args = multisero.parse_args()
+    with pytest.raises(ValueError):
+        multisero.run_multisero(args)
+
+
+def test_lazy_imports():
+    # The CLI only imports workflows and their dependencies when they're run
+    code = "import sys; modules = set(sys.modules); import multisero; " \
+           "print(' '.join(set(sys.modules) - modules))"
+    modules = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout.decode().split()
+    assert 'multisero' in modules
+    for module in ['cv2', 'skimage', 'scipy', 'pandas', 'matplotlib',
+                   'seaborn', 'array_analyzer.workflows.registration_workflow',
+                   'interpretation.od_analyzer']:
+        assert module not in modules
+
+
+def test_import_time():
+    # Startup budget for importing the CLI, in microseconds
+    startup_budget = 200000
+    import_times = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import multisero'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stderr=subprocess.PIPE,
+        check=True,
+    ).stderr.decode().splitlines()
+    # Last line is the cumulative import time of multisero
+    cumulative_time = int(import_times[-1].split('|')[1])
+    assert cumulative_time < startup_budget
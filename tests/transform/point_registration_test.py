@@ -2,6 +2,7 @@ import numpy as np
 import pytest
 
 import array_analyzer.extract.constants as constants
+import array_analyzer.extract.run_context as run_context
 import array_analyzer.transform.point_registration as registration
 
 
@@ -11,19 +12,21 @@ def register_inst():
     spot_coords = np.array(
         [[18, 51], [10, 10], [16, 20], [22, 20], [29, 41], [31, 59]],
         ).astype(np.float32)
-    fiducials_idx = [1, 3, 5]
-    constants.params = {
-        'rows': 2,
-        'columns': 3,
-    }
-    constants.SPOT_DIST_PIX = 10
+    test_context = run_context.RunContext(
+        params={
+            'rows': 2,
+            'columns': 3,
+        },
+        fiducials_idx=[1, 3, 5],
+        spot_dist_pix=10,
+    )
     constants.NBR_PARTICLES = 100
     constants.STDS = [1, 1, 1, 1]
 
     register_inst = registration.ParticleFilter(
         spot_coords=spot_coords,
         im_shape=im_shape,
-        fiducials_idx=fiducials_idx,
+        run_context=test_context,
         random_seed=42,
     )
     return register_inst
@@ -1,3 +1,4 @@
+import cv2 as cv
 import numpy as np
 import os
 import pytest
@@ -51,6 +52,33 @@ def test_get_image_paths(image_dir):
         assert im_name == key + '.png'
 
 
+def test_get_384_image_paths(tmpdir_factory):
+    input_dir = tmpdir_factory.mktemp("input_dir")
+    im = np.zeros((5, 10), dtype=np.uint8)
+    for well_name in ['P24', 'A2', 'not_a_well', 'C10', 'C3']:
+        cv.imwrite(os.path.join(input_dir, well_name + '.png'), im)
+    well_images = io_utils.get_image_paths(input_dir)
+    assert list(well_images) == ['A2', 'C3', 'C10', 'P24']
+
+
+def test_get_image_paths_suffix(tmpdir_factory):
+    input_dir = tmpdir_factory.mktemp("input_dir")
+    im = np.zeros((5, 10), dtype=np.uint8)
+    for im_name in ['B12_xxx', 'A2', 'A2_bright', 'C123', 'Blank']:
+        cv.imwrite(os.path.join(input_dir, im_name + '.png'), im)
+    well_images = io_utils.get_image_paths(input_dir)
+    assert list(well_images) == ['A2', 'B12']
+    assert os.path.basename(well_images['A2']) == 'A2.png'
+    assert os.path.basename(well_images['B12']) == 'B12_xxx.png'
+
+
+def test_find_image_paths_empty(tmpdir_factory):
+    input_dir = tmpdir_factory.mktemp("input_dir")
+    assert io_utils.find_image_paths(input_dir) == {}
+    with pytest.raises(AssertionError):
+        io_utils.get_image_paths(input_dir)
+
+
 def test_get_mm_image_paths(micromanager_dir):
     well_images = io_utils.get_image_paths(micromanager_dir)
     assert len(well_images) == 4
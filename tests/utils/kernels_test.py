@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+import array_analyzer.extract.constants as constants
+import array_analyzer.utils.kernels as kernels
+
+
+@pytest.fixture
+def particle_data():
+    np.random.seed(3)
+    particles = np.random.randn(600, 4) * [5, 5, 2, .01] + [0, 0, 0, 1]
+    fiducial_coords = np.array([[20, 40], [20, 60], [30, 40], [30, 60]], dtype=np.float64)
+    spot_coords = np.random.rand(30, 2) * 80
+    return particles, fiducial_coords, spot_coords
+
+
+@pytest.fixture
+def numba_kernels(monkeypatch):
+    pytest.importorskip('numba')
+    monkeypatch.setenv(constants.KERNELS_ENV, 'numba')
+    assert kernels.use_numba()
+
+
+def test_use_numba_reference():
+    # conftest forces reference kernels
+    assert not kernels.use_numba()
+
+
+def test_use_numba_not_installed(monkeypatch):
+    # Failed import is remembered, the environment variable is read per call
+    monkeypatch.setattr(kernels, '_numba_kernels', None)
+    monkeypatch.setenv(constants.KERNELS_ENV, 'numba')
+    assert not kernels.use_numba()
+
+
+def test_get_numba_kernels_once():
+    numba_kernels = kernels._get_numba_kernels()
+    assert kernels._numba_kernels is not kernels._NOT_IMPORTED
+    assert kernels._get_numba_kernels() is numba_kernels
+
+
+@pytest.mark.parametrize('nbr_outliers', [0, 1])
+def test_particle_dists(particle_data, nbr_outliers):
+    particles, fiducial_coords, spot_coords = particle_data
+    dists = kernels.particle_dists(
+        particles,
+        fiducial_coords,
+        spot_coords,
+        nbr_outliers,
+    )
+    assert dists.shape == (600,)
+    # Compare to transforming one particle at a time
+    for p in [0, 255, 256, 599]:
+        particle = particles[p]
+        a = particle[3] * np.cos(particle[2] * np.pi / 180)
+        b = particle[3] * np.sin(particle[2] * np.pi / 180)
+        t_matrix = np.array([[a, b], [-b, a]])
+        trans_coords = fiducial_coords @ t_matrix.T + particle[:2]
+        sq_dists = np.sum((trans_coords[:, np.newaxis] - spot_coords) ** 2, axis=2)
+        min_dists = np.sort(np.min(sq_dists, axis=1))
+        expected = np.sum(min_dists[:min_dists.shape[0] - nbr_outliers])
+        np.testing.assert_allclose(dists[p], expected)
+
+
+def test_block_medians():
+    im = np.arange(5 * 7, dtype=np.uint16).reshape(5, 7)
+    medians = kernels.block_medians(im, 2)
+    # Incomplete blocks are ignored, block (x, y) at y * nbr_blocks_x + x
+    expected = [np.median(im[x * 2:x * 2 + 2, y * 2:y * 2 + 2])
+                for y in range(3) for x in range(2)]
+    np.testing.assert_array_equal(medians, expected)
+
+
+def test_block_medians_exclude():
+    im = np.arange(4 * 6, dtype=np.float64).reshape(4, 6)
+    exclude = np.zeros(im.shape, dtype=bool)
+    exclude[0, :2] = True
+    exclude[2:, 4:] = True
+    exclude[3, 5] = False
+    medians = kernels.block_medians(im, 2, exclude=exclude, min_count=2)
+    np.testing.assert_array_equal(medians[:3], [6.5, 15.5, 5.5])
+    # Blocks with too few pixels left have no median
+    assert np.isnan(medians[5])
+
+
+def test_segment_stats():
+    values = np.random.rand(1000)
+    segment_ids = np.random.randint(0, 5, 1000)
+    # Segment 3 has an even number of values, segment 4 is empty
+    segment_ids[segment_ids == 4] = 2
+    segment_ids[np.where(segment_ids == 3)[0][:np.sum(segment_ids == 3) % 2]] = 0
+    stats = kernels.segment_stats(values, segment_ids, 5)
+    for segment_id in range(4):
+        segment_values = values[segment_ids == segment_id]
+        assert stats[segment_id, 0] == pytest.approx(np.mean(segment_values))
+        assert stats[segment_id, 1] == np.median(segment_values)
+    assert np.all(np.isnan(stats[4]))
+
+
+def test_spot_stats():
+    images = [np.arange(9.).reshape(3, 3), np.arange(20.).reshape(4, 5)]
+    backgrounds = [np.ones((3, 3)), np.arange(20.).reshape(4, 5) / 2]
+    masks = [np.eye(3, dtype=np.uint8), np.zeros((4, 5), dtype=np.uint8)]
+    masks[1][1:3, 1:4] = 1
+    stats = kernels.spot_stats(images, backgrounds, masks)
+    np.testing.assert_array_equal(stats[0], [4., 4., 1., 1.])
+    np.testing.assert_array_equal(stats[1], [9.5, 9.5, 4.75, 4.75])
+
+
+def test_numba_kernels(numba_kernels, particle_data, monkeypatch):
+    particles, fiducial_coords, spot_coords = particle_data
+    im = np.random.randint(0, 4096, (300, 260)).astype(np.uint16)
+    images = [np.random.rand(9, 9), np.random.rand(11, 7)]
+    backgrounds = [np.random.rand(9, 9), np.random.rand(11, 7)]
+    masks = [np.random.rand(9, 9) > .5, np.random.rand(11, 7) > .3]
+    numba_dists = kernels.particle_dists(particles, fiducial_coords, spot_coords, 1)
+    numba_medians = kernels.block_medians(im, 64)
+    exclude = np.random.rand(*im.shape) > .5
+    exclude[:64, :64] = True
+    numba_masked_medians = kernels.block_medians(im, 64, exclude, min_count=100)
+    numba_stats = kernels.spot_stats(images, backgrounds, masks)
+    # Compare to reference kernels
+    monkeypatch.setenv(constants.KERNELS_ENV, 'numpy')
+    np.testing.assert_allclose(
+        numba_dists,
+        kernels.particle_dists(particles, fiducial_coords, spot_coords, 1),
+    )
+    np.testing.assert_array_equal(numba_medians, kernels.block_medians(im, 64))
+    np.testing.assert_array_equal(
+        numba_masked_medians,
+        kernels.block_medians(im, 64, exclude, min_count=100),
+    )
+    np.testing.assert_allclose(
+        numba_stats,
+        kernels.spot_stats(images, backgrounds, masks),
+    )
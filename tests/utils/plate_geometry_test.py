@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import array_analyzer.utils.plate_geometry as plate_geometry
+
+
+@pytest.mark.parametrize('plate_format,shape,last_well', [
+    (96, (8, 12), 'H12'),
+    (384, (16, 24), 'P24'),
+    (1536, (32, 48), 'AF48'),
+])
+def test_from_format(plate_format, shape, last_well):
+    plate = plate_geometry.PlateGeometry.from_format(plate_format)
+    assert plate.shape == shape
+    assert plate.nbr_wells == plate_format
+    assert plate.well_names()[-1] == last_well
+    assert plate.well_index(last_well) == plate_format - 1
+    assert plate.well_name(plate_format - 1) == last_well
+
+
+def test_from_format_invalid():
+    with pytest.raises(AssertionError):
+        plate_geometry.PlateGeometry.from_format(48)
+
+
+def test_parse_well_name():
+    assert plate_geometry.parse_well_name('A1') == (0, 0)
+    assert plate_geometry.parse_well_name('B12') == (1, 11)
+    assert plate_geometry.parse_well_name('Z3') == (25, 2)
+    assert plate_geometry.parse_well_name('AA1') == (26, 0)
+    assert plate_geometry.parse_well_name('AF48') == (31, 47)
+
+
+def test_parse_well_name_invalid():
+    with pytest.raises(ValueError):
+        plate_geometry.parse_well_name('1A')
+
+
+def test_well_sort_key():
+    well_names = ['AA1', 'B1', 'A10', 'Z2', 'A2']
+    assert sorted(well_names, key=plate_geometry.well_sort_key) == \
+        ['A2', 'A10', 'B1', 'Z2', 'AA1']
+
+
+def test_well_position_outside_plate():
+    plate = plate_geometry.PlateGeometry()
+    with pytest.raises(ValueError):
+        plate.well_position('I1')
+    with pytest.raises(ValueError):
+        plate.well_position('A13')
+
+
+def test_to_array():
+    plate = plate_geometry.PlateGeometry.from_format(384)
+    plate_array = plate.to_array(['A1', 'P24', 'C5'], [1., 2., 3.])
+    assert plate_array.shape == (16, 24)
+    assert plate_array[0, 0] == 1.
+    assert plate_array[15, 23] == 2.
+    assert plate_array[2, 4] == 3.
+    assert np.sum(np.isnan(plate_array)) == 384 - 3
+
+
+def test_to_df():
+    plate = plate_geometry.PlateGeometry(2, 3)
+    plate_df = plate.to_df(np.arange(6).reshape(2, 3))
+    assert list(plate_df.index) == ['A', 'B']
+    assert list(plate_df.columns) == ['1', '2', '3']
+    assert plate_df.at['B', '2'] == 4
@@ -0,0 +1,71 @@
+import concurrent.futures
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import types
+
+import array_analyzer.extract.constants as constants
+import array_analyzer.load.well_cache as well_cache
+import array_analyzer.workflows.batch_wf as batch_wf
+
+
+@pytest.fixture
+def plate_dirs(tmpdir_factory):
+    batch_dir = tmpdir_factory.mktemp("batch_dir")
+    for plate_name in ['plate1', 'plate2']:
+        os.makedirs(os.path.join(batch_dir, plate_name))
+    return str(batch_dir)
+
+
+def test_read_manifest_csv(plate_dirs):
+    constants.METADATA_FILE = 'multisero_output_data_metadata.xlsx'
+    manifest_path = os.path.join(plate_dirs, 'manifest.csv')
+    manifest_df = pd.DataFrame({
+        'directory': ['plate1', 'plate2'],
+        'metadata': ['other_metadata.xlsx', np.nan],
+    })
+    manifest_df.to_csv(manifest_path, index=False)
+    plates = batch_wf.read_manifest(manifest_path)
+    assert len(plates) == 2
+    assert plates[0]['input_dir'] == os.path.join(plate_dirs, 'plate1')
+    assert plates[0]['metadata'] == 'other_metadata.xlsx'
+    assert plates[1]['input_dir'] == os.path.join(plate_dirs, 'plate2')
+    assert plates[1]['metadata'] == constants.METADATA_FILE
+
+
+def test_read_manifest_missing_dir(plate_dirs):
+    manifest_path = os.path.join(plate_dirs, 'manifest.csv')
+    manifest_df = pd.DataFrame({'directory': ['plate1', 'plate3']})
+    manifest_df.to_csv(manifest_path, index=False)
+    with pytest.raises(IOError):
+        batch_wf.read_manifest(manifest_path)
+
+
+def test_read_manifest_no_directory(plate_dirs):
+    manifest_path = os.path.join(plate_dirs, 'manifest.csv')
+    manifest_df = pd.DataFrame({'plate': ['plate1', 'plate2']})
+    manifest_df.to_csv(manifest_path, index=False)
+    with pytest.raises(IOError):
+        batch_wf.read_manifest(manifest_path)
+
+
+
+def test_get_well_result_exception(plate_dirs):
+    im_path = os.path.join(plate_dirs, 'plate1', 'A1.png')
+    with open(im_path, 'wb') as f:
+        f.write(b'image')
+    task = {
+        'plate_idx': 1,
+        'well_name': 'A1',
+        'im_path': im_path,
+        'run_context': types.SimpleNamespace(input_dir=plate_dirs),
+    }
+    future = concurrent.futures.Future()
+    future.set_exception(ValueError("Worker failed"))
+    result = batch_wf.get_well_result(future, task)
+    assert result['plate_idx'] == 1
+    assert result['well_name'] == 'A1'
+    assert result['status'] == 'extraction'
+    assert result['spots_df'] is None
+    assert result['image_hash'] == well_cache.hash_file(im_path)
@@ -0,0 +1,133 @@
+import http.server
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import threading
+import urllib.error
+import urllib.request
+
+import array_analyzer.extract.constants as constants
+import array_analyzer.workflows.service_wf as service_wf
+
+
+class FakeService:
+
+    def __init__(self):
+        self.logger = logging.getLogger(constants.LOG_NAME)
+        self.jobs = []
+
+    def status(self):
+        return {'nbr_jobs': len(self.jobs)}
+
+    def extract_plate(self, job):
+        assert 'directory' in job, "Job has no plate 'directory'"
+        self.jobs.append(job)
+        return {'status': {'A1': 'done'}}
+
+    def extract_well(self, job):
+        raise RuntimeError("Worker died")
+
+
+@pytest.fixture
+def service_url():
+    service = FakeService()
+    handler = type('Handler', (service_wf.ServiceHandler,), {'service': service})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def request(url, job=None):
+    data = None
+    if job is not None:
+        data = json.dumps(job).encode('utf-8')
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_od_table():
+    antigen_df = pd.DataFrame({
+        'antigen': ['0_1_H1 HA', '1_0_H3 HA'],
+        'grid_row': [0, 1],
+        'grid_col': [1, 0],
+    }, dtype=object)
+    spots_df = pd.DataFrame({
+        'grid_row': [0, 0, 1, 0],
+        'grid_col': [0, 1, 1, 1],
+        'intensity_median': [.1, .2, .3, .4],
+        'bg_median': [.5, .6, .7, .8],
+        'od_norm': [1., 2., 3., 4.],
+    })
+    od_df = service_wf.od_table(
+        antigen_df,
+        ['A1', 'A2', 'B1'],
+        {'B1': spots_df, 'A1': spots_df.iloc[:2]},
+    )
+    assert list(od_df['well_name']) == ['A1', 'A1', 'B1', 'B1']
+    assert list(od_df['antigen']) == ['0_1_H1 HA', '1_0_H3 HA'] * 2
+    # First spot is used for duplicates, missing spots have no OD
+    np.testing.assert_array_equal(od_df['od_norm'], [2., np.nan, 2., np.nan])
+    assert od_df['bg_median'].iloc[0] == .6
+
+
+def test_od_table_empty():
+    antigen_df = pd.DataFrame({
+        'antigen': ['0_1_H1 HA'],
+        'grid_row': [0],
+        'grid_col': [1],
+    })
+    od_df = service_wf.od_table(antigen_df, ['A1'], {})
+    assert od_df.shape[0] == 0
+    assert 'od_norm' in od_df.columns
+
+
+def test_find_plate_dirs(tmpdir):
+    constants.METADATA_FILE = 'multisero_output_data_metadata.xlsx'
+    for plate_name in ['plate1', 'plate2']:
+        os.makedirs(os.path.join(tmpdir, plate_name))
+    open(os.path.join(tmpdir, 'plate2', constants.METADATA_FILE), 'w').close()
+    plate_dirs = service_wf.find_plate_dirs(str(tmpdir))
+    assert plate_dirs == [os.path.join(tmpdir, 'plate2')]
+
+
+def test_service_status(service_url):
+    code, response = request(service_url + '/status')
+    assert code == 200
+    assert response == {'nbr_jobs': 0}
+
+
+def test_service_plate(service_url):
+    code, response = request(service_url + '/plate', {'directory': 'plate1'})
+    assert code == 200
+    assert response == {'status': {'A1': 'done'}}
+    code, response = request(service_url + '/status')
+    assert response == {'nbr_jobs': 1}
+
+
+def test_service_invalid_job(service_url):
+    code, response = request(service_url + '/plate', {'plate': 'plate1'})
+    assert code == 400
+    assert response['error'].startswith("Job has no plate 'directory'")
+
+
+def test_service_failed_job(service_url):
+    code, response = request(service_url + '/well', {'directory': 'plate1'})
+    assert code == 500
+    assert response['error'] == 'Worker died'
+
+
+def test_service_unknown_path(service_url):
+    code, response = request(service_url + '/wells', {'directory': 'plate1'})
+    assert code == 404
+    code, response = request(service_url + '/plates')
+    assert code == 404
@@ -0,0 +1,62 @@
+import cv2 as cv
+import numpy as np
+import os
+import time
+
+import array_analyzer.workflows.watch_wf as watch_wf
+
+
+def write_im(input_dir, well_name, mtime):
+    im_path = os.path.join(input_dir, well_name + '.png')
+    cv.imwrite(im_path, np.zeros((5, 10), dtype=np.uint8))
+    os.utime(im_path, (mtime, mtime))
+    return im_path
+
+
+def test_watcher_poll(tmpdir):
+    input_dir = str(tmpdir)
+    watcher = watch_wf.ImageWatcher(input_dir, settle_time=10)
+    assert watcher.poll() == {}
+    old_time = time.time() - 60
+    a1_path = write_im(input_dir, 'A1', old_time)
+    b2_path = write_im(input_dir, 'B2', old_time)
+    write_im(input_dir, 'A10', time.time())
+    # Images are ready once they're unchanged between two polls
+    assert watcher.poll() == {}
+    new_images = watcher.poll()
+    assert list(new_images) == ['A1', 'B2']
+    assert new_images['A1'] == a1_path
+    assert new_images['B2'] == b2_path
+    assert watcher.ready_wells == {'A1', 'B2'}
+    # Ready images aren't returned again, A10 hasn't settled
+    assert watcher.poll() == {}
+
+
+def test_watcher_changing_image(tmpdir):
+    input_dir = str(tmpdir)
+    watcher = watch_wf.ImageWatcher(input_dir, settle_time=0)
+    im_path = os.path.join(input_dir, 'A1.png')
+    with open(im_path, 'wb') as f:
+        f.write(b'\x89PNG')
+    assert watcher.poll() == {}
+    # Image is still being written
+    with open(im_path, 'ab') as f:
+        f.write(b'\x00' * 10)
+    assert watcher.poll() == {}
+    assert watcher.poll() == {'A1': im_path}
+
+
+def test_watcher_retry(tmpdir):
+    input_dir = str(tmpdir)
+    watcher = watch_wf.ImageWatcher(input_dir, settle_time=0)
+    im_path = write_im(input_dir, 'A1', time.time() - 60)
+    watcher.poll()
+    assert watcher.poll() == {'A1': im_path}
+    watcher.retry('A1')
+    assert watcher.ready_wells == set()
+    # Unchanged image that couldn't be read isn't returned again
+    watcher.poll()
+    assert watcher.poll() == {}
+    write_im(input_dir, 'A1', time.time() - 30)
+    watcher.poll()
+    assert watcher.poll() == {'A1': im_path}
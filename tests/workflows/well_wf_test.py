@@ -0,0 +1,67 @@
+import cv2 as cv
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+import array_analyzer.extract.constants as constants
+import array_analyzer.utils.plate_geometry as plate_geometry
+import array_analyzer.workflows.well_wf as well_wf
+
+
+def write_plate_info(plate_info_path, plate, notes=False):
+    """
+    Write a Plate_Info file with a sample and a dilution sheet, the first
+    well is a blank.
+    """
+    sample_df = plate.to_df().astype(object)
+    sample_df.loc[:, :] = 'serum'
+    sample_df.iloc[0, 0] = 'Blank'
+    dilution_df = plate.to_df() + .01
+    if notes:
+        sample_df['notes'] = 'note'
+        sample_df.loc['comment'] = 'comment'
+    with pd.ExcelWriter(plate_info_path) as writer:
+        sample_df.to_excel(writer, sheet_name='sample')
+        dilution_df.to_excel(writer, sheet_name='dilution')
+
+
+@pytest.mark.parametrize('plate_format', [96, 384])
+def test_get_plate_geometry(tmpdir, plate_format):
+    plate = plate_geometry.PlateGeometry.from_format(plate_format)
+    plate_info_path = os.path.join(tmpdir, 'Plate_Info.xlsx')
+    write_plate_info(plate_info_path, plate, notes=True)
+    assert well_wf.get_plate_geometry(plate_info_path).shape == plate.shape
+
+
+def test_get_plate_geometry_invalid(tmpdir):
+    plate_info_path = os.path.join(tmpdir, 'Plate_Info.xlsx')
+    write_plate_info(plate_info_path, plate_geometry.PlateGeometry(8, 10))
+    with pytest.raises(IOError):
+        well_wf.get_plate_geometry(plate_info_path)
+
+
+def test_well_analysis_384(tmpdir, monkeypatch):
+    input_dir = str(tmpdir.mkdir('input'))
+    run_path = str(tmpdir.mkdir('output'))
+    monkeypatch.setattr(constants, 'METADATA_FILE', 'well')
+    monkeypatch.setattr(constants, 'RUN_PATH', run_path)
+    monkeypatch.setattr(constants, 'DEBUG', False)
+    plate = plate_geometry.PlateGeometry.from_format(384)
+    write_plate_info(os.path.join(input_dir, 'Plate_Info.xlsx'), plate, notes=True)
+    for well_name, intensity in [('A1', 200), ('C10', 100), ('P24', 20)]:
+        cv.imwrite(
+            os.path.join(input_dir, well_name + '.png'),
+            np.full((50, 60), intensity, dtype=np.uint8),
+        )
+    well_wf.well_analysis(input_dir, run_path, method='crop')
+    results = pd.read_excel(
+        os.path.join(run_path, 'intensities.xlsx'),
+        sheet_name=None,
+        index_col=0,
+    )
+    assert results['sample'].shape == (16, 24)
+    assert results['intensity'].shape == (16, 24)
+    assert results['intensity'].iloc[15, 23] == 20
+    assert results['intensity'].iloc[2, 9] == 100
+    np.testing.assert_allclose(results['od'].iloc[15, 23], 1.)